@@ -0,0 +1,8 @@
+"""
+Offline benchmarks for the bot's hot paths.
+
+Everything runs in-process against the fakes in benchmarks.fakes (no gateway,
+no network) and a throwaway SQLite file. Run with:
+
+    python -m benchmarks.run --sizes 100,5000,50000 --json results.json
+"""
@@ -0,0 +1,247 @@
+import asyncio
+import itertools
+from collections import Counter
+
+import discord
+
+class HTTPRecorder:
+    """
+    Counts the Discord REST calls the fakes would have made, keyed by route
+    template (e.g. "PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}").
+    latency, if set, is awaited on every call so the bot yields like it would
+    on a real request.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls.clear()
+
+    async def request(self, method, route):
+        self.calls[f"{method} {route}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+_ids = itertools.count(1_000_000_000_000_000)
+
+def snowflake():
+    return next(_ids)
+
+class FakeRole:
+    def __init__(self, guild, name, id=None, default=False):
+        self.guild = guild
+        self.id = id or snowflake()
+        self.name = name
+        self.mention = f"<@&{self.id}>"
+        self._default = default
+
+    def is_default(self):
+        return self._default
+
+    @property
+    def members(self):
+        return [m for m in self.guild.members if self in m.roles]
+
+    def __repr__(self):
+        return f"<FakeRole {self.name}>"
+
+class FakeMember:
+    def __init__(self, guild, name, roles=(), manage_roles=False, id=None):
+        self.guild = guild
+        self.id = id or snowflake()
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{self.id}>"
+        self.bot = False
+        self.roles = [guild.default_role, *roles]
+        self.guild_permissions = discord.Permissions(manage_roles=manage_roles)
+
+    @property
+    def top_role(self):
+        return self.roles[-1]
+
+    async def add_roles(self, *roles, reason=None, atomic=True):
+        for role in roles:
+            await self.guild.http.request("PUT", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles, reason=None, atomic=True):
+        for role in roles:
+            await self.guild.http.request("DELETE", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+            if role in self.roles:
+                self.roles.remove(role)
+
+    async def edit(self, *, reason=None, **fields):
+        await self.guild.http.request("PATCH", "/guilds/{guild_id}/members/{user_id}")
+        if 'roles' in fields:
+            self.roles = [self.guild.default_role, *(r for r in fields['roles'] if not r.is_default())]
+        if 'nick' in fields:
+            self.display_name = fields['nick'] or self.name
+
+    async def send(self, content=None, **kwargs):
+        await self.guild.http.request("POST", "/channels/{channel_id}/messages")
+        return FakeMessage(None, self, content)
+
+    def __repr__(self):
+        return f"<FakeMember {self.name}>"
+
+class FakeMessage:
+    def __init__(self, channel, author, content="", id=None):
+        self.id = id or snowflake()
+        self.channel = channel
+        self.guild = channel.guild if channel else None
+        self.author = author
+        self.content = content or ""
+        self.embeds = []
+
+    @property
+    def _http(self):
+        return (self.guild or self.author.guild).http
+
+    async def add_reaction(self, emoji):
+        await self._http.request("PUT", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me")
+
+    async def edit(self, **kwargs):
+        await self._http.request("PATCH", "/channels/{channel_id}/messages/{message_id}")
+        return self
+
+    async def delete(self, *, delay=None):
+        await self._http.request("DELETE", "/channels/{channel_id}/messages/{message_id}")
+
+class FakeTextChannel:
+    def __init__(self, guild, name, id=None):
+        self.guild = guild
+        self.id = id or snowflake()
+        self.name = name
+        self.mention = f"<#{self.id}>"
+
+    async def send(self, content=None, *, delete_after=None, **kwargs):
+        await self.guild.http.request("POST", "/channels/{channel_id}/messages")
+        message = FakeMessage(self, self.guild.me, content)
+        if delete_after is not None:
+            # discord.py deletes it later with one more call; count it now
+            await self.guild.http.request("DELETE", "/channels/{channel_id}/messages/{message_id}")
+        return message
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, self.guild.me, id=message_id)
+
+class FakeGuild:
+    """A guild with `size` members, all holding the permitted role, and the attendance roles."""
+
+    def __init__(self, size, http=None, name=None):
+        self.http = http or HTTPRecorder()
+        self.id = snowflake()
+        self.name = name or f"bench-{size}"
+        self.icon = None
+        self.owner_id = None
+        self.default_role = FakeRole(self, "@everyone", id=self.id, default=True)
+        self._roles = {self.default_role.id: self.default_role}
+        self._channels = {}
+        self._members = {}
+        self.me = FakeMember(self, "bench-bot", manage_roles=True)
+        self.present_role = self.add_role("Present")
+        self.absent_role = self.add_role("Absent")
+        self.excused_role = self.add_role("Excused")
+        self.permitted_role = self.add_role("Staff")
+        self.channel = self.add_channel("attendance")
+        self.system_channel = self.channel
+        for i in range(size):
+            self.add_member(f"member-{i:06d}", roles=(self.permitted_role,))
+
+    def add_role(self, name):
+        role = FakeRole(self, name)
+        self._roles[role.id] = role
+        return role
+
+    def add_channel(self, name):
+        channel = FakeTextChannel(self, name)
+        self._channels[channel.id] = channel
+        return channel
+
+    def add_member(self, name, roles=(), manage_roles=False):
+        member = FakeMember(self, name, roles, manage_roles)
+        self._members[member.id] = member
+        return member
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def roles(self):
+        return list(self._roles.values())
+
+    def get_member(self, user_id):
+        return self._members.get(user_id)
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+class FakeContext:
+    """Just enough of commands.Context for helpers such as update_user_status."""
+
+    def __init__(self, guild, author, channel=None):
+        self.guild = guild
+        self.author = author
+        self.channel = channel or guild.channel
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+class FakeInteractionResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        await self._interaction.guild.http.request("POST", "/interactions/{interaction_id}/{token}/callback")
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond()
+
+    async def defer(self, **kwargs):
+        await self._respond()
+
+    async def send_modal(self, modal):
+        await self._respond()
+
+    async def edit_message(self, **kwargs):
+        await self._respond()
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self._interaction.guild.http.request("POST", "/webhooks/{application_id}/{token}")
+
+class FakeInteraction:
+    """A button press by `user` in `guild`."""
+
+    def __init__(self, guild, user, client=None):
+        self.id = snowflake()
+        self.guild = guild
+        self.user = user
+        self.channel = guild.channel
+        self.client = client
+        self.type = discord.InteractionType.component
+        self.message = None
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from benchmarks import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(samples)))
+    return samples[min(rank, len(samples)) - 1]
+
+class SQLCounter:
+    """sqlite3 trace callback counting executed statements."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+class Bench:
+    """Runs the scenarios for one roster size against one fake guild."""
+
+    def __init__(self, bot, database, size, args, sql):
+        self.bot = bot
+        self.database = database
+        self.args = args
+        self.sql = sql
+        self.guild = fakes.FakeGuild(size, fakes.HTTPRecorder(args.http_latency_ms / 1000))
+        self.admin = self.guild.add_member("bench-admin", manage_roles=True)
+        self.members = [m for m in self.guild.members if m is not self.admin]
+        self.results = []
+
+    async def measure(self, scenario, op, ops, reset=None):
+        """Times `ops` calls of op(i); reset(), if given, runs untimed before each call."""
+        http = self.guild.http
+        sql_before = self.sql.count
+        http.reset()
+        samples = []
+        for i in range(ops):
+            if reset is not None:
+                await self._untraced(reset)
+            started = time.perf_counter()
+            await op(i)
+            samples.append(time.perf_counter() - started)
+            # Background DMs belong to the op that queued them
+            await self.bot.dm_outbox.join()
+        sql_count = self.sql.count - sql_before
+        self.bot.cancel_report_refresh(self.guild.id)
+
+        total = sum(samples)
+        samples.sort()
+        result = {
+            "scenario": scenario,
+            "roster": len(self.members),
+            "ops": ops,
+            "ops_per_sec": round(ops / total, 1) if total else None,
+            "p50_ms": round(percentile(samples, 50) * 1000, 4),
+            "p99_ms": round(percentile(samples, 99) * 1000, 4),
+            "sql_per_op": round(sql_count / ops, 2),
+            "discord_calls_per_op": round(http.total / ops, 2),
+            "discord_calls": dict(http.calls),
+        }
+        self.results.append(result)
+        return result
+
+    async def _untraced(self, func):
+        count = self.sql.count
+        calls = self.guild.http.calls.copy()
+        await func()
+        self.sql.count = count
+        self.guild.http.calls = calls
+
+    # --- state helpers (untimed) ---
+
+    async def configure(self, **fields):
+        await self.database.update_guild_config_async(self.guild.id, **fields)
+        self.bot.invalidate_message_triggers(self.guild.id)
+
+    async def clear_records(self):
+        await self.database.run_async(self.database.clear_attendance_records, self.guild.id)
+        self.bot.invalidate_record_models(self.guild.id)
+        for member in self.members:
+            member.roles = [self.guild.default_role, self.guild.permitted_role]
+
+    async def seed_records(self, status_of, age_hours=0):
+        """Gives every member a record (status_of(i) -> status) marked age_hours ago."""
+        marked = (datetime.datetime.now() - datetime.timedelta(hours=age_hours)).isoformat()
+        roles = {"present": self.guild.present_role, "absent": self.guild.absent_role,
+                 "excused": self.guild.excused_role}
+        records = {}
+        for i, member in enumerate(self.members):
+            status = status_of(i)
+            records[str(member.id)] = {"status": status, "timestamp": marked, "channel_id": self.guild.channel.id}
+            member.roles = [self.guild.default_role, self.guild.permitted_role, roles[status]]
+        await self.database.run_async(self.database.replace_all_records, self.guild.id, records)
+        self.bot.invalidate_record_models(self.guild.id)
+
+    async def reset_end_of_day(self):
+        await self.clear_records()
+        with self.database.get_pool().writer() as conn:
+            conn.execute('DELETE FROM eod_jobs WHERE guild_id = ?', (self.guild.id,))
+            conn.execute('DELETE FROM eod_job_members WHERE guild_id = ?', (self.guild.id,))
+        await self.configure(last_processed_date=None)
+
+    # --- scenarios ---
+
+    async def run(self):
+        bot, guild, args = self.bot, self.guild, self.args
+        roster = len(self.members)
+        marks = min(args.ops, roster)
+        await self.configure(
+            attendance_role_id=guild.present_role.id, absent_role_id=guild.absent_role.id,
+            excused_role_id=guild.excused_role.id, allowed_role_id=guild.permitted_role.id,
+            welcome_channel_id=guild.channel.id, report_channel_id=guild.channel.id,
+            attendance_mode='duration', attendance_expiry_hours=12,
+            allow_self_marking=1, require_admin_excuse=0)
+        await self.clear_records()
+
+        def message(i, content):
+            return fakes.FakeMessage(guild.channel, self.members[i % roster], content)
+
+        await self.measure("on_message:chatter",
+                           lambda i: bot.on_message(message(i, "good morning everyone")), args.ops)
+        await self.measure("on_message:present",
+                           lambda i: bot.on_message(message(i, "present")), marks)
+        await self.measure("on_message:present-repeat",
+                           lambda i: bot.on_message(message(i, "present")), marks)
+        await self.measure("on_message:excuse",
+                           lambda i: bot.on_message(message(i, "excuse doctor's appointment")), marks)
+
+        await self.clear_records()
+        view = bot.AttendanceView(bot.bot)
+        await self.measure("handle_attendance:present",
+                           lambda i: view.handle_attendance(fakes.FakeInteraction(guild, self.members[i]), "present"),
+                           marks)
+
+        ctx = fakes.FakeContext(guild, self.admin)
+        await self.measure("update_user_status:absent",
+                           lambda i: bot.update_user_status(ctx, self.members[i], "absent"), marks)
+
+        statuses = ("present", "absent", "excused")
+        await self.seed_records(lambda i: statuses[i % 3])
+        await self._untraced(lambda: bot.create_attendance_embed(guild))
+        await self.measure("create_attendance_embed:warm",
+                           lambda i: bot.create_attendance_embed(guild), args.ops)
+
+        async def drop_models():
+            bot.invalidate_record_models(guild.id)
+        await self.measure("create_attendance_embed:cold",
+                           lambda i: bot.create_attendance_embed(guild), args.passes, reset=drop_models)
+
+        # One expiry pass over a whole roster whose sessions are all due
+        await self.measure("process_due_expiries:duration",
+                           lambda i: bot.process_due_expiries([bot.EXPIRY_WAKEUP]), args.passes,
+                           reset=lambda: self.seed_records(lambda i: "present", age_hours=13))
+
+        # Window closed an hour ago with nobody marked: end-of-day marks the roster absent
+        now = datetime.datetime.now(bot.windows.PH_TZ)
+        await self.configure(attendance_mode='window',
+                             window_start_time=(now - datetime.timedelta(hours=3)).strftime("%H:%M"),
+                             window_end_time=(now - datetime.timedelta(hours=1)).strftime("%H:%M"))
+        await self.measure("process_window_transitions:end-of-day",
+                           lambda i: bot.process_window_transitions([guild.id]), args.passes,
+                           reset=self.reset_end_of_day)
+        await self.configure(attendance_mode='duration')
+        return self.results
+
+async def run_all(bot, database, args, sql):
+    database.init_db()
+    bot.bot._connection.user = types.SimpleNamespace(id=0, name="bench-bot")
+    # The debounced report publish is amortised across many marks; keep it out of per-op numbers
+    bot.REPORT_DEBOUNCE_SECONDS = 3600
+    guilds = {}
+    bot.bot.get_guild = guilds.get
+
+    results = []
+    for size in args.sizes:
+        started = time.perf_counter()
+        bench = Bench(bot, database, size, args, sql)
+        guilds[bench.guild.id] = bench.guild
+        results.extend(await bench.run())
+        print(f"roster {size}: done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    await bot.dm_outbox.stop()
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results):
+    header = f"{'scenario':<44} {'roster':>7} {'ops':>6} {'ops/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'sql/op':>7} {'http/op':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['scenario']:<44} {r['roster']:>7} {r['ops']:>6} {r['ops_per_sec'] or 0:>11.1f} "
+              f"{r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} {r['sql_per_op']:>7.2f} {r['discord_calls_per_op']:>8.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the bot's hot paths.")
+    parser.add_argument("--sizes", default="100,5000,50000",
+                        help="comma-separated roster sizes (default: 100,5000,50000)")
+    parser.add_argument("--ops", type=int, default=2000,
+                        help="operations per per-message scenario (marks are capped at the roster size)")
+    parser.add_argument("--passes", type=int, default=3,
+                        help="passes for whole-roster scenarios (expiry, end-of-day, cold report)")
+    parser.add_argument("--http-latency-ms", type=float, default=0.0,
+                        help="simulated latency of every Discord call")
+    parser.add_argument("--json", metavar="PATH", help="write machine-readable results to PATH ('-' for stdout)")
+    parser.add_argument("--log-level", default="WARNING", help="bot log level during the run")
+    args = parser.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    if args.json and args.json != "-":
+        args.json = os.path.abspath(args.json)
+
+    # The database file and bot.log must be redirected before the bot modules are imported
+    workdir = tempfile.mkdtemp(prefix="attendance-bench-")
+    os.environ["DB_FILE"] = os.path.join(workdir, "bench.db")
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+
+    import database
+    sql = SQLCounter()
+    configure = database._configure
+    def traced_configure(conn):
+        conn.set_trace_callback(sql)
+        return configure(conn)
+    database._configure = traced_configure
+
+    import bot
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    started = time.time()
+    try:
+        results = asyncio.run(run_all(bot, database, args, sql))
+    finally:
+        database.shutdown()
+
+    report = {
+        "meta": {
+            "started_at": datetime.datetime.fromtimestamp(started, datetime.timezone.utc).isoformat(),
+            "duration_seconds": round(time.time() - started, 2),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "ops": args.ops,
+            "passes": args.passes,
+            "http_latency_ms": args.http_latency_ms,
+        },
+        "results": results,
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {args.json}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
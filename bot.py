@@ -3,34 +3,70 @@ import json
 import datetime
 import asyncio
 import logging
+import math
+import signal
+import time
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from dotenv import load_dotenv
-from keep_alive import keep_alive
+import keep_alive
 import database # Import database module
+import reports
+import presence
+import scheduler
+import windows
+import role_engine
+import metrics
+import looplag
+import logsetup
+from outbox import dm_outbox
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 # DATA_DIR = "data" # No longer needed for main storage
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging (queued; a background thread writes the rotating bot.log and stderr)
+logsetup.setup_logging()
 logger = logging.getLogger(__name__)
+# Per-message / per-report lines; rate limited per call site so bursts cannot flood the log
+hot_logger = logsetup.rate_limited_logger(f"{__name__}.hot")
 
 # Configure intents
 intents = discord.Intents.default()
 intents.members = True  # Required to detect member joins and updates
 intents.message_content = True # Required for reading commands
 
-bot = commands.Bot(command_prefix='!', intents=intents, case_insensitive=True)
+bot = commands.Bot(command_prefix='!', intents=intents, case_insensitive=True,
+                   http_trace=role_engine.rate_limits.trace_config)
+
+# --- Metrics (served on /metrics by the keep_alive server) ---
+ON_MESSAGE_SECONDS = metrics.registry.histogram(
+    "on_message_seconds", "Time spent handling one on_message event.")
+EXPIRY_PASS_SECONDS = metrics.registry.histogram(
+    "attendance_expiry_pass_seconds", "Duration of one expiry pass (window transitions or duration expiry).",
+    labels=("mode",))
+REPORT_REFRESHES = metrics.registry.counter(
+    "attendance_report_refreshes_total", "Attendance report publishes by outcome.", labels=("result",))
+metrics.registry.gauge("discord_gateway_latency_seconds", "Gateway heartbeat latency (bot.latency).",
+                       fn=lambda: bot.latency if math.isfinite(bot.latency) else None)
+metrics.registry.gauge("discord_guilds", "Guilds the bot is in.", fn=lambda: len(bot.guilds))
+metrics.registry.gauge("cached_guilds", "Guilds with in-memory state, per cache.", labels=("cache",),
+                       fn=lambda: {("config",): database.config_cache.stats()["size"],
+                                   ("message_triggers",): len(message_triggers),
+                                   ("presence_index",): len(presence_indexes),
+                                   ("report_model",): len(report_models),
+                                   ("report_message",): len(report_messages)})
+metrics.registry.gauge("queue_depth", "Work waiting in in-process queues and schedulers.", labels=("queue",),
+                       fn=lambda: {("dm_outbox",): dm_outbox.pending(),
+                                   ("report_refresh",): len(pending_refreshes),
+                                   ("expiry_scheduler",): len(expiry_scheduler),
+                                   ("window_scheduler",): len(window_scheduler)})
+metrics.registry.counter("dm_outbox_total", "Confirmation DMs by outcome.", labels=("event",),
+                         fn=lambda: {(k,): v for k, v in dm_outbox.stats.items()})
+metrics.registry.counter("attendance_window_checks_total", "Window-mode pass counters (see expiry_tick_stats).",
+                         labels=("event",),
+                         fn=lambda: {(k,): v for k, v in expiry_tick_stats.items() if k not in ("last_duration", "max_duration")})
 
 # Configuration
 SUFFIX = " [𝙼𝚂𝚄𝚊𝚗]"
@@ -52,7 +88,7 @@ def can_manage_nick(ctx, member):
 
 async def apply_nickname(member):
     """Helper function to apply the nickname suffix."""
-    settings = load_settings(member.guild.id)
+    settings = await load_settings(member.guild.id)
     suffix = settings.get("suffix_format", SUFFIX)
     
     try:
@@ -81,7 +117,7 @@ async def apply_nickname(member):
 
 async def remove_nickname(member):
     """Helper function to remove the nickname suffix."""
-    settings = load_settings(member.guild.id)
+    settings = await load_settings(member.guild.id)
     suffix = settings.get("suffix_format", SUFFIX)
     
     try:
@@ -108,13 +144,26 @@ async def remove_nickname(member):
 @bot.event
 async def on_member_join(member):
     logger.info(f"Member joined: {member.name}")
-    settings = load_settings(member.guild.id)
+    settings = await load_settings(member.guild.id)
     if settings.get("auto_nick_on_join", False):
         await apply_nickname(member)
 
+@bot.event
+async def on_member_remove(member):
+    # Departed members are listed by ID in the report, as before
+    model = report_models.get(member.guild.id)
+    if model is not None:
+        model.rename(member.id, f"Unknown ({member.id})")
+
 @bot.event
 async def on_member_update(before, after):
-    settings = load_settings(after.guild.id)
+    # Keep the report model's sort order in step with display names
+    if before.display_name != after.display_name:
+        model = report_models.get(after.guild.id)
+        if model is not None:
+            model.rename(after.id, after.display_name)
+
+    settings = await load_settings(after.guild.id)
     
     # Enforce Suffix
     if settings.get("enforce_suffix", False):
@@ -226,7 +275,7 @@ async def nick(ctx, *, name: str = None):
                 return
 
             # Check if the suffix is already in the provided name, if not, append it
-            settings = load_settings(ctx.guild.id)
+            settings = await load_settings(ctx.guild.id)
             suffix = settings.get("suffix_format", SUFFIX)
             if not name.endswith(suffix):
                  # Truncate if necessary
@@ -331,7 +380,7 @@ async def set_attendance_time(ctx, *, time_input: str = None):
             await ctx.send(f"Invalid time format (`{start_str}` or `{end_str}`). Please use formats like `6am`, `11:59pm`, `08:00`.")
             return
             
-        settings = load_settings(ctx.guild.id)
+        settings = await load_settings(ctx.guild.id)
         settings['attendance_mode'] = 'window'
         settings['window_start_time'] = s_parsed
         settings['window_end_time'] = e_parsed
@@ -339,7 +388,7 @@ async def set_attendance_time(ctx, *, time_input: str = None):
         # Reset the last processed date so we don't accidentally skip today if re-setting
         settings['last_processed_date'] = None
         
-        save_settings(ctx.guild.id, settings)
+        await save_settings(ctx.guild.id, settings)
         
         # Convert to 12-hour format for confirmation message
         dt_start = datetime.datetime.strptime(s_parsed, "%H:%M")
@@ -351,7 +400,7 @@ async def set_attendance_time(ctx, *, time_input: str = None):
         await ctx.send(f"✅ Attendance time set to **{display_s} - {display_e}**. Mode switched to 'Window'.")
         
         # Check if allowed_role is set for auto-absence
-        data = load_attendance_data(ctx.guild.id)
+        data = await load_attendance_data(ctx.guild.id)
         if not data.get('allowed_role_id'):
             await ctx.send("⚠️ **Note:** You haven't set a 'Permitted Role' (the role required to attend). \n"
                            "Bot cannot determine who is 'missing' without it. \n"
@@ -365,9 +414,9 @@ async def set_attendance_time(ctx, *, time_input: str = None):
 
 # --- Attendance Logic ---
 
-def load_attendance_data(guild_id):
+async def load_attendance_data(guild_id):
     """Loads attendance data for a specific guild from the database."""
-    config = database.get_guild_config(guild_id)
+    config = await database.get_guild_config_async(guild_id)
     if not config:
         # Default structure for new guilds
         return {
@@ -378,6 +427,8 @@ def load_attendance_data(guild_id):
             "report_channel_id": None,
             "last_report_message_id": None,
             "last_report_channel_id": None,
+            "allowed_role_id": None,
+            "ping_role_id": None,
             "records": {}, 
             "settings": {}
         }
@@ -398,9 +449,9 @@ def load_attendance_data(guild_id):
         "suffix_format": config.get('suffix_format')
     }
     
-    records = database.get_attendance_records(guild_id)
+    records = await database.get_attendance_records_async(guild_id)
     
-    return {
+    data = {
         "attendance_role_id": config.get('attendance_role_id'),
         "absent_role_id": config.get('absent_role_id'),
         "excused_role_id": config.get('excused_role_id'),
@@ -408,16 +459,18 @@ def load_attendance_data(guild_id):
         "report_channel_id": config.get('report_channel_id'),
         "last_report_message_id": config.get('last_report_message_id'),
         "last_report_channel_id": config.get('last_report_channel_id'),
+        "allowed_role_id": config.get('allowed_role_id'),
+        "ping_role_id": config.get('ping_role_id'),
         "records": records,
         "settings": settings
     }
+    _take_snapshot(data)
+    return data
 
-def save_attendance_data(guild_id, guild_data):
-    """Saves attendance data for a specific guild to the database."""
+def _flatten_config(guild_data):
+    """Flattens the bot's guild data structure into guild_configs columns."""
     settings = guild_data.get('settings', {})
-    
-    # Flatten for DB update
-    config_update = {
+    return {
         "attendance_role_id": guild_data.get('attendance_role_id'),
         "absent_role_id": guild_data.get('absent_role_id'),
         "excused_role_id": guild_data.get('excused_role_id'),
@@ -425,6 +478,8 @@ def save_attendance_data(guild_id, guild_data):
         "report_channel_id": guild_data.get('report_channel_id'),
         "last_report_message_id": guild_data.get('last_report_message_id'),
         "last_report_channel_id": guild_data.get('last_report_channel_id'),
+        "allowed_role_id": guild_data.get('allowed_role_id'),
+        "ping_role_id": guild_data.get('ping_role_id'),
         
         # Settings
         "attendance_mode": settings.get('attendance_mode'),
@@ -440,32 +495,196 @@ def save_attendance_data(guild_id, guild_data):
         "remove_suffix_on_role_loss": settings.get('remove_suffix_on_role_loss'),
         "suffix_format": settings.get('suffix_format')
     }
-    
-    database.update_guild_config(guild_id, **config_update)
-    database.replace_all_records(guild_id, guild_data.get('records', {}))
 
-def load_settings(guild_id):
-    """Helper to get settings with defaults for a guild"""
-    config = database.get_guild_config(guild_id)
-    
-    defaults = {
-        "debug_mode": False,
-        "auto_nick_on_join": False,
-        "enforce_suffix": False,
-        "remove_suffix_on_role_loss": False,
-        "attendance_expiry_hours": 12,
-        "allow_self_marking": True,
-        "require_admin_excuse": True,
-        "suffix_format": " [𝙼𝚂𝚄𝚊𝚗]",
-        "attendance_mode": "duration", 
-        "window_start_time": "00:00",
-        "window_end_time": "23:59",
-        "last_processed_date": None,
-        "last_opened_date": None
+def _normalize_record(info):
+    """Returns a record as the (status, timestamp, channel_id, reason) row stored in the DB."""
+    if isinstance(info, str):
+        return ("present", info, None, None)
+    return (info.get('status', 'present'), info.get('timestamp'), info.get('channel_id'), info.get('reason'))
+
+def _take_snapshot(guild_data):
+    """Remembers what is persisted so save_attendance_data can write only the delta."""
+    guild_data['_snapshot'] = {
+        "config": _flatten_config(guild_data),
+        "records": {uid: _normalize_record(info) for uid, info in guild_data.get('records', {}).items()}
     }
+
+async def save_attendance_data(guild_id, guild_data):
+    """
+    Saves attendance data for a specific guild to the database.
+    Data returned by load_attendance_data carries a snapshot, so only the config
+    columns and records that actually changed are written.
+    """
+    config_update = _flatten_config(guild_data)
+    records = guild_data.get('records', {})
+    snapshot = guild_data.get('_snapshot')
+    
+    if snapshot is None:
+        # Fresh structure (new guild or full reset): write everything
+        await database.update_guild_config_async(guild_id, **config_update)
+        invalidate_message_triggers(guild_id)
+        await database.replace_all_records_async(guild_id, records)
+        invalidate_record_models(guild_id)
+        note_record_expiries(guild_id, records, cleared=True)
+    else:
+        changed_config = {k: v for k, v in config_update.items() if snapshot['config'].get(k) != v}
+        if changed_config:
+            await database.update_guild_config_async(guild_id, **changed_config)
+            invalidate_message_triggers(guild_id)
+        
+        old_records = snapshot['records']
+        if not records and old_records:
+            await database.clear_attendance_records_async(guild_id)
+            note_record_changes(guild_id, cleared=True)
+        else:
+            upserts = {}
+            for uid, info in records.items():
+                row = _normalize_record(info)
+                if old_records.get(uid) != row:
+                    upserts[uid] = dict(zip(("status", "timestamp", "channel_id", "reason"), row))
+            deletes = [uid for uid in old_records if uid not in records]
+            if upserts or deletes:
+                await database.apply_record_changes_async(guild_id, upserts, deletes)
+                note_record_changes(guild_id, upserts, deletes)
+    
+    _take_snapshot(guild_data)
+
+async def set_attendance_record(guild_id, user_id, record):
+    """Persists a single user's current attendance record."""
+    status, timestamp, channel_id, reason = _normalize_record(record)
+    await database.add_or_update_record_async(guild_id, int(user_id), status, timestamp, channel_id, reason)
+    note_record_changes(guild_id, {user_id: record})
+
+async def remove_attendance_record(guild_id, user_id):
+    """Deletes a single user's attendance record."""
+    await database.delete_record_async(guild_id, int(user_id))
+    note_record_changes(guild_id, deletes=[user_id])
+
+# --- In-Memory Attendance State ---
+# Mirrors of attendance_records, kept in step with every write above so hot
+# paths (report rendering) never have to reload the roster from SQLite.
+
+report_models = {}  # guild_id -> reports.AttendanceReport, built lazily
+presence_indexes = {}  # guild_id -> presence.PresenceIndex, built lazily
+model_builds = {}  # guild_id -> [changes noted while a build's read is in flight], one list per build
+
+def member_display_name(guild, user_id):
+    member = guild.get_member(int(user_id)) if guild else None
+    return member.display_name if member else f"Unknown ({user_id})"
+
+def note_record_changes(guild_id, upserts=None, deletes=(), cleared=False):
+    """Applies persisted record changes ({user_id: record} upserts, [user_id] deletes) to the in-memory models."""
+    note_record_expiries(guild_id, upserts, deletes, cleared)
+    change = (dict(upserts or {}), list(deletes), cleared)
+    # A build whose read is still running may or may not see this write; it replays it
+    for noted in model_builds.get(guild_id, ()):
+        noted.append(change)
+    index = presence_indexes.get(guild_id)
+    if index is not None:
+        _apply_to_index(index, *change)
+    model = report_models.get(guild_id)
+    if model is not None:
+        _apply_to_model(model, bot.get_guild(guild_id), *change)
+
+def _apply_to_index(index, upserts, deletes, cleared):
+    if cleared:
+        index.clear()
+    for uid in deletes:
+        index.remove(int(uid))
+    for uid, info in upserts.items():
+        index.set(int(uid), _normalize_record(info)[0])
+
+def _apply_to_model(model, guild, upserts, deletes, cleared):
+    if cleared:
+        model.clear()
+    for uid in deletes:
+        model.remove(int(uid))
+    for uid, info in upserts.items():
+        status, _, _, reason = _normalize_record(info)
+        model.set(int(uid), status, member_display_name(guild, uid), reason)
+
+async def _read_records_for_build(guild_id):
+    """
+    Reads a guild's records for building a model and returns them with the
+    changes noted while the read ran, to be replayed (in order) on the result.
+    """
+    noted = []
+    builds = model_builds.setdefault(guild_id, [])
+    builds.append(noted)
+    try:
+        records = await database.get_attendance_records_async(guild_id)
+    finally:
+        builds.remove(noted)
+        if not builds:
+            del model_builds[guild_id]
+    return records, noted
+
+def invalidate_record_models(guild_id):
+    """Drops the in-memory models for a guild; they are rebuilt from SQLite on next use."""
+    report_models.pop(guild_id, None)
+    presence_indexes.pop(guild_id, None)
+
+async def get_presence_index(guild_id):
+    """Returns the guild's presence index, loading it from SQLite the first time."""
+    index = presence_indexes.get(guild_id)
+    if index is None:
+        records, noted = await _read_records_for_build(guild_id)
+        index = presence_indexes.get(guild_id)  # A concurrent caller may have built it meanwhile
+        if index is None:
+            index = presence.PresenceIndex.from_records(records)
+            for change in noted:
+                _apply_to_index(index, *change)
+            presence_indexes[guild_id] = index
+    return index
+
+async def get_report_model(guild):
+    """Returns the guild's report model, loading it from SQLite the first time."""
+    model = report_models.get(guild.id)
+    if model is None:
+        records, noted = await _read_records_for_build(guild.id)
+        model = report_models.get(guild.id)  # A concurrent caller may have built it meanwhile
+        if model is None:
+            model = reports.AttendanceReport.from_records(records, lambda uid: member_display_name(guild, uid))
+            for change in noted:
+                _apply_to_model(model, guild, *change)
+            report_models[guild.id] = model
+    return model
+
+# Defaults applied by load_settings (built once, copied per call)
+DEFAULT_SETTINGS = {
+    "debug_mode": False,
+    "auto_nick_on_join": False,
+    "enforce_suffix": False,
+    "remove_suffix_on_role_loss": False,
+    "attendance_expiry_hours": 12,
+    "allow_self_marking": True,
+    "require_admin_excuse": True,
+    "suffix_format": " [𝙼𝚂𝚄𝚊𝚗]",
+    "attendance_mode": "duration", 
+    "window_start_time": "00:00",
+    "window_end_time": "23:59",
+    "last_processed_date": None,
+    "last_opened_date": None
+}
+
+class Settings(dict):
+    """
+    A guild's settings as returned by load_settings. `loaded` keeps the values
+    as read (None if the guild had no config row yet) so save_settings can
+    write back only what the caller changed.
+    """
+
+    def __init__(self, values, loaded=True):
+        super().__init__(values)
+        self.loaded = dict(values) if loaded else None
+
+async def load_settings(guild_id):
+    """Helper to get settings with defaults for a guild (served from the config cache)"""
+    config = await database.get_guild_config_async(guild_id)
+    defaults = DEFAULT_SETTINGS
     
     if not config:
-        return defaults
+        return Settings(defaults, loaded=False)
         
     # Map DB fields to settings dict
     settings = {
@@ -487,9 +706,9 @@ def load_settings(guild_id):
     for k, v in defaults.items():
         if k not in settings or settings[k] is None:
             settings[k] = v
-    return settings
+    return Settings(settings)
 
-def save_settings(guild_id, settings):
+async def save_settings(guild_id, settings):
     config_update = {
         "attendance_mode": settings.get('attendance_mode'),
         "attendance_expiry_hours": settings.get('attendance_expiry_hours'),
@@ -504,7 +723,27 @@ def save_settings(guild_id, settings):
         "remove_suffix_on_role_loss": settings.get('remove_suffix_on_role_loss'),
         "suffix_format": settings.get('suffix_format')
     }
-    database.update_guild_config(guild_id, **config_update)
+    # Write only the keys changed since load_settings, so a caller holding older
+    # settings cannot overwrite columns someone else has changed in the meantime
+    loaded = getattr(settings, 'loaded', None)
+    if loaded is not None:
+        config_update = {k: v for k, v in config_update.items() if loaded.get(k) != v}
+        if not config_update:
+            return
+    await database.update_guild_config_async(guild_id, **config_update)
+    invalidate_message_triggers(guild_id)
+    if loaded is not None:
+        loaded.update(config_update)
+    
+    # The database recomputes expires_at when the mode or duration changes; re-aim the wake-up
+    if config_update.keys() & {'attendance_mode', 'attendance_expiry_hours'}:
+        if expiry_scheduler.is_running():
+            await reschedule_expiries()
+    
+    # A new window (or mode) moves the guild's next open/close; check it right away
+    if config_update.keys() & {'attendance_mode', 'window_start_time', 'window_end_time'}:
+        if window_scheduler.is_running():
+            window_scheduler.schedule(guild_id, time.time())
 
 # --- Configuration Views ---
 
@@ -521,7 +760,7 @@ class SettingsSelect(discord.ui.Select):
 
     async def callback(self, interaction: discord.Interaction):
         category = self.values[0]
-        settings = load_settings(interaction.guild.id)
+        settings = await load_settings(interaction.guild.id)
         
         if category == "System Settings":
             view = SystemSettingsView(interaction.guild.id, settings)
@@ -579,7 +818,7 @@ class BaseSettingsView(discord.ui.View):
         self.settings = settings
 
     async def update_message(self, interaction, embed):
-        save_settings(self.guild_id, self.settings)
+        await save_settings(self.guild_id, self.settings)
         await interaction.response.edit_message(embed=embed, view=self)
 
     @discord.ui.button(label="Back to Main Menu", style=discord.ButtonStyle.secondary, row=4)
@@ -719,9 +958,9 @@ async def assign_attendance_role(ctx, role: discord.Role):
     Sets the role that users receive when they say 'present'.
     Usage: !presentrole @Role (or !assignrole @Role)
     """
-    data = load_attendance_data(ctx.guild.id)
+    data = await load_attendance_data(ctx.guild.id)
     data['attendance_role_id'] = role.id
-    save_attendance_data(ctx.guild.id, data)
+    await save_attendance_data(ctx.guild.id, data)
     await ctx.send(f"Attendance role has been set to {role.mention}. Users who say 'present' will now receive this role for 12 hours.")
 
 @bot.command(name='absentrole')
@@ -731,9 +970,9 @@ async def assign_absent_role(ctx, role: discord.Role):
     Sets the role that users receive when marked as absent.
     Usage: !absentrole @Role
     """
-    data = load_attendance_data(ctx.guild.id)
+    data = await load_attendance_data(ctx.guild.id)
     data['absent_role_id'] = role.id
-    save_attendance_data(ctx.guild.id, data)
+    await save_attendance_data(ctx.guild.id, data)
     await ctx.send(f"Absent role has been set to {role.mention}.")
 
 @bot.command(name='excuserole')
@@ -743,57 +982,50 @@ async def assign_excused_role(ctx, role: discord.Role):
     Sets the role that users receive when marked as excused.
     Usage: !excuserole @Role
     """
-    data = load_attendance_data(ctx.guild.id)
+    data = await load_attendance_data(ctx.guild.id)
     data['excused_role_id'] = role.id
-    save_attendance_data(ctx.guild.id, data)
+    await save_attendance_data(ctx.guild.id, data)
     await ctx.send(f"Excused role has been set to {role.mention}.")
 
 
+def status_role_jobs(guild, member, status, triggers):
+    """role_engine jobs giving member the role for status and taking the other status roles."""
+    role_ids = {
+        'present': triggers.present_role_id,
+        'absent': triggers.absent_role_id,
+        'excused': triggers.excused_role_id,
+    }
+    jobs = []
+    for role_status, role_id in role_ids.items():
+        role = guild.get_role(role_id) if role_id else None
+        if role:
+            jobs.append((member, role, role_status == status))
+    return jobs
+
 async def update_user_status(ctx, member, status, reason=None):
-    data = load_attendance_data(ctx.guild.id)
+    # Role IDs come from the cached guild config; only this member's record is written
+    triggers = await get_message_triggers(ctx.guild.id)
+    target_role_id = {
+        'present': triggers.present_role_id,
+        'absent': triggers.absent_role_id,
+        'excused': triggers.excused_role_id,
+    }.get(status)
+    
+    # Swap the status roles in one edit
+    result = await role_engine.apply_role_changes(ctx.guild, status_role_jobs(ctx.guild, member, status, triggers))
     
-    # Get all role IDs
-    present_role_id = data.get('attendance_role_id')
-    absent_role_id = data.get('absent_role_id')
-    excused_role_id = data.get('excused_role_id')
-    
-    target_role_id = None
-    roles_to_remove = []
-    
-    if status == 'present':
-        target_role_id = present_role_id
-        if absent_role_id: roles_to_remove.append(absent_role_id)
-        if excused_role_id: roles_to_remove.append(excused_role_id)
-    elif status == 'absent':
-        target_role_id = absent_role_id
-        if present_role_id: roles_to_remove.append(present_role_id)
-        if excused_role_id: roles_to_remove.append(excused_role_id)
-    elif status == 'excused':
-        target_role_id = excused_role_id
-        if present_role_id: roles_to_remove.append(present_role_id)
-        if absent_role_id: roles_to_remove.append(absent_role_id)
-        
-    # Remove conflicting roles
-    for rid in roles_to_remove:
-        role = ctx.guild.get_role(rid)
-        if role and role in member.roles:
-            try:
-                await member.remove_roles(role)
-            except discord.Forbidden:
-                await ctx.send(f"Warning: Could not remove role {role.name} from {member.display_name} (Missing Permissions)")
-
-    # Add new role
     if target_role_id:
         role = ctx.guild.get_role(target_role_id)
         if role:
-            try:
-                await member.add_roles(role)
+            if result.forbidden:
+                await ctx.send(f"Failed to give {status} role to {member.display_name} (Missing Permissions)")
+            elif result.failed:
+                await ctx.send(f"Failed to give {status} role to {member.display_name}")
+            else:
                 msg = f"Marked {member.mention} as **{status.upper()}** and gave them the {role.name} role."
                 if reason:
                     msg += f"\nReason: {reason}"
                 await ctx.send(msg)
-            except discord.Forbidden:
-                await ctx.send(f"Failed to give {status} role to {member.display_name} (Missing Permissions)")
         else:
              msg = f"Marked {member.mention} as **{status.upper()}**, but the role for this status is not configured or deleted."
              if reason:
@@ -805,11 +1037,8 @@ async def update_user_status(ctx, member, status, reason=None):
             msg += f"\nReason: {reason}"
         await ctx.send(msg)
 
-    # Update JSON
+    # Save record
     user_id = str(member.id)
-    if 'records' not in data:
-        data['records'] = {}
-    
     record = {
         "status": status,
         "timestamp": datetime.datetime.now().isoformat(),
@@ -818,8 +1047,7 @@ async def update_user_status(ctx, member, status, reason=None):
     if reason:
         record["reason"] = reason
         
-    data['records'][user_id] = record
-    save_attendance_data(ctx.guild.id, data)
+    await set_attendance_record(ctx.guild.id, user_id, record)
 
 @bot.command(name='setpermitrole', aliases=['allowrole'])
 @commands.has_permissions(manage_roles=True)
@@ -829,7 +1057,7 @@ async def set_permit_role(ctx, role: discord.Role = None):
     Usage: !setpermitrole @Role
     Usage: !setpermitrole (to reset/allow everyone)
     """
-    data = load_attendance_data(ctx.guild.id)
+    data = await load_attendance_data(ctx.guild.id)
     if role:
         data['allowed_role_id'] = role.id
         await ctx.send(f"Permission Updated: Only users with the {role.mention} role can mark attendance.")
@@ -837,7 +1065,7 @@ async def set_permit_role(ctx, role: discord.Role = None):
         data['allowed_role_id'] = None
         await ctx.send("Permission Updated: Everyone can now mark attendance.")
     
-    save_attendance_data(ctx.guild.id, data)
+    await save_attendance_data(ctx.guild.id, data)
 
 @bot.command(name='resetpermitrole', aliases=['resetassignrole', 'resetallowedrole'])
 @commands.has_permissions(manage_roles=True)
@@ -847,7 +1075,7 @@ async def reset_permit_role_users(ctx):
     This effectively resets who is allowed to say 'present'.
     Usage: !resetpermitrole
     """
-    data = load_attendance_data(ctx.guild.id)
+    data = await load_attendance_data(ctx.guild.id)
     allowed_role_id = data.get('allowed_role_id')
     
     if not allowed_role_id:
@@ -868,20 +1096,11 @@ async def reset_permit_role_users(ctx):
         
     await ctx.send(f"Removing {role.mention} from {len(users_with_role)} users... This may take a moment.")
     
-    count = 0
-    for member in users_with_role:
-        try:
-            await member.remove_roles(role)
-            count += 1
-            # Add a small delay to avoid rate limits if many users
-            if count % 5 == 0:
-                await asyncio.sleep(1) 
-        except discord.Forbidden:
-            logger.warning(f"Failed to remove permitted role from {member.name} (Missing Permissions)")
-        except Exception as e:
-            logger.error(f"Error removing permitted role from {member.id}: {e}")
+    result = await role_engine.apply_role_changes(
+        ctx.guild, [(member, role, False) for member in users_with_role],
+        progress=role_engine.ProgressMessage(ctx.channel, f"Removing {role.name}"))
             
-    await ctx.send(f"✅ Reset complete! Removed {role.mention} from {count} users. They will need to be re-assigned the role to say 'present'.")
+    await ctx.send(f"✅ Reset complete! Removed {role.mention} from {result.changed} users. They will need to be re-assigned the role to say 'present'.")
 
 @bot.command(name='reset')
 @commands.has_permissions(manage_roles=True)
@@ -899,52 +1118,11 @@ async def reset_specific_role(ctx, role: discord.Role):
         
     await ctx.send(f"Removing {role.mention} from {len(users_with_role)} users... This may take a moment.")
     
-    count = 0
-    for member in users_with_role:
-        try:
-            await member.remove_roles(role)
-            count += 1
-            # Add a small delay to avoid rate limits if many users
-            if count % 5 == 0:
-                await asyncio.sleep(1) 
-        except discord.Forbidden:
-            logger.warning(f"Failed to remove role {role.name} from {member.name} (Missing Permissions)")
-        except Exception as e:
-            logger.error(f"Error removing role {role.name} from {member.id}: {e}")
-            
-    await ctx.send(f"✅ Reset complete! Removed {role.mention} from {count} users.")
-
-def is_in_attendance_window(guild_id):
-    settings = load_settings(guild_id)
-    if settings.get('attendance_mode') != 'window':
-        return True, None
-    
-    start_str = settings.get('window_start_time', '00:00')
-    end_str = settings.get('window_end_time', '23:59')
-    
-    try:
-        t_start = datetime.datetime.strptime(start_str, "%H:%M").time()
-        t_end = datetime.datetime.strptime(end_str, "%H:%M").time()
-        
-        # Use Philippines Time (UTC+8)
-        ph_tz = datetime.timezone(datetime.timedelta(hours=8))
-        now = datetime.datetime.now(ph_tz).time()
-        
-        in_window = False
-        if t_start <= t_end:
-            in_window = t_start <= now <= t_end
-        else:
-            in_window = now >= t_start or now <= t_end
-            
-        if not in_window:
-            # Convert to 12-hour format for display
-            display_start = t_start.strftime("%I:%M %p").lstrip('0')
-            display_end = t_end.strftime("%I:%M %p").lstrip('0')
-            return False, f"Attendance is only allowed between {display_start} and {display_end}."
+    result = await role_engine.apply_role_changes(
+        ctx.guild, [(member, role, False) for member in users_with_role],
+        progress=role_engine.ProgressMessage(ctx.channel, f"Removing {role.name}"))
             
-        return True, None
-    except ValueError:
-        return True, None
+    await ctx.send(f"✅ Reset complete! Removed {role.mention} from {result.changed} users.")
 
 @bot.command(name='present')
 async def mark_present(ctx, member: discord.Member = None):
@@ -958,22 +1136,19 @@ async def mark_present(ctx, member: discord.Member = None):
 
     # Check for required role if marking self
     if member == ctx.author:
-        settings = load_settings(ctx.guild.id)
+        triggers = await get_message_triggers(ctx.guild.id)
         
         # Check Window
-        allowed, msg = is_in_attendance_window(ctx.guild.id)
-        if not allowed:
-             await ctx.send(msg)
+        if not triggers.in_window():
+             await ctx.send(triggers.window.message)
              return
         
-        if not settings.get('allow_self_marking', True):
+        if not triggers.allow_self_marking:
             await ctx.send("Self-marking is currently disabled.")
             return
 
-        data = load_attendance_data(ctx.guild.id)
-        allowed_role_id = data.get('allowed_role_id')
-        if allowed_role_id:
-            allowed_role = ctx.guild.get_role(allowed_role_id)
+        if triggers.allowed_role_id:
+            allowed_role = ctx.guild.get_role(triggers.allowed_role_id)
             if allowed_role and allowed_role not in ctx.author.roles:
                 await ctx.send(f"You need the {allowed_role.mention} role to mark attendance.")
                 return
@@ -999,7 +1174,7 @@ async def mark_excuse(ctx, member: discord.Member, *, reason: str):
     Marks a user as excused with a reason.
     Usage: !excuse @User I was sick
     """
-    settings = load_settings(ctx.guild.id)
+    settings = await load_settings(ctx.guild.id)
     if settings.get('require_admin_excuse', True):
         if not ctx.author.guild_permissions.manage_roles:
             await ctx.send("You do not have permission to excuse users.")
@@ -1012,10 +1187,10 @@ async def mark_excuse_error(ctx, error):
     if isinstance(error, commands.MissingRequiredArgument):
         await ctx.send("Usage: `!excuse @User <reason>` (e.g., `!excuse @John I was sick`)")
 
-def create_attendance_embed(guild):
-    logger.info(f"Generating report for guild: {guild.name} ({guild.id})")
-    data = load_attendance_data(guild.id)
-    records = data.get('records', {})
+async def create_attendance_embed(guild):
+    hot_logger.info("Generating report for guild: %s (%s)", guild.name, guild.id)
+    model = await get_report_model(guild)
+    index = await get_presence_index(guild.id)
     
     # Philippines Time (UTC+8)
     ph_tz = datetime.timezone(datetime.timedelta(hours=8))
@@ -1038,49 +1213,10 @@ def create_attendance_embed(guild):
         "**Absent** • Did not check in."
     )
     
-    # Helper to get name
-    def get_name(uid):
-        member = guild.get_member(int(uid))
-        return member.display_name if member else f"Unknown ({uid})"
-
-    # Sort records by name for cleaner display
-    sorted_records = sorted(records.items(), key=lambda x: get_name(x[0]).lower())
-
-    present_entries = []
-    absent_entries = []
-    excused_entries = []
-
-    for uid, info in sorted_records:
-        if isinstance(info, str):
-            info = {"status": "present", "timestamp": info}
-            
-        status = info.get('status', 'present')
-        reason = info.get('reason')
-        name = get_name(uid)
-        
-        entry = f"• {name}"
-        if reason:
-            entry += f" (*{reason}*)"
-
-        if status == 'present':
-            present_entries.append(entry)
-        elif status == 'absent':
-            absent_entries.append(entry)
-        elif status == 'excused':
-            excused_entries.append(entry)
-
-    # Helper to chunk list to avoid hitting Discord 1024 char limit
-    def format_list(entries):
-        if not entries:
-            return "None"
-        text = "\n".join(entries)
-        if len(text) > 1000:
-            return text[:950] + "\n... (truncated)"
-        return text
-
-    embed.add_field(name=f"✅  **Present**  ` {len(present_entries)} `", value=format_list(present_entries), inline=True)
-    embed.add_field(name=f"❌  **Absent**  ` {len(absent_entries)} `", value=format_list(absent_entries), inline=True)
-    embed.add_field(name=f"⚠️  **Excused**  ` {len(excused_entries)} `", value=format_list(excused_entries), inline=False)
+    # Buckets are kept sorted by name, and only the visible entries are formatted
+    embed.add_field(name=f"✅  **Present**  ` {index.count('present')} `", value=model.format_bucket('present'), inline=True)
+    embed.add_field(name=f"❌  **Absent**  ` {index.count('absent')} `", value=model.format_bucket('absent'), inline=True)
+    embed.add_field(name=f"⚠️  **Excused**  ` {index.count('excused')} `", value=model.format_bucket('excused'), inline=False)
     
     embed.set_footer(text=f"Created by Calvin • Last Updated: {now_ph.strftime('%I:%M %p')}", icon_url=guild.icon.url if guild.icon else None)
     
@@ -1093,14 +1229,14 @@ async def remove_present(ctx, member: discord.Member):
     Removes a user's present status/role so they can mark attendance again.
     Usage: !removepresent @User
     """
-    data = load_attendance_data(ctx.guild.id)
+    data = await load_attendance_data(ctx.guild.id)
     role_id = data.get('attendance_role_id')
     user_id = str(member.id)
     
     # Remove from records
     if 'records' in data and user_id in data['records']:
         del data['records'][user_id]
-        save_attendance_data(ctx.guild.id, data)
+        await remove_attendance_record(ctx.guild.id, user_id)
     
     # Remove role
     if role_id:
@@ -1136,17 +1272,16 @@ async def restart_attendance(ctx):
     # Proceed with reset
     await ctx.send("🔄 Resetting attendance system... Please wait.")
     
-    data = load_attendance_data(ctx.guild.id)
+    data = await load_attendance_data(ctx.guild.id)
     
     # 1. Remove Roles
     present_role_id = data.get('attendance_role_id')
     if present_role_id:
         role = ctx.guild.get_role(present_role_id)
         if role:
-            for member in role.members:
-                try:
-                    await member.remove_roles(role)
-                except: pass
+            await role_engine.apply_role_changes(
+                ctx.guild, [(member, role, False) for member in role.members],
+                progress=role_engine.ProgressMessage(ctx.channel, f"Removing {role.name}"))
     
     # 2. Wipe Data and Settings
     # Create a fresh default structure
@@ -1174,7 +1309,9 @@ async def restart_attendance(ctx):
         "settings": default_settings
     }
     
-    save_attendance_data(ctx.guild.id, fresh_data)
+    await save_attendance_data(ctx.guild.id, fresh_data)
+    cancel_report_refresh(ctx.guild.id)
+    forget_report_message(ctx.guild.id)
     
     # Attempt to post a fresh, empty report to the report channel
     report_channel_id = data.get('report_channel_id')
@@ -1185,54 +1322,89 @@ async def restart_attendance(ctx):
                 # Create a temporary guild object or just call the function since it only needs ID for loading data
                 # but create_attendance_embed uses guild.get_member etc.
                 # Since we are in ctx, we can use ctx.guild
-                embed = create_attendance_embed(ctx.guild)
+                embed = await create_attendance_embed(ctx.guild)
                 await channel.send(embed=embed)
             except:
                 pass
 
     await ctx.send("✅ **System Reset Complete.**\nAll data has been cleared. You can now reconfigure the bot using `!settime`, `!assignchannel`, etc.")
 
-async def refresh_attendance_report(guild, target_channel=None):
-    """
-    Deletes the previous report (if tracked) and sends a new one to the target channel.
-    If target_channel is None, it tries to use the configured report channel.
-    Updates the tracked message ID.
-    """
-    data = load_attendance_data(guild.id)
-    
-    # 1. Delete Old Report
-    last_msg_id = data.get('last_report_message_id')
-    last_chan_id = data.get('last_report_channel_id')
-    
-    if last_msg_id and last_chan_id:
-        try:
-            # SAFETY CHECK: Ensure the channel belongs to the same guild
-            old_chan = guild.get_channel(last_chan_id)
-            if old_chan and old_chan.guild.id == guild.id:
-                try:
-                    old_msg = await old_chan.fetch_message(last_msg_id)
-                    await old_msg.delete()
-                except (discord.NotFound, discord.Forbidden):
-                    pass
-        except Exception as e:
-            logger.error(f"Error deleting old report in {guild.name}: {e}")
-            pass
-            
-    # 2. Determine Target Channel
-    channel = target_channel
-    if not channel:
-        report_channel_id = data.get('report_channel_id')
-        if report_channel_id:
-            channel = guild.get_channel(report_channel_id)
+# --- Report Publishing ---
+# The live report is edited in place. Refreshes requested by check-ins are
+# coalesced per guild, so a burst of "present" messages costs one edit.
+
+REPORT_DEBOUNCE_SECONDS = float(os.getenv("REPORT_DEBOUNCE_SECONDS", 2))
+
+report_messages = {}    # guild_id -> discord.PartialMessage of the live report
+report_hashes = {}      # guild_id -> hash of the last published content
+pending_refreshes = {}  # guild_id -> asyncio.Task waiting out the debounce window
+report_locks = {}       # guild_id -> asyncio.Lock serializing publishes
+
+def request_report_refresh(guild):
+    """Schedules a report refresh; requests within the debounce window are merged into one."""
+    if guild.id not in pending_refreshes:
+        pending_refreshes[guild.id] = asyncio.create_task(_debounced_refresh(guild))
+
+async def _debounced_refresh(guild):
+    try:
+        await asyncio.sleep(REPORT_DEBOUNCE_SECONDS)
+    finally:
+        # Requests arriving while we publish schedule a fresh round
+        if pending_refreshes.get(guild.id) is asyncio.current_task():
+            del pending_refreshes[guild.id]
+    try:
+        await refresh_attendance_report(guild)
+    except Exception as e:
+        logger.error(f"Error refreshing report in {guild.name}: {e}", exc_info=True)
+
+def cancel_report_refresh(guild_id):
+    """Drops a pending debounced refresh (used before publishing a final report directly)."""
+    task = pending_refreshes.pop(guild_id, None)
+    if task:
+        task.cancel()
+
+def forget_report_message(guild_id):
+    """Forgets the cached live report so the next refresh posts a new message."""
+    report_messages.pop(guild_id, None)
+    report_hashes.pop(guild_id, None)
+
+def _embed_hash(embed):
+    # Time-of-day lines are left out so an unchanged roster is never re-sent
+    return hash((embed.title, tuple((f.name, f.value) for f in embed.fields)))
+
+def _resolve_report_channel(guild, config):
+    channel = None
+    report_channel_id = config.get('report_channel_id')
+    if report_channel_id:
+        channel = guild.get_channel(report_channel_id)
             
     if not channel:
         # Fallback
-        welcome_channel_id = data.get('welcome_channel_id')
+        welcome_channel_id = config.get('welcome_channel_id')
         if welcome_channel_id:
              channel = guild.get_channel(welcome_channel_id)
         elif guild.system_channel:
              channel = guild.system_channel
+    return channel
+
+async def refresh_attendance_report(guild, target_channel=None):
+    """
+    Publishes the attendance report. Background refreshes (target_channel None)
+    edit the tracked report in the configured channel in place (no fetch, skipped
+    entirely when the content is unchanged), and send a new message only when
+    nothing is tracked yet or the message is gone.
+    An explicit target_channel (e.g. !attendance) always posts a fresh report
+    there and deletes the old one, as the command has always done.
+    """
+    lock = report_locks.setdefault(guild.id, asyncio.Lock())
+    async with lock:
+        return await _publish_report(guild, target_channel)
 
+async def _publish_report(guild, target_channel):
+    config = await database.get_guild_config_async(guild.id) or {}
+    
+    # 1. Determine Target Channel
+    channel = target_channel or _resolve_report_channel(guild, config)
     if not channel:
         return None # Nowhere to send
 
@@ -1240,19 +1412,59 @@ async def refresh_attendance_report(guild, target_channel=None):
     if channel.guild.id != guild.id:
         logger.error(f"Security Alert: Attempted to post report for {guild.name} to channel in {channel.guild.name}!")
         return None
+    
+    # 2. Locate the live report without fetching it
+    message = report_messages.get(guild.id)
+    if message is None:
+        last_msg_id = config.get('last_report_message_id')
+        last_chan_id = config.get('last_report_channel_id')
+        old_chan = guild.get_channel(last_chan_id) if last_msg_id and last_chan_id else None
+        # SAFETY CHECK: Ensure the channel belongs to the same guild
+        if old_chan and old_chan.guild.id == guild.id:
+            message = old_chan.get_partial_message(last_msg_id)
+            report_messages[guild.id] = message
+    
+    embed = await create_attendance_embed(guild)
+    content_hash = _embed_hash(embed)
+    
+    # 3. Background refresh: edit in place when the report already lives in the channel
+    if message is not None and target_channel is None and message.channel.id == channel.id:
+        if report_hashes.get(guild.id) == content_hash:
+            REPORT_REFRESHES.labels("unchanged").inc()
+            return message
+        try:
+            await message.edit(embed=embed)
+            report_hashes[guild.id] = content_hash
+            REPORT_REFRESHES.labels("edited").inc()
+            return message
+        except discord.NotFound:
+            forget_report_message(guild.id)
+        except discord.Forbidden:
+            REPORT_REFRESHES.labels("forbidden").inc()
+            return None
+    elif message is not None:
+        # Explicit request or report moved to another channel: remove the old copy
+        try:
+            await message.delete()
+        except (discord.NotFound, discord.Forbidden):
+            pass
+        except Exception as e:
+            logger.error(f"Error deleting old report in {guild.name}: {e}")
+        forget_report_message(guild.id)
         
-    # 3. Send New Report
-    embed = create_attendance_embed(guild)
+    # 4. Send New Report
     try:
         new_msg = await channel.send(embed=embed)
-        
-        # 4. Update Tracking
-        data['last_report_message_id'] = new_msg.id
-        data['last_report_channel_id'] = channel.id
-        save_attendance_data(guild.id, data)
-        return new_msg
     except discord.Forbidden:
+        REPORT_REFRESHES.labels("forbidden").inc()
         return None
+    REPORT_REFRESHES.labels("sent").inc()
+    
+    # 5. Update Tracking
+    report_messages[guild.id] = channel.get_partial_message(new_msg.id)
+    report_hashes[guild.id] = content_hash
+    await database.update_guild_config_async(guild.id, last_report_message_id=new_msg.id, last_report_channel_id=channel.id)
+    return new_msg
 
 @bot.command(name='attendance')
 async def view_attendance(ctx):
@@ -1262,6 +1474,70 @@ async def view_attendance(ctx):
     """
     await refresh_attendance_report(ctx.guild, ctx.channel)
 
+@bot.command(name='history')
+@commands.has_permissions(manage_roles=True)
+async def attendance_history(ctx, days: int = 7):
+    """
+    Shows daily attendance counts for recent days.
+    Usage: !history (last 7 days)
+    Usage: !history 30
+    """
+    days = max(1, min(days, 60))
+    
+    # Philippines Time (UTC+8)
+    ph_tz = datetime.timezone(datetime.timedelta(hours=8))
+    today = datetime.datetime.now(ph_tz).date()
+    start_day = (today - datetime.timedelta(days=days - 1)).isoformat()
+    
+    rollup = await database.get_daily_rollup_async(ctx.guild.id, start_day=start_day)
+    if not rollup:
+        await ctx.send(f"No attendance history recorded in the last {days} day(s).")
+        return
+    
+    lines = []
+    for day in sorted(rollup, reverse=True):
+        counts = rollup[day]
+        lines.append(f"`{day}`  ✅ {counts.get('present', 0)}  ❌ {counts.get('absent', 0)}  ⚠️ {counts.get('excused', 0)}")
+    
+    embed = discord.Embed(title="Attendance History", description="\n".join(lines)[:4000], color=discord.Color.gold())
+    embed.set_footer(text=f"Last {days} day(s) • Present / Absent / Excused")
+    await ctx.send(embed=embed)
+
+@bot.command(name='looplag')
+@commands.has_permissions(administrator=True)
+async def loop_lag(ctx, entry: int = None):
+    """
+    Shows recent event loop stalls and where the loop was stuck.
+    Usage: !looplag (latest stalls)
+    Usage: !looplag 1 (stack of the most recent stall)
+    """
+    monitor = looplag.monitor
+    blocks = list(monitor.blocks)[::-1]
+    ph_tz = datetime.timezone(datetime.timedelta(hours=8))
+    
+    if entry is not None:
+        if not 1 <= entry <= len(blocks):
+            await ctx.send(f"No stall #{entry}; {len(blocks)} recorded.")
+            return
+        block = blocks[entry - 1]
+        when = datetime.datetime.fromtimestamp(block.at, ph_tz).strftime('%I:%M:%S %p')
+        stack = "\n".join(block.stack) or "(not captured)"
+        await ctx.send(f"**Stall #{entry}** at {when}: {block.lag * 1000:.0f}ms (task: {block.task or 'unknown'})\n"
+                       f"```\n{stack[-1800:]}\n```")
+        return
+    
+    lines = [f"Last lag **{monitor.last_lag * 1000:.1f}ms**, max **{monitor.max_lag * 1000:.1f}ms** "
+             f"(threshold {monitor.threshold * 1000:.0f}ms, {len(blocks)} stall(s) kept)"]
+    for i, block in enumerate(blocks[:10], start=1):
+        when = datetime.datetime.fromtimestamp(block.at, ph_tz).strftime('%I:%M:%S %p')
+        lines.append(f"`#{i}` {when} **{block.lag * 1000:.0f}ms** {block.site or 'site not captured'}"
+                     + (f" ({block.task})" if block.task else ""))
+    if not monitor.is_running():
+        lines.append("⚠️ The loop-lag monitor is not running.")
+    embed = discord.Embed(title="Event Loop Lag", description="\n".join(lines)[:4000], color=discord.Color.blue())
+    embed.set_footer(text="!looplag <n> shows the stack of stall n")
+    await ctx.send(embed=embed)
+
 @assign_attendance_role.error
 async def assign_role_error(ctx, error):
     if isinstance(error, commands.MissingPermissions):
@@ -1271,272 +1547,516 @@ async def assign_role_error(ctx, error):
     elif isinstance(error, commands.BadArgument):
         await ctx.send("Invalid role. Please ping a valid role.")
 
-@tasks.loop(minutes=1)
-async def check_attendance_expiry():
-    # Iterate over guilds first, then load data for each
-    for guild in bot.guilds:
-        settings = load_settings(guild.id)
-        data = load_attendance_data(guild.id)
+# Window-mode guilds are woken exactly at their next open/close instant by
+# window_scheduler (keyed by guild id) instead of being polled every minute.
+# Guilds due together are processed concurrently so one slow end-of-day
+# (hundreds of role edits) cannot hold up every other guild's transitions.
+EXPIRY_CONCURRENCY = int(os.getenv("EXPIRY_CONCURRENCY", 8))
+EXPIRY_GUILD_TIMEOUT = float(os.getenv("EXPIRY_GUILD_TIMEOUT", 300))
+WINDOW_RETRY_SECONDS = 60   # Retry delay after a failed or timed-out transition
+
+window_scheduler = scheduler.DeadlineScheduler("attendance-window")
+
+expiry_tick_stats = {
+    "ticks": 0,              # Scheduler wake-ups that processed at least one guild
+    "guilds": 0,             # Guild transitions checked
+    "last_duration": 0.0,
+    "max_duration": 0.0,
+    "guild_errors": 0,
+    "guild_timeouts": 0,
+}
+
+async def schedule_window_transition(guild_id, delay=None):
+    """Aims window_scheduler at the guild's next transition (or `delay` seconds from now)."""
+    window = (await get_message_triggers(guild_id)).window
+    if window is None:
+        window_scheduler.cancel(guild_id)
+    elif delay is not None:
+        window_scheduler.schedule(guild_id, time.time() + delay)
+    else:
+        window_scheduler.schedule(guild_id, window.next_transition().timestamp())
+
+async def process_window_transitions(guild_ids):
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(EXPIRY_CONCURRENCY)
+    guilds = [guild for guild in map(bot.get_guild, guild_ids) if guild is not None]
+    await asyncio.gather(*(check_guild_window_guarded(guild, semaphore) for guild in guilds))
+    
+    duration = time.perf_counter() - started
+    EXPIRY_PASS_SECONDS.labels("window").observe(duration)
+    expiry_tick_stats["ticks"] += 1
+    expiry_tick_stats["guilds"] += len(guilds)
+    expiry_tick_stats["last_duration"] = duration
+    expiry_tick_stats["max_duration"] = max(expiry_tick_stats["max_duration"], duration)
+
+async def check_guild_window_guarded(guild, semaphore):
+    """Runs one guild's window check under the shared semaphore, isolating its timeouts and errors."""
+    retry = None
+    async with semaphore:
+        try:
+            await asyncio.wait_for(check_guild_window(guild), timeout=EXPIRY_GUILD_TIMEOUT)
+        except asyncio.TimeoutError:
+            expiry_tick_stats["guild_timeouts"] += 1
+            retry = WINDOW_RETRY_SECONDS
+            logger.error(f"Attendance window check for {guild.name} timed out after {EXPIRY_GUILD_TIMEOUT:.0f}s")
+        except Exception as e:
+            expiry_tick_stats["guild_errors"] += 1
+            retry = WINDOW_RETRY_SECONDS
+            logger.error(f"Attendance window check failed for {guild.name}: {e}", exc_info=True)
+    try:
+        await schedule_window_transition(guild.id, delay=retry)
+    except Exception as e:
+        logger.error(f"Failed to schedule attendance window for {guild.name}: {e}")
+        window_scheduler.schedule(guild.id, time.time() + WINDOW_RETRY_SECONDS)
+
+async def check_guild_window(guild):
+    """Opens the window / runs end-of-day for one window-mode guild when due."""
+    window = (await get_message_triggers(guild.id)).window
+    if window is None:
+        return
+    
+    config = await database.get_guild_config_async(guild.id) or {}
+    now = datetime.datetime.now(windows.PH_TZ)
+    
+    if window.is_open(now):
+        # Automatically post/refresh report when window opens. An overnight
+        # window belongs to the day it opened on.
+        session_day = window.current_session_day(now)
+        if config.get('last_opened_date') != session_day:
+            logger.info(f"Opening attendance window for {guild.name}")
+            await refresh_attendance_report(guild)
+            # Only this column: other settings may have changed since config was read
+            await database.update_guild_config_async(guild.id, last_opened_date=session_day)
+    else:
+        # Close out the most recent session if that has not happened yet
+        target_date_to_process = window.last_closed_session_day(now)
+        if config.get('last_processed_date') != target_date_to_process:
+            await run_end_of_day(guild, target_date_to_process)
+
+# --- End of Day (Window Mode) ---
+# Runs as a persisted job (see database.EOD_STEPS) so a restart resumes from
+# the last finished step and member instead of repeating Discord calls.
+
+eod_locks = {}  # guild_id -> asyncio.Lock, so a resumed job and the window check never overlap
+# Runs of the 'roles' step that may end with failed member edits before the job moves on without them
+EOD_ROLE_ATTEMPTS = int(os.getenv("EOD_ROLE_ATTEMPTS", 5))
+eod_role_attempts = {}  # (guild_id, day) -> runs of the 'roles' step that left members pending
+
+async def run_end_of_day(guild, day):
+    """Runs (or resumes) the end-of-day job for a window-mode guild."""
+    lock = eod_locks.setdefault(guild.id, asyncio.Lock())
+    async with lock:
+        job = await database.start_eod_job_async(guild.id, day)
+        step = job['step']
+        if step == 'done':
+            return
+        if step == 'plan':
+            logger.info(f"Triggering End-of-Day for {guild.name} (Date: {day})")
+        else:
+            logger.info(f"Resuming End-of-Day for {guild.name} (Date: {day}) at step '{step}'")
         
-        mode = settings.get('attendance_mode', 'duration')
-        expiry_hours = settings.get("attendance_expiry_hours", 12)
-        records = data.get('records', {})
+        # 1. Auto-Absent Logic (records and role work are persisted together)
+        if step == 'plan':
+            await plan_end_of_day(guild, day)
+            step = 'report'
         
-        # --- End of Day / Session Logic (Window Mode) ---
-        if mode == 'window':
-            start_str = settings.get('window_start_time', '00:00')
-            end_str = settings.get('window_end_time', '23:59')
-            last_processed = settings.get('last_processed_date') # e.g., "2024-02-01"
-            
-            try:
-                # Use Philippines Time (UTC+8)
-                ph_tz = datetime.timezone(datetime.timedelta(hours=8))
-                now = datetime.datetime.now(ph_tz)
-                today_str = now.strftime("%Y-%m-%d")
-                
-                t_start = datetime.datetime.strptime(start_str, "%H:%M").time()
-                t_end = datetime.datetime.strptime(end_str, "%H:%M").time()
-                
-                # Construct datetime objects for comparison (make them timezone-aware)
-                dt_start = datetime.datetime.combine(now.date(), t_start).replace(tzinfo=ph_tz)
-                dt_end = datetime.datetime.combine(now.date(), t_end).replace(tzinfo=ph_tz)
-                
-                # --- START OF WINDOW LOGIC ---
-                # Automatically post/refresh report when window opens
-                last_opened = settings.get('last_opened_date')
-                
-                if now >= dt_start and now < dt_end:
-                     if last_opened != today_str:
-                         logger.info(f"Opening attendance window for {guild.name}")
-                         await refresh_attendance_report(guild)
-                         settings['last_opened_date'] = today_str
-                         save_settings(guild.id, settings)
-                
-                target_date_to_process = None
-                
-                # Check 1: Post-Shift (Same Day)
-                # If we are past the end time today
-                if now > dt_end:
-                    target_date_to_process = today_str
-                    
-                # Check 2: Pre-Shift (Next Day / Overnight)
-                # If we are before the start time, we might need to close out yesterday
-                # (Logic: If we haven't closed out yesterday, do it now)
-                elif now < dt_start:
-                    yesterday = now - datetime.timedelta(days=1)
-                    target_date_to_process = yesterday.strftime("%Y-%m-%d")
-
-                # Handle Cross-Midnight windows (Start > End, e.g. 22:00 to 06:00)
-                # Not fully supported by this simple logic yet, but user asked for 6am-11:59pm
-                
-                if target_date_to_process and last_processed != target_date_to_process:
-                    logger.info(f"Triggering End-of-Day for {guild.name} (Date: {target_date_to_process})")
-                    
-                    # 1. Auto-Absent Logic
-                    allowed_role_id = data.get('allowed_role_id')
-                    absent_role_id = data.get('absent_role_id')
-                    
-                    if allowed_role_id:
-                        allowed_role = guild.get_role(allowed_role_id)
-                        if allowed_role:
-                            # Identify missing users
-                            present_ids = set(records.keys())
-                            missing_members = [m for m in allowed_role.members if str(m.id) not in present_ids and not m.bot]
-                            
-                            # Mark them absent
-                            if missing_members:
-                                absent_role = guild.get_role(absent_role_id) if absent_role_id else None
-                                
-                                for member in missing_members:
-                                    # Add to records
-                                    records[str(member.id)] = {
-                                        "status": "absent",
-                                        "timestamp": now.isoformat(),
-                                        "reason": "Auto-marked at end of attendance window"
-                                    }
-                                    
-                                    # Give absent role
-                                    if absent_role:
-                                        try:
-                                            await member.add_roles(absent_role)
-                                        except discord.Forbidden:
-                                            pass
-                                            
-                                logger.info(f"Marked {len(missing_members)} users as absent in {guild.name}")
-                    else:
-                        logger.warning(f"Cannot auto-mark absences for {guild.name}: No 'allowed_role' configured.")
-                    
-                    # 2. Generate and Post Report
-                    # Save data first so embed is accurate
-                    data['records'] = records
-                    save_attendance_data(guild.id, data)
-                    
-                    await refresh_attendance_report(guild)
-
-                    # 3. Reset/Clear Data ("Old attendance will be out")
-                    # Remove 'present' roles
-                    present_role_id = data.get('attendance_role_id')
-                    if present_role_id:
-                        role = guild.get_role(present_role_id)
-                        if role:
-                            for uid in list(records.keys()):
-                                member = guild.get_member(int(uid))
-                                if member and role in member.roles:
-                                    try:
-                                        await member.remove_roles(role)
-                                    except: pass
-
-                    # Clear Records
-                    data['records'] = {}
-                    
-                    # Update Settings
-                    settings['last_processed_date'] = target_date_to_process
-                    save_settings(guild.id, settings)
-                    save_attendance_data(guild.id, data)
-                    
-                    logger.info(f"Attendance reset complete for {guild.name}")
-                    
-            except ValueError as e:
-                logger.error(f"Error parsing time settings for {guild.name}: {e}")
-                
-        # --- End of Window Logic ---
+        # 2. Generate and Post Report
+        if step == 'report':
+            # Publish the final tally now; a debounced refresh must not land after the clear
+            cancel_report_refresh(guild.id)
+            await refresh_attendance_report(guild)
+            await database.set_eod_job_step_async(guild.id, day, 'roles')
+            step = 'roles'
         
-        # Determine if we should expire individual users (Duration Mode Only)
-        # Window mode now handles bulk expiry/reset above.
-        if mode == 'window':
-            continue 
-
-        # ... Existing Duration Mode Logic Below ...
+        # 3. Absent roles and present-role removals, one edit per member
+        if step == 'roles':
+            result = await run_end_of_day_roles(guild, day)
+            pending = result.forbidden + result.failed
+            if pending:
+                attempts = eod_role_attempts.get((guild.id, day), 0) + 1
+                eod_role_attempts[(guild.id, day)] = attempts
+                if attempts < EOD_ROLE_ATTEMPTS:
+                    # Failed members stay pending; the window check retries the job shortly
+                    raise RuntimeError(f"{pending} member role edit(s) failed "
+                                       f"(attempt {attempts}/{EOD_ROLE_ATTEMPTS})")
+                logger.error(f"Giving up on {pending} member role edit(s) in {guild.name} "
+                             f"after {attempts} attempts")
+            eod_role_attempts.pop((guild.id, day), None)
+            await database.set_eod_job_step_async(guild.id, day, 'clear')
+            step = 'clear'
         
-        # Get all role IDs
-        role_map = {
-            'present': data.get('attendance_role_id'),
-            'absent': data.get('absent_role_id'),
-            'excused': data.get('excused_role_id')
-        }
-        ping_role_id = data.get('ping_role_id')
+        # 4. Reset/Clear Data ("Old attendance will be out") and mark the day processed
+        if step == 'clear':
+            await database.finish_eod_job_async(guild.id, day)
+            note_record_changes(guild.id, cleared=True)
+        
+        logger.info(f"Attendance reset complete for {guild.name}")
+
+async def plan_end_of_day(guild, day):
+    """Marks missing members absent and records which member roles end-of-day must change."""
+    data = await load_attendance_data(guild.id)
+    records = data.get('records', {})
+    now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=8)))
+    
+    absent_records = {}
+    role_work = {}  # user_id -> [add_role_id, remove_role_id]
     
-        now = datetime.datetime.now()
-        users_to_remove = []
-        users_to_update = {} 
+    allowed_role_id = data.get('allowed_role_id')
+    absent_role_id = data.get('absent_role_id')
+    
+    if allowed_role_id:
+        allowed_role = guild.get_role(allowed_role_id)
+        if allowed_role:
+            # Identify missing users
+            missing_members = [m for m in allowed_role.members if str(m.id) not in records and not m.bot]
+            absent_role = guild.get_role(absent_role_id) if absent_role_id else None
+            
+            for member in missing_members:
+                absent_records[str(member.id)] = {
+                    "status": "absent",
+                    "timestamp": now.isoformat(),
+                    "reason": "Auto-marked at end of attendance window"
+                }
+                if absent_role:
+                    role_work[member.id] = [absent_role.id, None]
+            
+            if missing_members:
+                logger.info(f"Marked {len(missing_members)} users as absent in {guild.name}")
+    else:
+        logger.warning(f"Cannot auto-mark absences for {guild.name}: No 'allowed_role' configured.")
+    
+    # Remove 'present' roles from everyone who has a record
+    present_role_id = data.get('attendance_role_id')
+    role = guild.get_role(present_role_id) if present_role_id else None
+    if role:
+        for uid in records:
+            member = guild.get_member(int(uid))
+            if member and role in member.roles:
+                role_work.setdefault(member.id, [None, None])[1] = role.id
+    
+    await database.plan_eod_job_async(guild.id, day, absent_records,
+                                      [(uid, add, remove) for uid, (add, remove) in role_work.items()])
+    note_record_changes(guild.id, absent_records)
 
-        for user_id_str, info in records.items():
-            # Handle migration/fallback
-            if isinstance(info, str):
-                info = {"status": "present", "timestamp": info, "channel_id": None}
+async def run_end_of_day_roles(guild, day):
+    """
+    Applies the job's outstanding member role changes, checkpointing each member
+    once its edit succeeds, and returns the RoleChangeResult.
+    """
+    jobs = []
+    skipped = []  # Members who left (or whose roles were deleted) need no call
+    for user_id, add_role_id, remove_role_id in await database.get_eod_job_members_async(guild.id, day):
+        member = guild.get_member(user_id)
+        add_role = guild.get_role(add_role_id) if add_role_id else None
+        remove_role = guild.get_role(remove_role_id) if remove_role_id else None
+        if member is None or not (add_role or remove_role):
+            skipped.append(user_id)
+            continue
+        if add_role:
+            jobs.append((member, add_role, True))
+        if remove_role:
+            jobs.append((member, remove_role, False))
+    if skipped:
+        await database.mark_eod_members_done_async(guild.id, day, skipped)
+    
+    async def checkpoint(members):
+        await database.mark_eod_members_done_async(guild.id, day, [m.id for m in members])
+    
+    return await role_engine.apply_role_changes(guild, jobs, on_done=checkpoint)
+
+async def resume_end_of_day_jobs():
+    """Finishes end-of-day jobs interrupted by a restart."""
+    for job in await database.get_unfinished_eod_jobs_async():
+        guild = bot.get_guild(job['guild_id'])
+        if guild is None:
+            continue
+        try:
+            await run_end_of_day(guild, job['day'])
+        except Exception as e:
+            logger.error(f"Failed to resume End-of-Day for {guild.name}: {e}", exc_info=True)
+
+# --- Duration Mode Expiry ---
+# attendance_records.expires_at (indexed) is the source of truth. expiry_scheduler
+# sleeps until the earliest expires_at, then one range scan fetches everything
+# due across all guilds; record writes only ever pull the wake-up earlier.
+
+expiry_scheduler = scheduler.DeadlineScheduler("attendance-expiry")
+EXPIRY_WAKEUP = "attendance-records"
+# Wake-ups trail the first deadline by this much so a shift expiring together
+# is handled (and notified) in one pass rather than one user per second
+EXPIRY_COALESCE_SECONDS = float(os.getenv("EXPIRY_COALESCE_SECONDS", 30))
+# A guild whose expiry pass fails is retried after this delay, doubling per failed pass up to the max
+EXPIRY_RETRY_SECONDS = float(os.getenv("EXPIRY_RETRY_SECONDS", 30))
+EXPIRY_RETRY_MAX_SECONDS = float(os.getenv("EXPIRY_RETRY_MAX_SECONDS", 900))
+expiry_retry = {"delay": EXPIRY_RETRY_SECONDS}
+
+def record_timestamp(info):
+    """Returns a record's timestamp as epoch seconds, or None if it is missing or does not parse."""
+    if isinstance(info, str):
+        info = {"timestamp": info}
+    timestamp_str = info.get('timestamp')
+    if not timestamp_str:
+        return None
+    try:
+        # Naive timestamps come from datetime.now() (server local time)
+        return datetime.datetime.fromisoformat(str(timestamp_str)).timestamp()
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+def record_deadline(info, expiry_hours):
+    """Returns the epoch second at which a record expires, or None if it has no usable timestamp."""
+    marked_at = record_timestamp(info)
+    return marked_at + expiry_hours * 3600 if marked_at is not None else None
+
+def _cached_expiry_settings(guild_id):
+    """Returns (mode, expiry_hours) from the config cache without touching SQLite."""
+    config = database.config_cache.get(guild_id)
+    if not config or config is database.GuildConfigCache.MISSING:
+        return DEFAULT_SETTINGS['attendance_mode'], DEFAULT_SETTINGS['attendance_expiry_hours']
+    return (config.get('attendance_mode') or DEFAULT_SETTINGS['attendance_mode'],
+            config.get('attendance_expiry_hours') or DEFAULT_SETTINGS['attendance_expiry_hours'])
+
+def wake_expiry_at(due_at):
+    """Moves the expiry wake-up earlier if due_at comes before it."""
+    wake_at = due_at + EXPIRY_COALESCE_SECONDS
+    current = expiry_scheduler.next_due()
+    if current is None or wake_at < current:
+        expiry_scheduler.schedule(EXPIRY_WAKEUP, wake_at)
+
+def note_record_expiries(guild_id, upserts=None, deletes=(), cleared=False):
+    """Pulls the expiry wake-up forward for newly written records (removals need nothing)."""
+    mode, expiry_hours = _cached_expiry_settings(guild_id)
+    if mode != 'duration':
+        return
+    for info in (upserts or {}).values():
+        due_at = record_deadline(info, expiry_hours)
+        wake_expiry_at(due_at if due_at is not None else time.time())
+
+async def reschedule_expiries():
+    """Points the wake-up at the earliest expires_at in the database."""
+    next_due = await database.get_next_expiry_async()
+    expiry_scheduler.cancel(EXPIRY_WAKEUP)
+    if next_due is not None:
+        wake_expiry_at(next_due)
+
+async def process_due_expiries(keys):
+    """expiry_scheduler callback: expires everything due, grouped per guild."""
+    started = time.perf_counter()
+    now = int(time.time())
+    by_guild = {}
+    for row in await database.get_due_records_async(now):
+        by_guild.setdefault(row['guild_id'], []).append(row)
+    failed = False
+    for guild_id, rows in by_guild.items():
+        guild = bot.get_guild(guild_id)
+        try:
+            if guild is not None:
+                await expire_duration_records(guild, rows)
+            elif bot.is_ready():
+                # The bot has left this guild: nothing to expire, so drop the rows
+                # rather than scanning them on every pass
+                user_ids = [str(row['user_id']) for row in rows]
+                await database.apply_record_changes_async(guild_id, {}, user_ids)
+                note_record_changes(guild_id, deletes=user_ids)
+                logger.info(f"Dropped {len(user_ids)} expired record(s) of unknown guild {guild_id}")
+            else:
+                failed = True  # Guild cache not loaded yet
+        except Exception as e:
+            failed = True
+            logger.error(f"Error expiring attendance in {guild.name if guild else guild_id}: {e}", exc_info=True)
+    
+    next_due = await database.get_next_expiry_async(after=now)
+    if next_due is not None:
+        wake_expiry_at(next_due)
+    # Rows left behind are still due, so the next deadline would not cover them; retry with backoff
+    if failed:
+        retry_at = time.time() + expiry_retry["delay"]
+        expiry_retry["delay"] = min(expiry_retry["delay"] * 2, EXPIRY_RETRY_MAX_SECONDS)
+        current = expiry_scheduler.next_due()
+        if current is None or retry_at < current:
+            expiry_scheduler.schedule(EXPIRY_WAKEUP, retry_at)
+    else:
+        expiry_retry["delay"] = EXPIRY_RETRY_SECONDS
+    EXPIRY_PASS_SECONDS.labels("duration").observe(time.perf_counter() - started)
+
+async def expire_duration_records(guild, rows):
+    """Expires the given due records of one guild (Duration Mode Only)."""
+    data = await database.get_guild_config_async(guild.id) or {}
+    if (data.get('attendance_mode') or 'duration') != 'duration':
+        return
+    
+    # Get all role IDs
+    role_map = {
+        'present': data.get('attendance_role_id'),
+        'absent': data.get('absent_role_id'),
+        'excused': data.get('excused_role_id')
+    }
+    ping_role_id = data.get('ping_role_id')
+
+    now = datetime.datetime.now()
+    users_to_remove = []
+    users_to_update = {} 
+    notices = {}  # channel_id -> (channel, [mention])
+    role_jobs = []  # (member, role, add), applied in bulk by role_engine
+    absent_role = guild.get_role(role_map['absent']) if role_map['absent'] else None
+
+    for info in rows:
+        user_id_str = str(info['user_id'])
+        status = info.get('status') or 'present'
+        channel_id = info.get('channel_id')
+        role_id = role_map.get(status)
+
+        user_id = int(user_id_str)
+        member = guild.get_member(user_id)
+        
+        # 1. Remove current role
+        if member and role_id:
+            role = guild.get_role(role_id)
+            if role:
+                role_jobs.append((member, role, False))
+        
+        # 2. Determine Channel
+        channel = None
+        if channel_id:
+            channel = guild.get_channel(channel_id)
+        if not channel and data.get('welcome_channel_id'):
+            channel = guild.get_channel(data.get('welcome_channel_id'))
+
+        # 3. Handle Transitions
+        if status == 'present' and record_timestamp(info) is not None:
+            # Transition to ABSENT
+            if absent_role and member:
+                role_jobs.append((member, absent_role, True))
             
-            timestamp_str = info.get('timestamp')
-            status = info.get('status', 'present')
-            channel_id = info.get('channel_id')
-            role_id = role_map.get(status)
+            # Schedule update to 'absent'
+            users_to_update[user_id_str] = {
+                "status": "absent",
+                "timestamp": now.isoformat(), 
+                "channel_id": channel_id
+            }
 
-            if not timestamp_str:
-                users_to_remove.append(user_id_str)
-                continue
+            # Notify (collected per channel, sent as digests below)
+            if channel and member:
+                notices.setdefault(channel.id, (channel, []))[1].append(member.mention)
 
-            try:
-                timestamp = datetime.datetime.fromisoformat(str(timestamp_str))
-                should_expire = False
-                
-                if mode == 'window':
-                    # In window mode, we expire if we are outside the window AND they are still present
-                    # We assume if they are 'present', they haven't been expired yet.
-                    if expire_all_present and status == 'present':
-                        should_expire = True
-                else:
-                    # Duration mode
-                    if now - timestamp > datetime.timedelta(hours=expiry_hours):
-                        should_expire = True
+        else:
+            # For absent/excused (or records without a usable timestamp), just remove the record
+            users_to_remove.append(user_id_str)
 
-                if should_expire:
-                    user_id = int(user_id_str)
-                    member = guild.get_member(user_id)
-                    
-                    # 1. Remove current role
-                    if member and role_id:
-                        role = guild.get_role(role_id)
-                        if role and role in member.roles:
-                            try:
-                                await member.remove_roles(role)
-                                logger.info(f"Removed {status} role from {member.name} (expired)")
-                            except discord.Forbidden:
-                                logger.warning(f"Failed to remove role from {member.name}: Missing Permissions")
-                    
-                    # 2. Determine Channel
-                    channel = None
-                    if channel_id:
-                        channel = guild.get_channel(channel_id)
-                    if not channel and data.get('welcome_channel_id'):
-                        channel = guild.get_channel(data.get('welcome_channel_id'))
-
-                    # 3. Handle Transitions
-                    if status == 'present':
-                        # Transition to ABSENT
-                        absent_role_id = data.get('absent_role_id')
-                        if absent_role_id:
-                            absent_role = guild.get_role(absent_role_id)
-                            if absent_role and member:
-                                try:
-                                    await member.add_roles(absent_role)
-                                except: pass
-                        
-                        # Schedule update to 'absent'
-                        users_to_update[user_id_str] = {
-                            "status": "absent",
-                            "timestamp": now.isoformat(), 
-                            "channel_id": channel_id
-                        }
-
-                        # Notify
-                        if channel:
-                            msg_content = f"{member.mention}, your attendance session has expired."
-                            if ping_role_id:
-                                ping_role = guild.get_role(ping_role_id)
-                                if ping_role:
-                                    msg_content = f"{ping_role.mention} " + msg_content
-                            msg_content += f"\nYou have been marked as **Absent**. You are now allowed to say **present** again."
-                            await channel.send(msg_content)
-
-                    else:
-                        # For absent/excused, just remove the record
-                        users_to_remove.append(user_id_str)
-                                    
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error parsing timestamp for user {user_id_str}: {e}")
-                users_to_remove.append(user_id_str)
-
-        # Apply Updates
-        if users_to_update:
-            for uid, new_record in users_to_update.items():
-                data['records'][uid] = new_record
-                
-        # Apply Removals
-        if users_to_remove:
-            users_to_remove = list(set(users_to_remove))
-            for uid in users_to_remove:
-                if uid in data['records'] and uid not in users_to_update:
-                    del data['records'][uid]
-                    
-        if users_to_update or users_to_remove:
-            save_attendance_data(guild.id, data)
+    # One rate-limit-aware edit per member instead of a remove and an add call each
+    if role_jobs:
+        await role_engine.apply_role_changes(guild, role_jobs, reason="Attendance session expired")
+    
+    if users_to_update or users_to_remove:
+        await database.apply_record_changes_async(guild.id, users_to_update, users_to_remove, expired=True)
+        note_record_changes(guild.id, users_to_update, users_to_remove)
+    
+    ping_role = guild.get_role(ping_role_id) if ping_role_id else None
+    for channel, mentions in notices.values():
+        await send_expiry_digest(channel, mentions, ping_role)
+
+DISCORD_MESSAGE_LIMIT = 2000
+
+def build_mention_digests(mentions, head="", tail="", limit=DISCORD_MESSAGE_LIMIT):
+    """Packs mentions into as few `head + mentions + tail` messages as fit under limit."""
+    budget = limit - len(head) - len(tail)
+    messages = []
+    line = ""
+    for mention in mentions:
+        candidate = f"{line} {mention}" if line else mention
+        if line and len(candidate) > budget:
+            messages.append(head + line + tail)
+            candidate = mention
+        line = candidate
+    if line:
+        messages.append(head + line + tail)
+    return messages
+
+async def send_expiry_digest(channel, mentions, ping_role=None):
+    """Tells many users at once that their session expired; the ping role is mentioned once per message."""
+    head = f"{ping_role.mention} " if ping_role else ""
+    tail = (", your attendance session has expired."
+            "\nYou have been marked as **Absent**. You are now allowed to say **present** again.")
+    for content in build_mention_digests(mentions, head, tail):
+        try:
+            await channel.send(content)
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to send expiry notice in #{channel.name}: {e}")
+
+# --- Health Server ---
+# Served from the bot's own event loop, so /healthz answering means the loop is alive.
+
+def gateway_ready():
+    return bot.is_ready() and not bot.is_closed() and bot.ws is not None and bot.ws.open
+
+def expiry_loops_running():
+    return expiry_scheduler.is_running() and window_scheduler.is_running()
+
+READY_CHECKS = {
+    "gateway": gateway_ready,
+    "database": database.ping_async,
+    "expiry": expiry_loops_running,
+}
+
+async def setup_hook():
+    # Runs inside bot.run's loop right after login, before the gateway connects
+    await keep_alive.keep_alive(READY_CHECKS)
+
+bot.setup_hook = setup_hook
 
 @bot.event
 async def on_ready():
     logger.info(f'Logged in as {bot.user.name}')
     logger.info('Bot is ready to auto-nickname users!')
     
+    # Sample event loop lag and capture the stack of anything that blocks it
+    looplag.monitor.start()
+    
     # Initialize Database
     try:
-        database.init_db()
+        await database.init_db_async()
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         
-    if not check_attendance_expiry.is_running():
-        check_attendance_expiry.start()
+    # Check every guild's window once now; each is then woken at its next transition
+    if not window_scheduler.is_running():
+        now = time.time()
+        for guild in bot.guilds:
+            window_scheduler.schedule(guild.id, now)
+        window_scheduler.start(process_window_transitions)
+    
+    # Pick up any end-of-day job a restart interrupted
+    asyncio.create_task(resume_end_of_day_jobs())
+    
+    # Duration-mode expiry sleeps until the earliest expires_at in the database
+    if not expiry_scheduler.is_running():
+        try:
+            await reschedule_expiries()
+        except Exception as e:
+            logger.error(f"Failed to schedule attendance expiry: {e}")
+        expiry_scheduler.start(process_due_expiries)
     
     # Register persistent views
     bot.add_view(AttendanceView(bot))
 
+def build_confirmation_embed(guild):
+    """The "Attendance Confirmed" DM sent after a successful present mark."""
+    embed = discord.Embed(
+        title="✅ Attendance Confirmed",
+        description="Your attendance has been checked successfully.",
+        color=discord.Color.green()
+    )
+    if guild.icon:
+        embed.set_author(name=guild.name, icon_url=guild.icon.url)
+        embed.set_thumbnail(url=guild.icon.url)
+    else:
+        embed.set_author(name=guild.name)
+
+    embed.add_field(name="Status", value="Present", inline=True)
+    embed.add_field(name="Note", value="You will be notified once the 12-hour period has expired, after which you will be allowed to mark yourself as present again.", inline=False)
+    embed.set_footer(text=f"Created by Calvin • Server: {guild.name}")
+    return embed
+
 # --- Persistent Views for Attendance ---
 
 class ExcuseModal(discord.ui.Modal, title="Excuse Reason"):
@@ -1571,8 +2091,8 @@ class AttendanceView(discord.ui.View):
         # The modal should open first, then we check? Or check first?
         # Checking first is better UX.
         
-        settings = load_settings()
-        if settings.get('require_admin_excuse', True) and not interaction.user.guild_permissions.manage_roles:
+        triggers = await get_message_triggers(interaction.guild.id)
+        if triggers.require_admin_excuse and not interaction.user.guild_permissions.manage_roles:
             await interaction.response.send_message("Only admins can mark users as excused.", ephemeral=True)
             return
             
@@ -1581,35 +2101,38 @@ class AttendanceView(discord.ui.View):
 
     async def handle_attendance(self, interaction, status, reason=None):
         user = interaction.user
+        triggers = await get_message_triggers(interaction.guild.id)
         
         # Check Window (only for present)
-        if status == 'present':
-            allowed, msg = is_in_attendance_window(interaction.guild.id)
-            if not allowed:
-                 await interaction.response.send_message(msg, ephemeral=True)
-                 return
+        if status == 'present' and not triggers.in_window():
+             await interaction.response.send_message(triggers.window.message, ephemeral=True)
+             return
 
         # Check self-marking setting (only for present)
-        settings = load_settings(interaction.guild.id)
-        if status == 'present' and not settings.get('allow_self_marking', True):
+        if status == 'present' and not triggers.allow_self_marking:
              await interaction.response.send_message("Self-marking is currently disabled.", ephemeral=True)
              return
 
         # Check permitted role
-        data = load_attendance_data(interaction.guild.id)
-        allowed_role_id = data.get('allowed_role_id')
-        if allowed_role_id:
-            allowed_role = interaction.guild.get_role(allowed_role_id)
+        if triggers.allowed_role_id:
+            allowed_role = interaction.guild.get_role(triggers.allowed_role_id)
             if allowed_role and allowed_role not in user.roles:
                 await interaction.response.send_message(f"You need the {allowed_role.mention} role to use this.", ephemeral=True)
                 return
 
+        # Check if already marked (prevent spamming present)
+        if status == 'present':
+            index = await get_presence_index(interaction.guild.id)
+            if index.status(user.id) == 'present':
+                await interaction.response.send_message("You have already marked your attendance!", ephemeral=True)
+                return
+
         # If it's a modal submission (interaction.type == modal_submit), we don't need to defer usually if we reply quickly.
         # But process_status_update might take a moment.
         if not interaction.response.is_done():
              await interaction.response.defer(ephemeral=True)
         
-        await self.process_status_update(interaction, user, status, reason)
+        await self.process_status_update(interaction, user, status, reason, triggers)
         
         msg = f"Successfully marked as **{status.upper()}**!"
         if reason:
@@ -1620,48 +2143,15 @@ class AttendanceView(discord.ui.View):
         else:
             await interaction.response.send_message(msg, ephemeral=True)
 
-    async def process_status_update(self, interaction, member, status, reason=None):
+    async def process_status_update(self, interaction, member, status, reason=None, triggers=None):
         # Logic duplicated/adapted from update_user_status to avoid ctx dependency
-        data = load_attendance_data(interaction.guild.id)
-        present_role_id = data.get('attendance_role_id')
-        absent_role_id = data.get('absent_role_id')
-        excused_role_id = data.get('excused_role_id')
-        
-        target_role_id = None
-        roles_to_remove = []
-        
-        if status == 'present':
-            target_role_id = present_role_id
-            if absent_role_id: roles_to_remove.append(absent_role_id)
-            if excused_role_id: roles_to_remove.append(excused_role_id)
-        elif status == 'excused':
-            target_role_id = excused_role_id
-            if present_role_id: roles_to_remove.append(present_role_id)
-            if absent_role_id: roles_to_remove.append(absent_role_id)
-            
-        guild = interaction.guild
-        
-        # Remove roles
-        for rid in roles_to_remove:
-            role = guild.get_role(rid)
-            if role and role in member.roles:
-                try:
-                    await member.remove_roles(role)
-                except: pass
-
-        # Add role
-        if target_role_id:
-            role = guild.get_role(target_role_id)
-            if role:
-                try:
-                    await member.add_roles(role)
-                except: pass
+        if triggers is None:
+            triggers = await get_message_triggers(interaction.guild.id)
+        await role_engine.apply_role_changes(
+            interaction.guild, status_role_jobs(interaction.guild, member, status, triggers))
         
         # Save record
         user_id = str(member.id)
-        if 'records' not in data:
-            data['records'] = {}
-        
         record = {
             "status": status,
             "timestamp": datetime.datetime.now().isoformat()
@@ -1669,32 +2159,14 @@ class AttendanceView(discord.ui.View):
         if reason:
             record["reason"] = reason
             
-        data['records'][user_id] = record
-        save_attendance_data(interaction.guild.id, data)
+        await set_attendance_record(interaction.guild.id, user_id, record)
 
         # Update Report
-        await refresh_attendance_report(interaction.guild)
+        request_report_refresh(interaction.guild)
 
-        # Send DM if present
+        # Send DM if present (delivered in the background)
         if status == 'present':
-             try:
-                 embed = discord.Embed(
-                    title="✅ Attendance Confirmed",
-                    description="Your attendance has been checked successfully.",
-                    color=discord.Color.green()
-                 )
-                 if interaction.guild.icon:
-                     embed.set_author(name=interaction.guild.name, icon_url=interaction.guild.icon.url)
-                     embed.set_thumbnail(url=interaction.guild.icon.url)
-                 else:
-                     embed.set_author(name=interaction.guild.name)
-
-                 embed.add_field(name="Status", value="Present", inline=True)
-                 embed.add_field(name="Note", value="You will be notified once the 12-hour period has expired, after which you will be allowed to mark yourself as present again.", inline=False)
-                 embed.set_footer(text=f"Created by Calvin • Server: {interaction.guild.name}")
-                 await member.send(embed=embed)
-             except:
-                 pass
+            dm_outbox.send(member, embed=build_confirmation_embed(interaction.guild))
 
 @bot.command(name='assignchannel')
 @commands.has_permissions(administrator=True)
@@ -1708,9 +2180,9 @@ async def assign_report_channel(ctx, channel: discord.TextChannel = None):
         return
 
     try:
-        data = load_attendance_data(ctx.guild.id)
+        data = await load_attendance_data(ctx.guild.id)
         data['report_channel_id'] = channel.id
-        save_attendance_data(ctx.guild.id, data)
+        await save_attendance_data(ctx.guild.id, data)
         
         logger.info(f"Report channel set to {channel.name} ({channel.id}) for guild {ctx.guild.id}")
         await ctx.send(f"✅ Attendance reports will now be sent to {channel.mention}.")
@@ -1753,18 +2225,65 @@ async def on_command_error(ctx, error):
     logger.error(f"Command error in {ctx.command}: {error}", exc_info=True)
     await ctx.send(f"❌ An error occurred while executing the command: `{error}`")
 
+# --- Message Triggers ---
+# on_message sees every message in every guild. The per-guild settings it needs
+# are compiled once into a MessageTriggers and kept in memory (dropped whenever
+# the guild config is written), so keyword checks never touch the database.
+
+class MessageTriggers:
+    __slots__ = ("present_role_id", "absent_role_id", "excused_role_id", "allowed_role_id",
+                 "allow_self_marking", "require_admin_excuse", "window")
+
+    def __init__(self, config):
+        config = config or {}
+        self.present_role_id = config.get('attendance_role_id')
+        self.absent_role_id = config.get('absent_role_id')
+        self.excused_role_id = config.get('excused_role_id')
+        self.allowed_role_id = config.get('allowed_role_id')
+        self.allow_self_marking = bool(config.get('allow_self_marking', DEFAULT_SETTINGS['allow_self_marking']))
+        self.require_admin_excuse = bool(config.get('require_admin_excuse', DEFAULT_SETTINGS['require_admin_excuse']))
+        self.window = None  # windows.WindowSchedule in window mode
+        if config.get('attendance_mode') == 'window':
+            try:
+                self.window = windows.WindowSchedule.compile(
+                    config.get('window_start_time') or '00:00', config.get('window_end_time') or '23:59')
+            except ValueError as e:
+                logger.error(f"Error parsing time settings for guild {config.get('guild_id')}: {e}")
+
+    def in_window(self):
+        return self.window is None or self.window.is_open()
+
+message_triggers = {}  # guild_id -> MessageTriggers
+
+async def get_message_triggers(guild_id):
+    triggers = message_triggers.get(guild_id)
+    if triggers is None:
+        triggers = MessageTriggers(await database.get_guild_config_async(guild_id))
+        message_triggers[guild_id] = triggers
+    return triggers
+
+def invalidate_message_triggers(guild_id):
+    message_triggers.pop(guild_id, None)
+
 @bot.event
 async def on_message(message):
+    started = time.perf_counter()
+    try:
+        await handle_message(message)
+    finally:
+        ON_MESSAGE_SECONDS.observe(time.perf_counter() - started)
+
+async def handle_message(message):
     # Don't let the bot reply to itself
     if message.author == bot.user:
         return
     
-    # Debug log to ensure we are receiving messages
+    # Only '!'-prefixed messages can be commands; skip building a Context for everything else
     if message.content.startswith('!'):
-        logger.info(f"Command-like message received from {message.author}: {message.content}")
-
-    # Process commands first (important!)
-    await bot.process_commands(message)
+        # Lazy %-formatting: this runs for every command and is normally filtered out
+        hot_logger.debug("Command-like message received from %s: %s", message.author, message.content)
+        await bot.process_commands(message)
+        return
 
     msg_content = message.content.strip().lower()
 
@@ -1773,114 +2292,84 @@ async def on_message(message):
         if not message.guild:
             return
 
-        settings = load_settings(message.guild.id)
+        triggers = await get_message_triggers(message.guild.id)
+        if not triggers.present_role_id:
+            return
         
         # Check Window
-        allowed, window_msg = is_in_attendance_window(message.guild.id)
-        if not allowed:
-            await message.channel.send(window_msg, delete_after=5)
+        if not triggers.in_window():
+            await message.channel.send(triggers.window.message, delete_after=5)
             return
 
-        if not settings.get('allow_self_marking', True):
+        if not triggers.allow_self_marking:
             # If self-marking is disabled, we ignore the message or warn?
             # Warn is better UX
             await message.channel.send("Self-marking is currently disabled.", delete_after=5)
             return
 
-        data = load_attendance_data(message.guild.id)
-        
         # Check permissions
-        allowed_role_id = data.get('allowed_role_id')
-        if allowed_role_id:
-            allowed_role = message.guild.get_role(allowed_role_id)
+        if triggers.allowed_role_id:
+            allowed_role = message.guild.get_role(triggers.allowed_role_id)
             if allowed_role and allowed_role not in message.author.roles:
                 # Silently ignore to prevent spam if they don't have perms.
                 return
 
-        attendance_role_id = data.get('attendance_role_id')
-        absent_role_id = data.get('absent_role_id')
-        excused_role_id = data.get('excused_role_id')
+        role = message.guild.get_role(triggers.present_role_id)
+        if role:
+            user_id = str(message.author.id)
+            now = datetime.datetime.now()
+            
+            # Check if already marked today (prevent spamming present)
+            index = await get_presence_index(message.guild.id)
+            if index.status(message.author.id) == 'present':
+                 await message.channel.send(f"{message.author.mention}, you have already marked your attendance!", delete_after=5)
+            else:
+                # Give role
+                try:
+                    # Remove conflicting roles first
+                    roles_to_remove = []
+                    if triggers.absent_role_id: roles_to_remove.append(triggers.absent_role_id)
+                    if triggers.excused_role_id: roles_to_remove.append(triggers.excused_role_id)
+                    
+                    for rid in roles_to_remove:
+                        r = message.guild.get_role(rid)
+                        if r and r in message.author.roles:
+                            await message.author.remove_roles(r)
 
-        if attendance_role_id:
-            role = message.guild.get_role(attendance_role_id)
-            if role:
-                user_id = str(message.author.id)
-                now = datetime.datetime.now()
-                
-                # Check if already marked today (prevent spamming present)
-                # We check if they HAVE the role already as a proxy for "already present"
-                if role in message.author.roles:
-                     await message.channel.send(f"{message.author.mention}, you have already marked your attendance!", delete_after=5)
-                else:
-                    # Give role
-                    try:
-                        # Remove conflicting roles first
-                        roles_to_remove = []
-                        if absent_role_id: roles_to_remove.append(absent_role_id)
-                        if excused_role_id: roles_to_remove.append(excused_role_id)
-                        
-                        for rid in roles_to_remove:
-                            r = message.guild.get_role(rid)
-                            if r and r in message.author.roles:
-                                await message.author.remove_roles(r)
-
-                        await message.author.add_roles(role)
-                        await message.add_reaction("✅")
-                        
-                        # Update record with FULL timestamp for 24h expiry
-                        if 'records' not in data:
-                            data['records'] = {}
-                        data['records'][user_id] = {
-                            "status": "present",
-                            "timestamp": now.isoformat(),
-                            "channel_id": message.channel.id
-                        }
-                        save_attendance_data(message.guild.id, data)
-                        
-                        await message.channel.send(f"Attendance marked for {message.author.mention}! You have been given the {role.name} role.", delete_after=10)
-                        
-                        # DM the user
-                        try:
-                            embed = discord.Embed(
-                                title="✅ Attendance Confirmed",
-                                description="Your attendance has been checked successfully.",
-                                color=discord.Color.green()
-                            )
-                            if message.guild.icon:
-                                embed.set_author(name=message.guild.name, icon_url=message.guild.icon.url)
-                                embed.set_thumbnail(url=message.guild.icon.url)
-                            else:
-                                embed.set_author(name=message.guild.name)
-
-                            embed.add_field(name="Status", value="Present", inline=True)
-                            embed.add_field(name="Note", value="You will be notified once the 12-hour period has expired, after which you will be allowed to mark yourself as present again.", inline=False)
-                            embed.set_footer(text=f"Created by Calvin • Server: {message.guild.name}")
-                            await message.author.send(embed=embed)
-                        except discord.Forbidden:
-                            logger.warning(f"Could not DM user {message.author.name} (Closed DMs)")
-                        except Exception:
-                            pass
-
-                        # Automatically show the attendance report
-                        await refresh_attendance_report(message.guild)
-                    except discord.Forbidden:
-                        await message.channel.send("I tried to give you the role, but I don't have permission! Please check my role hierarchy.")
+                    await message.author.add_roles(role)
+                    await message.add_reaction("✅")
+                    
+                    # Update record with FULL timestamp for 24h expiry
+                    record = {
+                        "status": "present",
+                        "timestamp": now.isoformat(),
+                        "channel_id": message.channel.id
+                    }
+                    await set_attendance_record(message.guild.id, user_id, record)
+                    
+                    await message.channel.send(f"Attendance marked for {message.author.mention}! You have been given the {role.name} role.", delete_after=10)
+                    
+                    # DM the user (delivered in the background)
+                    dm_outbox.send(message.author, embed=build_confirmation_embed(message.guild))
+
+                    # Automatically show the attendance report
+                    request_report_refresh(message.guild)
+                except discord.Forbidden:
+                    await message.channel.send("I tried to give you the role, but I don't have permission! Please check my role hierarchy.")
 
     elif msg_content.startswith("excuse"):
         if not message.guild:
             return
             
-        settings = load_settings(message.guild.id)
-        if settings.get('require_admin_excuse', True):
+        triggers = await get_message_triggers(message.guild.id)
+        if not triggers.excused_role_id:
+            return
+        
+        if triggers.require_admin_excuse:
             # Check if user has manage_roles
             if not message.author.guild_permissions.manage_roles:
                 await message.channel.send("Only admins can excuse users.", delete_after=5)
                 return
-
-        data = load_attendance_data(message.guild.id)
-        attendance_role_id = data.get('attendance_role_id')
-        absent_role_id = data.get('absent_role_id')
-        excused_role_id = data.get('excused_role_id')
         
         # Parse reason
         # "excuse because i am sick" -> reason: "because i am sick"
@@ -1888,53 +2377,61 @@ async def on_message(message):
         if not reason:
             reason = "No reason provided"
 
-        if excused_role_id:
-            role = message.guild.get_role(excused_role_id)
-            if role:
-                user_id = str(message.author.id)
-                now = datetime.datetime.now()
-                
-                # Check if already marked (prevent spamming)
-                if role in message.author.roles:
-                     await message.channel.send(f"{message.author.mention}, you have already marked your status as excused!", delete_after=5)
-                else:
-                    # Give role
-                    try:
-                        # Remove conflicting roles first
-                        roles_to_remove = []
-                        if attendance_role_id: roles_to_remove.append(attendance_role_id)
-                        if absent_role_id: roles_to_remove.append(absent_role_id)
-                        
-                        for rid in roles_to_remove:
-                            r = message.guild.get_role(rid)
-                            if r and r in message.author.roles:
-                                await message.author.remove_roles(r)
-
-                        await message.author.add_roles(role)
-                        await message.add_reaction("✅")
-                        
-                        # Update record with FULL timestamp for 24h expiry
-                        if 'records' not in data:
-                            data['records'] = {}
-                        data['records'][user_id] = {
-                            "status": "excused",
-                            "timestamp": now.isoformat(),
-                            "channel_id": message.channel.id,
-                            "reason": reason
-                        }
-                        save_attendance_data(message.guild.id, data)
-                        
-                        await message.channel.send(f"Excused status marked for {message.author.mention}! Reason: {reason}", delete_after=10)
-                        
-                        # Automatically show the attendance report
-                        await refresh_attendance_report(message.guild)
-                    except discord.Forbidden:
-                        await message.channel.send("I tried to give you the role, but I don't have permission! Please check my role hierarchy.")
+        role = message.guild.get_role(triggers.excused_role_id)
+        if role:
+            user_id = str(message.author.id)
+            now = datetime.datetime.now()
+            
+            # Check if already marked (prevent spamming)
+            index = await get_presence_index(message.guild.id)
+            if index.status(message.author.id) == 'excused':
+                 await message.channel.send(f"{message.author.mention}, you have already marked your status as excused!", delete_after=5)
+            else:
+                # Give role
+                try:
+                    # Remove conflicting roles first
+                    roles_to_remove = []
+                    if triggers.present_role_id: roles_to_remove.append(triggers.present_role_id)
+                    if triggers.absent_role_id: roles_to_remove.append(triggers.absent_role_id)
+                    
+                    for rid in roles_to_remove:
+                        r = message.guild.get_role(rid)
+                        if r and r in message.author.roles:
+                            await message.author.remove_roles(r)
+
+                    await message.author.add_roles(role)
+                    await message.add_reaction("✅")
+                    
+                    # Update record with FULL timestamp for 24h expiry
+                    record = {
+                        "status": "excused",
+                        "timestamp": now.isoformat(),
+                        "channel_id": message.channel.id,
+                        "reason": reason
+                    }
+                    await set_attendance_record(message.guild.id, user_id, record)
+                    
+                    await message.channel.send(f"Excused status marked for {message.author.mention}! Reason: {reason}", delete_after=10)
+                    
+                    # Automatically show the attendance report
+                    request_report_refresh(message.guild)
+                except discord.Forbidden:
+                    await message.channel.send("I tried to give you the role, but I don't have permission! Please check my role hierarchy.")
 
 
+def handle_sigterm(signum, frame):
+    """Render sends SIGTERM on redeploy; unwind bot.run like Ctrl+C so pending writes get flushed."""
+    logger.info("Received SIGTERM, shutting down...")
+    raise KeyboardInterrupt
+
 if __name__ == "__main__":
     if not TOKEN or TOKEN == "your_token_here":
         print("Error: Please set your DISCORD_TOKEN in the .env file.")
     else:
-        keep_alive()
-        bot.run(TOKEN)
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        try:
+            # Logging is already set up (queued); keep discord.py from adding its own blocking handler
+            bot.run(TOKEN, log_handler=None)
+        finally:
+            database.shutdown()
+            logsetup.shutdown()
@@ -1,24 +1,193 @@
 import os
 import sqlite3
 import json
+import asyncio
+import functools
 import logging
-from datetime import datetime
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+
+import metrics
 
 # Use environment variable for DB location (default to local file)
 DB_FILE = os.getenv("DB_FILE", "attendance.db")
 logger = logging.getLogger(__name__)
 
-def get_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+# Connection tuning (override via environment)
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 4))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", 8192))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 64 * 1024 * 1024))
+DB_STATEMENT_CACHE = 256
+
+# Attendance days are counted in Philippines Time (UTC+8), same as the bot
+ATTENDANCE_TZ = timezone(timedelta(hours=8))
+CONFIG_CACHE_SIZE = int(os.getenv("CONFIG_CACHE_SIZE", 1024))
+
+def _configure(conn):
+    """Applies the per-connection pragmas used by every pooled connection."""
     conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA synchronous = NORMAL')  # Safe with WAL, skips fsync per commit
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
     return conn
 
-def init_db():
-    """Initializes the database tables."""
-    conn = get_connection()
-    c = conn.cursor()
-    
+def get_connection():
+    """Establishes a standalone connection to the SQLite database."""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+    return _configure(conn)
+
+class ConnectionPool:
+    """
+    Long-lived connections shared by the whole process.
+    One writer connection (serialized by a lock) and a small pool of readers.
+    WAL mode lets the readers run while the writer holds a transaction.
+    """
+
+    def __init__(self, path, read_pool_size=DB_READ_POOL_SIZE):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._readers = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(max(1, read_pool_size))
+        self._all = []
+        self._all_lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+        _configure(conn)
+        with self._all_lock:
+            self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Yields the writer connection; commits on success, rolls back on error."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._open()
+                # journal_mode is persistent in the file, setting it once is enough
+                self._writer.execute('PRAGMA journal_mode = WAL')
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """Yields a pooled read connection."""
+        self._reader_slots.acquire()
+        try:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            try:
+                yield conn
+            finally:
+                self._readers.put(conn)
+        finally:
+            self._reader_slots.release()
+
+    def close(self):
+        """Closes every connection opened by this pool."""
+        with self._write_lock, self._all_lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all.clear()
+            self._writer = None
+            self._readers = queue.LifoQueue()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_FILE)
+    return _pool
+
+def close_connections():
+    """Closes the pooled connections (e.g., on shutdown or when DB_FILE changes)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+    config_cache.clear()
+
+class GuildConfigCache:
+    """
+    Bounded LRU cache of guild_configs rows, kept current by write-through.
+    Guilds without a config row are cached too, so unconfigured guilds
+    never reach SQLite on hot paths.
+    """
+    MISSING = object()
+
+    def __init__(self, maxsize=CONFIG_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, guild_id):
+        """Returns the cached row (or None for "no config"), or MISSING."""
+        with self._lock:
+            row = self._rows.get(guild_id, self.MISSING)
+            if row is self.MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._rows.move_to_end(guild_id)
+            return row
+
+    def put(self, guild_id, row):
+        with self._lock:
+            self._rows[guild_id] = row
+            self._rows.move_to_end(guild_id)
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, guild_id):
+        with self._lock:
+            self._rows.pop(guild_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._rows), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+config_cache = GuildConfigCache()
+
+# --- Schema Migrations ---
+# Each migration runs once, in its own transaction, and bumps PRAGMA user_version.
+# Append new migrations to the end of MIGRATIONS; never edit one that has shipped.
+
+def _migration_base_schema(c):
+    """v1: Base tables (no-op for databases created before versioning)."""
     # Guild Configuration Table
     c.execute('''CREATE TABLE IF NOT EXISTS guild_configs (
         guild_id INTEGER PRIMARY KEY,
@@ -59,138 +228,776 @@ def init_db():
     c.execute('CREATE INDEX IF NOT EXISTS idx_records_guild_user ON attendance_records (guild_id, user_id)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_records_guild_date ON attendance_records (guild_id, timestamp)')
 
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized.")
+def _migration_unique_current_status(c):
+    """v2: One current-status row per (guild_id, user_id), enforced by a unique index."""
+    # Older builds could leave duplicates behind; keep the newest row per user
+    c.execute('''DELETE FROM attendance_records WHERE id NOT IN (
+                     SELECT MAX(id) FROM attendance_records GROUP BY guild_id, user_id)''')
+    c.execute('DROP INDEX IF EXISTS idx_records_guild_user')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_records_guild_user ON attendance_records (guild_id, user_id)')
+
+def _migration_history_tables(c):
+    """v3: Append-only attendance_events log and per-day status rollups."""
+    c.execute('''CREATE TABLE IF NOT EXISTS attendance_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER,
+        day TEXT NOT NULL,
+        action TEXT NOT NULL,
+        status TEXT,
+        timestamp TEXT,
+        channel_id INTEGER,
+        reason TEXT
+    )''')
+    # (guild_id, day) prefix serves history queries; user_id finds a user's last mark of the day
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_guild_day ON attendance_events (guild_id, day, user_id)')
+    
+    # Number of users whose latest status on that day is `status`
+    c.execute('''CREATE TABLE IF NOT EXISTS attendance_daily (
+        guild_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, day, status)
+    ) WITHOUT ROWID''')
+    
+    # Seed history with the current-status rows so existing data is not lost
+    rows = c.execute('SELECT guild_id, user_id, status, timestamp, channel_id, reason FROM attendance_records').fetchall()
+    for guild_id, user_id, status, timestamp, channel_id, reason in rows:
+        _record_event(c, 'upsert', guild_id, user_id, (status, timestamp, channel_id, reason))
+
+def _migration_expiry_columns(c):
+    """v4: Integer marked_at/expires_at epoch columns so expiry is an indexed range scan."""
+    c.execute('ALTER TABLE attendance_records ADD COLUMN marked_at INTEGER')
+    c.execute('ALTER TABLE attendance_records ADD COLUMN expires_at INTEGER')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_records_expires ON attendance_records (expires_at)')
+    
+    rows = c.execute('SELECT id, guild_id, timestamp FROM attendance_records').fetchall()
+    expiry = {}
+    updates = []
+    for record_id, guild_id, timestamp in rows:
+        if guild_id not in expiry:
+            expiry[guild_id] = _expiry_seconds(c, guild_id)
+        marked_at = _epoch(timestamp)
+        updates.append((marked_at, _expires_at(marked_at, expiry[guild_id]), record_id))
+    c.executemany('UPDATE attendance_records SET marked_at = ?, expires_at = ? WHERE id = ?', updates)
+
+def _migration_eod_jobs(c):
+    """v5: Persisted end-of-day jobs with a step cursor and per-member progress."""
+    c.execute('''CREATE TABLE IF NOT EXISTS eod_jobs (
+        guild_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        step TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, day)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS eod_job_members (
+        guild_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        add_role_id INTEGER,
+        remove_role_id INTEGER,
+        done INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, day, user_id)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_eod_jobs_step ON eod_jobs (step) WHERE step != 'done'")
+
+def _migration_role_gate_columns(c):
+    """v6: Persist the permitted (allowed) role and the expiry ping role per guild."""
+    c.execute('ALTER TABLE guild_configs ADD COLUMN allowed_role_id INTEGER')
+    c.execute('ALTER TABLE guild_configs ADD COLUMN ping_role_id INTEGER')
+
+MIGRATIONS = [
+    (1, _migration_base_schema),
+    (2, _migration_unique_current_status),
+    (3, _migration_history_tables),
+    (4, _migration_expiry_columns),
+    (5, _migration_eod_jobs),
+    (6, _migration_role_gate_columns),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def init_db():
+    """Initializes the database tables and applies pending schema migrations in place."""
+    with get_pool().writer() as conn:
+        current = conn.execute('PRAGMA user_version').fetchone()[0]
+        
+        for version, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info(f"Applying database migration v{version}: {migration.__doc__}")
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                migration(conn.cursor())
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.error(f"Database migration v{version} failed", exc_info=True)
+                raise
+            current = version
+
+    logger.info(f"Database initialized (schema v{current}).")
+
+def _load_guild_config(guild_id):
+    """Reads a guild's config row from SQLite and caches it."""
+    with get_pool().reader() as conn:
+        row = conn.execute('SELECT * FROM guild_configs WHERE guild_id = ?', (guild_id,)).fetchone()
+    row = dict(row) if row else None
+    config_cache.put(guild_id, row)
+    return dict(row) if row else None
 
 def get_guild_config(guild_id):
     """Retrieves configuration for a guild."""
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM guild_configs WHERE guild_id = ?', (guild_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return dict(row)
-    return None
+    row = config_cache.get(guild_id)
+    if row is GuildConfigCache.MISSING:
+        return _load_guild_config(guild_id)
+    return dict(row) if row else None
 
 def update_guild_config(guild_id, **kwargs):
     """Updates specific fields in the guild configuration."""
-    conn = get_connection()
-    c = conn.cursor()
-    
-    # Check if exists
-    c.execute('SELECT 1 FROM guild_configs WHERE guild_id = ?', (guild_id,))
-    exists = c.fetchone()
-    
-    if not exists:
-        # Create default entry first
-        c.execute('INSERT INTO guild_configs (guild_id) VALUES (?)', (guild_id,))
-    
-    if kwargs:
-        columns = ', '.join(f"{k} = ?" for k in kwargs.keys())
-        values = list(kwargs.values()) + [guild_id]
-        c.execute(f'UPDATE guild_configs SET {columns} WHERE guild_id = ?', values)
-    
-    conn.commit()
-    conn.close()
+    with get_pool().writer() as conn:
+        # Create default entry first (no-op if it already exists)
+        conn.execute('INSERT OR IGNORE INTO guild_configs (guild_id) VALUES (?)', (guild_id,))
+        
+        if kwargs:
+            previous_expiry = _expiry_seconds(conn, guild_id)
+            columns = ', '.join(f"{k} = ?" for k in kwargs.keys())
+            values = list(kwargs.values()) + [guild_id]
+            conn.execute(f'UPDATE guild_configs SET {columns} WHERE guild_id = ?', values)
+        
+        # Write-through: refresh the cached row from the writer's view
+        row = conn.execute('SELECT * FROM guild_configs WHERE guild_id = ?', (guild_id,)).fetchone()
+        
+        if kwargs:
+            expiry_seconds = _expiry_seconds_from_config(dict(row))
+            if expiry_seconds != previous_expiry:
+                conn.execute(RECOMPUTE_EXPIRY_SQL, (expiry_seconds, expiry_seconds, guild_id))
+    config_cache.put(guild_id, dict(row))
 
 def get_attendance_records(guild_id):
-    """Retrieves all attendance records for a guild."""
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM attendance_records WHERE guild_id = ?', (guild_id,))
-    rows = c.fetchall()
-    conn.close()
-    
-    # Convert to dictionary format expected by bot {user_id: {status, timestamp, ...}}
-    records = {}
-    for row in rows:
-        records[str(row['user_id'])] = {
-            "status": row['status'],
-            "timestamp": row['timestamp'],
-            "channel_id": row['channel_id'],
-            "reason": row['reason']
-        }
+    """Retrieves all attendance records for a guild (including writes still pending in the journal)."""
+    with journal.reading() if journal is not None else nullcontext():
+        with get_pool().reader() as conn:
+            rows = conn.execute(
+                'SELECT user_id, status, timestamp, channel_id, reason FROM attendance_records WHERE guild_id = ?',
+                (guild_id,)
+            ).fetchall()
+        
+        # Convert to dictionary format expected by bot {user_id: {status, timestamp, ...}}
+        records = {}
+        for row in rows:
+            records[str(row['user_id'])] = {
+                "status": row['status'],
+                "timestamp": row['timestamp'],
+                "channel_id": row['channel_id'],
+                "reason": row['reason']
+            }
+        if journal is not None:
+            journal.overlay(guild_id, records)
     return records
 
+# The bot only stores ONE record per user per guild (current status),
+# so (guild_id, user_id) is unique and updates are a single-statement upsert.
+UPSERT_RECORD_SQL = '''INSERT INTO attendance_records (guild_id, user_id, status, timestamp, channel_id, reason, marked_at, expires_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                         ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                         status=excluded.status,
+                         timestamp=excluded.timestamp,
+                         channel_id=excluded.channel_id,
+                         reason=excluded.reason,
+                         marked_at=excluded.marked_at,
+                         expires_at=excluded.expires_at'''
+
+# --- Expiry Columns ---
+# `timestamp` stays as the ISO text the bot wrote (naive local or UTC+8-aware);
+# marked_at/expires_at are the same instant as epoch seconds so expiry can be
+# queried in SQL. expires_at is NULL for guilds that do not expire per record
+# (window mode) and is recomputed when a guild's mode or expiry hours change.
+
+def _epoch(timestamp):
+    """Returns a record timestamp as epoch seconds, or None if it cannot be parsed."""
+    if not timestamp:
+        return None
+    try:
+        # Naive timestamps were written with datetime.now() (server local time)
+        return int(datetime.fromisoformat(str(timestamp)).timestamp())
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+def _expiry_seconds_from_config(config):
+    """Returns a guild's per-record expiry in seconds, or None when records do not expire (window mode)."""
+    config = config or {}
+    if (config.get('attendance_mode') or 'duration') != 'duration':
+        return None
+    return int((config.get('attendance_expiry_hours') or 12) * 3600)
+
+def _expiry_seconds(conn, guild_id):
+    row = config_cache.get(guild_id)
+    if row is GuildConfigCache.MISSING:
+        row = conn.execute('SELECT attendance_mode, attendance_expiry_hours FROM guild_configs WHERE guild_id = ?',
+                           (guild_id,)).fetchone()
+        row = {"attendance_mode": row[0], "attendance_expiry_hours": row[1]} if row else None
+    return _expiry_seconds_from_config(row)
+
+def _expires_at(marked_at, expiry_seconds):
+    if expiry_seconds is None:
+        return None
+    if marked_at is None:
+        # Unparseable timestamps are due at once so the expiry pass removes them
+        return int(time.time())
+    return marked_at + expiry_seconds
+
+def _upsert_params(guild_id, user_id, row, expiry_seconds):
+    marked_at = _epoch(row[1])
+    return (guild_id, user_id) + tuple(row) + (marked_at, _expires_at(marked_at, expiry_seconds))
+
+RECOMPUTE_EXPIRY_SQL = '''UPDATE attendance_records
+                           SET expires_at = CASE WHEN ? IS NULL THEN NULL
+                                                 WHEN marked_at IS NULL THEN CAST(strftime('%s', 'now') AS INTEGER)
+                                                 ELSE marked_at + ? END
+                           WHERE guild_id = ?'''
+
+# Record mutations are expressed as ops so they can be applied immediately or journaled:
+#   ('upsert', guild_id, user_id, (status, timestamp, channel_id, reason))
+#   ('expire', guild_id, user_id, (status, timestamp, channel_id, reason))  # an upsert made by expiry
+#   ('delete', guild_id, user_id, None)
+#   ('clear', guild_id, None, None)
+
+def _record_row(info):
+    return (info.get('status', 'present'), info.get('timestamp'), info.get('channel_id'), info.get('reason'))
+
+def _event_day(timestamp):
+    """Returns the attendance day (YYYY-MM-DD, UTC+8) a record timestamp belongs to."""
+    if timestamp:
+        try:
+            # Naive timestamps were written with datetime.now() (server local time)
+            return datetime.fromisoformat(str(timestamp)).astimezone(ATTENDANCE_TZ).strftime("%Y-%m-%d")
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return datetime.now(ATTENDANCE_TZ).strftime("%Y-%m-%d")
+
+ROLLUP_ADD_SQL = '''INSERT INTO attendance_daily (guild_id, day, status, count) VALUES (?, ?, ?, ?)
+                     ON CONFLICT(guild_id, day, status) DO UPDATE SET count = count + excluded.count'''
+
+def _record_event(conn, kind, guild_id, user_id, row):
+    """Appends a history event and keeps the daily rollup in step with it."""
+    if kind in ('upsert', 'expire'):
+        status, timestamp, channel_id, reason = row
+        day = _event_day(timestamp)
+        previous = conn.execute(
+            '''SELECT status FROM attendance_events
+               WHERE guild_id = ? AND day = ? AND user_id = ? AND action = 'mark'
+               ORDER BY id DESC LIMIT 1''', (guild_id, day, user_id)).fetchone()
+        if kind == 'expire' and previous is not None:
+            # A session ending does not undo the day's mark (checked in at 08:00, expired at 20:00 = present)
+            conn.execute('''INSERT INTO attendance_events (guild_id, user_id, day, action, status, timestamp, channel_id, reason)
+                            VALUES (?, ?, ?, 'expire', ?, ?, ?, ?)''',
+                         (guild_id, user_id, day, status, timestamp, channel_id, reason))
+            return
+        conn.execute('''INSERT INTO attendance_events (guild_id, user_id, day, action, status, timestamp, channel_id, reason)
+                        VALUES (?, ?, ?, 'mark', ?, ?, ?, ?)''',
+                     (guild_id, user_id, day, status, timestamp, channel_id, reason))
+        # A user counts once per day, under their latest status
+        previous_status = previous[0] if previous else None
+        if previous_status != status:
+            if previous_status is not None:
+                conn.execute(ROLLUP_ADD_SQL, (guild_id, day, previous_status, -1))
+            conn.execute(ROLLUP_ADD_SQL, (guild_id, day, status, 1))
+    else:
+        # Removals are logged for auditing but do not rewrite the day's history
+        conn.execute('''INSERT INTO attendance_events (guild_id, user_id, day, action)
+                        VALUES (?, ?, ?, ?)''',
+                     (guild_id, user_id, _event_day(None), kind))
+
+def _apply_record_ops(conn, ops):
+    """Applies record ops in order on an open write transaction."""
+    expiry = {}
+    for kind, guild_id, user_id, row in ops:
+        _record_event(conn, kind, guild_id, user_id, row)
+        if kind in ('upsert', 'expire'):
+            if guild_id not in expiry:
+                expiry[guild_id] = _expiry_seconds(conn, guild_id)
+            conn.execute(UPSERT_RECORD_SQL, _upsert_params(guild_id, user_id, row, expiry[guild_id]))
+        elif kind == 'delete':
+            conn.execute('DELETE FROM attendance_records WHERE guild_id = ? AND user_id = ?', (guild_id, user_id))
+        elif kind == 'clear':
+            conn.execute('DELETE FROM attendance_records WHERE guild_id = ?', (guild_id,))
+
+def _submit_record_ops(ops):
+    """Writes record ops now, or queues them when write-behind is enabled."""
+    if journal is not None:
+        journal.append(ops)
+        return
+    with get_pool().writer() as conn:
+        _apply_record_ops(conn, ops)
+
 def add_or_update_record(guild_id, user_id, status, timestamp, channel_id=None, reason=None):
     """Adds or updates an attendance record."""
-    conn = get_connection()
-    c = conn.cursor()
-    
-    # Upsert logic
-    c.execute('''INSERT INTO attendance_records (guild_id, user_id, status, timestamp, channel_id, reason)
-                 VALUES (?, ?, ?, ?, ?, ?)
-                 ON CONFLICT(id) DO UPDATE SET
-                 status=excluded.status,
-                 timestamp=excluded.timestamp,
-                 channel_id=excluded.channel_id,
-                 reason=excluded.reason
-    ''', (guild_id, user_id, status, timestamp, channel_id, reason))
-    
-    # Wait, SQLite UPSERT usually requires a unique constraint to conflict on.
-    # We don't have a unique constraint on (guild_id, user_id) because we might want history?
-    # But the current bot only stores ONE record per user per guild (current status).
-    # So we should probably DELETE old record for this user or UPDATE it.
-    
-    # Let's clean up: Delete existing record for this user in this guild first
-    # (Since we only track 'current' status in the JSON version)
-    
-    # Actually, let's use a unique constraint if we only want one record per user per day/session.
-    # The JSON structure is `records: { "user_id": { ... } }`, so only one active record per user.
-    
-    conn.rollback() # Undo the insert above
-    
-    # Delete previous record for this user
-    c.execute('DELETE FROM attendance_records WHERE guild_id = ? AND user_id = ?', (guild_id, user_id))
-    
-    # Insert new
-    c.execute('''INSERT INTO attendance_records (guild_id, user_id, status, timestamp, channel_id, reason)
-                 VALUES (?, ?, ?, ?, ?, ?)''', (guild_id, user_id, status, timestamp, channel_id, reason))
-    
-    conn.commit()
-    conn.close()
+    _submit_record_ops([('upsert', guild_id, int(user_id), (status, timestamp, channel_id, reason))])
+
+def delete_record(guild_id, user_id):
+    """Deletes a single user's attendance record."""
+    _submit_record_ops([('delete', guild_id, int(user_id), None)])
+
+def apply_record_changes(guild_id, upserts, deletes, expired=False):
+    """
+    Writes only the records that changed, in one transaction.
+    upserts is {user_id: {status, timestamp, channel_id, reason}}, deletes is [user_id].
+    expired marks the upserts as session expiries, which keep the day's mark in the history rollup.
+    """
+    kind = 'expire' if expired else 'upsert'
+    ops = [('delete', guild_id, int(uid), None) for uid in deletes]
+    ops.extend((kind, guild_id, int(uid), _record_row(info)) for uid, info in upserts.items())
+    if ops:
+        _submit_record_ops(ops)
 
 def replace_all_records(guild_id, records_dict):
     """Replaces all attendance records for a guild (bulk save)."""
-    conn = get_connection()
-    c = conn.cursor()
-    
-    # Transaction
+    # records_dict is {user_id: {status, timestamp, channel_id, reason}}
+    ops = [('clear', guild_id, None, None)]
+    ops.extend(('upsert', guild_id, int(uid), _record_row(info)) for uid, info in records_dict.items())
     try:
-        # Delete all existing
-        c.execute('DELETE FROM attendance_records WHERE guild_id = ?', (guild_id,))
-        
-        # Insert new
-        # records_dict is {user_id: {status, timestamp, channel_id, reason}}
-        to_insert = []
-        for uid, info in records_dict.items():
-            to_insert.append((
-                guild_id, 
-                uid, 
-                info.get('status', 'present'), 
-                info.get('timestamp'), 
-                info.get('channel_id'),
-                info.get('reason')
-            ))
-            
-        if to_insert:
-            c.executemany('''INSERT INTO attendance_records (guild_id, user_id, status, timestamp, channel_id, reason)
-                             VALUES (?, ?, ?, ?, ?, ?)''', to_insert)
-        
-        conn.commit()
+        _submit_record_ops(ops)
     except Exception as e:
-        conn.rollback()
         logger.error(f"Failed to replace records for guild {guild_id}: {e}")
         raise
-    finally:
-        conn.close()
 
 def clear_attendance_records(guild_id):
     """Clears all attendance records for a guild (e.g., reset)."""
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute('DELETE FROM attendance_records WHERE guild_id = ?', (guild_id,))
-    conn.commit()
-    conn.close()
+    _submit_record_ops([('clear', guild_id, None, None)])
+
+def bulk_import_guild(guild_id, config, records):
+    """
+    Imports one guild's config and current-status records in a single transaction.
+    records is a list of (user_id, status, timestamp, channel_id, reason).
+    Used by migrate_to_db.py; history rows are written with executemany when the
+    guild has no prior history, otherwise per record so the rollup stays exact.
+    """
+    flush_pending_writes()
+    with get_pool().writer() as conn:
+        conn.execute('INSERT OR IGNORE INTO guild_configs (guild_id) VALUES (?)', (guild_id,))
+        if config:
+            columns = ', '.join(f"{k} = ?" for k in config.keys())
+            conn.execute(f'UPDATE guild_configs SET {columns} WHERE guild_id = ?', list(config.values()) + [guild_id])
+        
+        has_history = conn.execute('SELECT 1 FROM attendance_events WHERE guild_id = ? LIMIT 1', (guild_id,)).fetchone()
+        if has_history:
+            _apply_record_ops(conn, [('upsert', guild_id, uid, (status, ts, ch, reason))
+                                     for uid, status, ts, ch, reason in records])
+        elif records:
+            expiry_seconds = _expiry_seconds_from_config(dict(conn.execute(
+                'SELECT attendance_mode, attendance_expiry_hours FROM guild_configs WHERE guild_id = ?', (guild_id,)).fetchone()))
+            conn.executemany(UPSERT_RECORD_SQL, [_upsert_params(guild_id, r[0], r[1:], expiry_seconds) for r in records])
+            
+            events = []
+            rollup = {}
+            for uid, status, ts, ch, reason in records:
+                day = _event_day(ts)
+                events.append((guild_id, uid, day, status, ts, ch, reason))
+                rollup[(day, status)] = rollup.get((day, status), 0) + 1
+            conn.executemany('''INSERT INTO attendance_events (guild_id, user_id, day, action, status, timestamp, channel_id, reason)
+                                VALUES (?, ?, ?, 'mark', ?, ?, ?, ?)''', events)
+            conn.executemany(ROLLUP_ADD_SQL, [(guild_id, day, status, n) for (day, status), n in rollup.items()])
+        
+        row = conn.execute('SELECT * FROM guild_configs WHERE guild_id = ?', (guild_id,)).fetchone()
+    config_cache.put(guild_id, dict(row))
+    return len(records)
+
+# --- Expiry ---
+
+def ping():
+    """Runs a trivial query; raises if the database cannot be read."""
+    with get_pool().reader() as conn:
+        conn.execute('SELECT 1').fetchone()
+    return True
+
+def get_due_records(now, limit=None):
+    """
+    Returns every record (across all guilds) whose expires_at <= now, oldest first,
+    as dicts with guild_id, user_id, status, timestamp, channel_id, reason and expires_at.
+    Served by idx_records_expires, so the cost is proportional to the due rows only.
+    """
+    query = '''SELECT guild_id, user_id, status, timestamp, channel_id, reason, expires_at
+               FROM attendance_records WHERE expires_at <= ? ORDER BY expires_at'''
+    params = [int(now)]
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+    
+    flush_pending_writes()
+    with get_pool().reader() as conn:
+        rows = conn.execute(query, params).fetchall()
+    return [dict(row) for row in rows]
+
+def get_next_expiry(after=None):
+    """Returns the earliest expires_at (optionally strictly after `after`), or None."""
+    flush_pending_writes()
+    with get_pool().reader() as conn:
+        if after is None:
+            row = conn.execute('SELECT MIN(expires_at) FROM attendance_records').fetchone()
+        else:
+            row = conn.execute('SELECT MIN(expires_at) FROM attendance_records WHERE expires_at > ?', (int(after),)).fetchone()
+    return row[0]
+
+# --- End-of-Day Jobs ---
+# Window-mode end-of-day runs as a persisted job so a restart resumes it instead
+# of redoing (or skipping) Discord calls. Steps advance in this order:
+#   'plan'   -> auto-absent records and the member role work are written together
+#   'report' -> the final report is posted
+#   'roles'  -> eod_job_members rows are worked off, each marked done as it completes
+#   'clear'  -> records are cleared and last_processed_date is set with the job's 'done'
+EOD_STEPS = ('plan', 'report', 'roles', 'clear', 'done')
+
+def start_eod_job(guild_id, day):
+    """
+    Creates the end-of-day job for (guild, day) if needed and returns it as a dict.
+    A 'done' job starts over at 'plan' when the guild's last_processed_date no
+    longer says `day` (it was reset, e.g. by !settime, and the window closed again).
+    """
+    now = int(time.time())
+    with get_pool().writer() as conn:
+        conn.execute('''INSERT OR IGNORE INTO eod_jobs (guild_id, day, step, created_at, updated_at)
+                        VALUES (?, ?, 'plan', ?, ?)''', (guild_id, day, now, now))
+        row = conn.execute('SELECT * FROM eod_jobs WHERE guild_id = ? AND day = ?', (guild_id, day)).fetchone()
+        if row['step'] == 'done':
+            processed = conn.execute('SELECT last_processed_date FROM guild_configs WHERE guild_id = ?',
+                                     (guild_id,)).fetchone()
+            if processed is None or processed[0] != day:
+                conn.execute('DELETE FROM eod_job_members WHERE guild_id = ? AND day = ?', (guild_id, day))
+                _set_eod_step(conn, guild_id, day, 'plan')
+                row = conn.execute('SELECT * FROM eod_jobs WHERE guild_id = ? AND day = ?',
+                                   (guild_id, day)).fetchone()
+    return dict(row)
+
+def _set_eod_step(conn, guild_id, day, step):
+    conn.execute('UPDATE eod_jobs SET step = ?, updated_at = ? WHERE guild_id = ? AND day = ?',
+                 (step, int(time.time()), guild_id, day))
+
+def set_eod_job_step(guild_id, day, step):
+    with get_pool().writer() as conn:
+        _set_eod_step(conn, guild_id, day, step)
+
+def plan_eod_job(guild_id, day, absent_records, members):
+    """
+    Writes the auto-absent records ({user_id: record}) and the role work
+    ([(user_id, add_role_id, remove_role_id)]) and moves the job to 'report', atomically.
+    """
+    flush_pending_writes()
+    with get_pool().writer() as conn:
+        _apply_record_ops(conn, [('upsert', guild_id, int(uid), _record_row(info))
+                                 for uid, info in absent_records.items()])
+        conn.executemany('''INSERT OR REPLACE INTO eod_job_members (guild_id, day, user_id, add_role_id, remove_role_id)
+                            VALUES (?, ?, ?, ?, ?)''', [(guild_id, day) + tuple(m) for m in members])
+        _set_eod_step(conn, guild_id, day, 'report')
+
+def get_eod_job_members(guild_id, day):
+    """Returns the job's unfinished [(user_id, add_role_id, remove_role_id)]."""
+    with get_pool().reader() as conn:
+        rows = conn.execute('''SELECT user_id, add_role_id, remove_role_id FROM eod_job_members
+                               WHERE guild_id = ? AND day = ? AND done = 0''', (guild_id, day)).fetchall()
+    return [tuple(row) for row in rows]
+
+def mark_eod_members_done(guild_id, day, user_ids):
+    with get_pool().writer() as conn:
+        conn.executemany('UPDATE eod_job_members SET done = 1 WHERE guild_id = ? AND day = ? AND user_id = ?',
+                         [(guild_id, day, uid) for uid in user_ids])
+
+def finish_eod_job(guild_id, day):
+    """Clears the guild's records, records `day` as processed and completes the job, atomically."""
+    flush_pending_writes()
+    with get_pool().writer() as conn:
+        _apply_record_ops(conn, [('clear', guild_id, None, None)])
+        conn.execute('UPDATE guild_configs SET last_processed_date = ? WHERE guild_id = ?', (day, guild_id))
+        conn.execute('DELETE FROM eod_job_members WHERE guild_id = ? AND day = ?', (guild_id, day))
+        _set_eod_step(conn, guild_id, day, 'done')
+        row = conn.execute('SELECT * FROM guild_configs WHERE guild_id = ?', (guild_id,)).fetchone()
+    if row:
+        config_cache.put(guild_id, dict(row))
+
+def get_unfinished_eod_jobs():
+    """Returns every end-of-day job that has not reached 'done'."""
+    with get_pool().reader() as conn:
+        rows = conn.execute("SELECT * FROM eod_jobs WHERE step != 'done' ORDER BY created_at").fetchall()
+    return [dict(row) for row in rows]
+
+# --- History ---
+
+def get_daily_rollup(guild_id, start_day=None, end_day=None):
+    """
+    Returns {day: {status: count}} for a guild from the precomputed rollup table.
+    Days are YYYY-MM-DD strings (UTC+8); bounds are inclusive and optional.
+    """
+    query = 'SELECT day, status, count FROM attendance_daily WHERE guild_id = ?'
+    params = [guild_id]
+    if start_day:
+        query += ' AND day >= ?'
+        params.append(start_day)
+    if end_day:
+        query += ' AND day <= ?'
+        params.append(end_day)
+    
+    flush_pending_writes()
+    with get_pool().reader() as conn:
+        rows = conn.execute(query + ' ORDER BY day', params).fetchall()
+    
+    rollup = {}
+    for row in rows:
+        if row['count']:
+            rollup.setdefault(row['day'], {})[row['status']] = row['count']
+    return rollup
+
+def get_attendance_events(guild_id, day):
+    """Returns the raw history events for one guild and day, oldest first."""
+    flush_pending_writes()
+    with get_pool().reader() as conn:
+        rows = conn.execute(
+            '''SELECT user_id, action, status, timestamp, channel_id, reason FROM attendance_events
+               WHERE guild_id = ? AND day = ? ORDER BY id''', (guild_id, day)).fetchall()
+    return [dict(row) for row in rows]
+
+# --- Write-Behind Journal ---
+# Optional group commit for attendance writes. When a window opens, hundreds of
+# check-ins land within seconds; journaling them turns hundreds of commits into a few.
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+WRITE_BEHIND_MAX_LAG_MS = int(os.getenv("WRITE_BEHIND_MAX_LAG_MS", 200))  # Maximum durability lag
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", 500))
+
+class WriteBehindJournal:
+    """
+    In-memory journal of pending record ops, flushed by a background thread in one
+    transaction every max_lag_ms or every max_batch ops, whichever comes first.
+    Pending ops are overlaid on reads so callers always see their own writes.
+    An overlay entry is dropped only once it is committed AND every read in
+    progress started after that commit, so no read can miss it in both places.
+    """
+
+    def __init__(self, max_lag_ms=WRITE_BEHIND_MAX_LAG_MS, max_batch=WRITE_BEHIND_MAX_BATCH):
+        self.max_lag = max_lag_ms / 1000
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._ops = []          # [(seq, op)]
+        self._seq = 0
+        self._flushed_seq = 0   # highest seq committed to SQLite
+        self._reads = {}        # _flushed_seq when a read started -> reads in progress from then
+        self._first_pending_at = None
+        # guild_id -> {"cleared": seq or None, "records": {user_id: (seq, row or None)}}
+        self._overlay = {}
+        self._thread = None
+        self._stopping = False
+        self.flushes = 0
+        self.flushed_ops = 0
+
+    def append(self, ops):
+        with self._cond:
+            for op in ops:
+                self._seq += 1
+                self._ops.append((self._seq, op))
+                kind, guild_id, user_id, row = op
+                entry = self._overlay.setdefault(guild_id, {"cleared": None, "records": {}})
+                if kind == 'clear':
+                    entry["cleared"] = self._seq
+                    entry["records"].clear()
+                else:
+                    entry["records"][user_id] = (self._seq, row if kind in ('upsert', 'expire') else None)
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-write-behind", daemon=True)
+                self._thread.start()
+            if len(self._ops) >= self.max_batch:
+                self._cond.notify_all()
+
+    def overlay(self, guild_id, records):
+        """Applies pending ops for a guild on top of records read from SQLite."""
+        with self._cond:
+            entry = self._overlay.get(guild_id)
+            if not entry:
+                return records
+            if entry["cleared"] is not None:
+                records.clear()
+            for user_id, (_, row) in entry["records"].items():
+                if row is None:
+                    records.pop(str(user_id), None)
+                else:
+                    status, timestamp, channel_id, reason = row
+                    records[str(user_id)] = {"status": status, "timestamp": timestamp,
+                                             "channel_id": channel_id, "reason": reason}
+            return records
+
+    @contextmanager
+    def reading(self):
+        """Wraps a SQLite read and its overlay(); entries it may not see in its snapshot are kept meanwhile."""
+        with self._cond:
+            mark = self._flushed_seq
+            self._reads[mark] = self._reads.get(mark, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._reads[mark] -= 1
+                if not self._reads[mark]:
+                    del self._reads[mark]
+                self._prune()
+
+    def _prune(self):
+        # Committed entries every running read's snapshot is guaranteed to include
+        horizon = min(self._reads, default=self._flushed_seq)
+        for guild_id in list(self._overlay):
+            entry = self._overlay[guild_id]
+            if entry["cleared"] is not None and entry["cleared"] <= horizon:
+                entry["cleared"] = None
+            for user_id in [u for u, (seq, _) in entry["records"].items() if seq <= horizon]:
+                del entry["records"][user_id]
+            if entry["cleared"] is None and not entry["records"]:
+                del self._overlay[guild_id]
+
+    def pending(self):
+        with self._cond:
+            return len(self._ops)
+
+    def flush(self):
+        """Commits every pending op in one transaction. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._ops
+                if not batch:
+                    return 0
+                self._ops = []
+                self._first_pending_at = None
+            try:
+                with get_pool().writer() as conn:
+                    _apply_record_ops(conn, [op for _, op in batch])
+            except Exception:
+                # Put the batch back in front so nothing is lost; the next flush retries it
+                with self._cond:
+                    self._ops = batch + self._ops
+                    self._first_pending_at = time.monotonic()
+                raise
+            
+            with self._cond:
+                self._flushed_seq = batch[-1][0]
+                self._prune()
+            self.flushes += 1
+            self.flushed_ops += len(batch)
+            return len(batch)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ops and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                deadline = self._first_pending_at + self.max_lag
+                while len(self._ops) < self.max_batch and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed, will retry: {e}")
+                time.sleep(self.max_lag)
+
+    def stop(self):
+        """Stops the flusher thread after committing whatever is pending."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+journal = WriteBehindJournal() if WRITE_BEHIND else None
+
+def flush_pending_writes():
+    """Commits any journaled writes immediately. Returns the number of ops flushed."""
+    if journal is None:
+        return 0
+    return journal.flush()
+
+def shutdown():
+    """Flushes pending writes and closes all connections (call on SIGTERM/exit)."""
+    global journal
+    if journal is not None:
+        journal.stop()
+        journal = None
+    close_connections()
+
+# --- Async API ---
+# All blocking SQLite work runs on one dedicated thread so the event loop
+# (gateway heartbeat, other guilds' events) never waits on disk I/O.
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+SQLITE_CALL_SECONDS = metrics.registry.histogram(
+    "sqlite_call_seconds", "Time spent running a database function on the database thread.", labels=("call",))
+metrics.registry.gauge("sqlite_pending_writes", "Record writes journaled but not yet committed.",
+                       fn=lambda: journal.pending() if journal is not None else 0)
+metrics.registry.counter("guild_config_cache_total", "Config cache lookups and evictions.", labels=("event",),
+                         fn=lambda: {(k,): v for k, v in config_cache.stats().items() if k in ("hits", "misses", "evictions")})
+
+def _timed_call(func, args, kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        SQLITE_CALL_SECONDS.labels(func.__name__).observe(time.perf_counter() - started)
+
+async def run_async(func, *args, **kwargs):
+    """Runs a blocking database function on the database thread and awaits the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed_call, func, args, kwargs)
+
+def _make_async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_async(func, *args, **kwargs)
+    return wrapper
+
+def _make_async_write(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Journaling only takes an in-memory lock, so there is no need to hop threads
+        if journal is not None:
+            return func(*args, **kwargs)
+        return await run_async(func, *args, **kwargs)
+    return wrapper
+
+init_db_async = _make_async(init_db)
+update_guild_config_async = _make_async(update_guild_config)
+get_attendance_records_async = _make_async(get_attendance_records)
+add_or_update_record_async = _make_async_write(add_or_update_record)
+delete_record_async = _make_async_write(delete_record)
+apply_record_changes_async = _make_async_write(apply_record_changes)
+replace_all_records_async = _make_async_write(replace_all_records)
+clear_attendance_records_async = _make_async_write(clear_attendance_records)
+get_due_records_async = _make_async(get_due_records)
+ping_async = _make_async(ping)
+get_next_expiry_async = _make_async(get_next_expiry)
+get_daily_rollup_async = _make_async(get_daily_rollup)
+start_eod_job_async = _make_async(start_eod_job)
+set_eod_job_step_async = _make_async(set_eod_job_step)
+plan_eod_job_async = _make_async(plan_eod_job)
+get_eod_job_members_async = _make_async(get_eod_job_members)
+mark_eod_members_done_async = _make_async(mark_eod_members_done)
+finish_eod_job_async = _make_async(finish_eod_job)
+get_unfinished_eod_jobs_async = _make_async(get_unfinished_eod_jobs)
+get_attendance_events_async = _make_async(get_attendance_events)
+
+async def get_guild_config_async(guild_id):
+    """Retrieves configuration for a guild; cache hits skip the database thread entirely."""
+    row = config_cache.get(guild_id)
+    if row is GuildConfigCache.MISSING:
+        return await run_async(_load_guild_config, guild_id)
+    return dict(row) if row else None
+
+def get_config_cache_stats():
+    """Returns hit/miss/eviction counters for the guild config cache."""
+    return config_cache.stats()
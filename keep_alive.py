@@ -1,18 +1,70 @@
-from flask import Flask
-from threading import Thread
+import asyncio
+import inspect
+import logging
 import os
 
-app = Flask('')
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return "I'm alive!"
+import metrics
 
-def run():
+logger = logging.getLogger(__name__)
+
+# A readiness check slower than this counts as failed
+READY_CHECK_TIMEOUT = float(os.getenv("READY_CHECK_TIMEOUT", 5))
+
+_runner = None
+
+async def home(request):
+    return web.Response(text="I'm alive!")
+
+async def healthz(request):
+    """The process is up and its event loop is answering."""
+    return web.Response(text="ok")
+
+async def readyz(request):
+    """Runs every registered check; 200 only if all of them pass."""
+    results = {}
+    for name, check in request.app["ready_checks"].items():
+        try:
+            ok = check()
+            if inspect.isawaitable(ok):
+                ok = await asyncio.wait_for(ok, timeout=READY_CHECK_TIMEOUT)
+            results[name] = bool(ok)
+        except Exception as e:
+            logger.warning(f"Readiness check '{name}' failed: {e!r}")
+            results[name] = False
+    ready = all(results.values())
+    return web.json_response({"ready": ready, "checks": results}, status=200 if ready else 503)
+
+async def metrics_endpoint(request):
+    return web.Response(body=metrics.registry.render().encode(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+async def keep_alive(ready_checks=None, port=None):
+    """
+    Starts the health/metrics HTTP server on the running event loop.
+    ready_checks maps a name to a callable (sync or async) returning True when healthy.
+    """
+    global _runner
+    if _runner is not None:
+        return _runner
+    app = web.Application()
+    app["ready_checks"] = dict(ready_checks or {})
+    app.router.add_get('/', home)
+    app.router.add_get('/healthz', healthz)
+    app.router.add_get('/readyz', readyz)
+    app.router.add_get('/metrics', metrics_endpoint)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
     # Use the PORT environment variable provided by Render, or default to 8080
-    port = int(os.environ.get("PORT", 8080))
-    app.run(host='0.0.0.0', port=port)
+    port = port or int(os.environ.get("PORT", 8080))
+    await web.TCPSite(runner, host='0.0.0.0', port=port).start()
+    _runner = runner
+    logger.info(f"Health server listening on port {port}")
+    return runner
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
\ No newline at end of file
+async def stop():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,126 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+import metrics
+
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 5 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 3))
+# Per call site on rate_limited_logger() loggers: at most LOG_RATE_LIMIT INFO/DEBUG
+# records every LOG_RATE_WINDOW_SECONDS (0 disables)
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", 20))
+LOG_RATE_WINDOW_SECONDS = float(os.getenv("LOG_RATE_WINDOW_SECONDS", 60))
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+
+LOG_SUPPRESSED = metrics.registry.counter(
+    "log_records_suppressed_total", "Log records dropped by the per-call-site rate limit.")
+
+logger = logging.getLogger(__name__)
+
+class CallSiteRateLimit(logging.Filter):
+    """
+    Lets through at most `limit` records per `window` seconds from each call
+    site (file and line), so a hot-path log line costs the same at 10 or 10,000
+    messages a minute. Records above max_level (warnings and errors by default)
+    are never dropped. When a site that dropped records logs again in a new
+    window, a WARNING says how many were suppressed.
+    Attach it to a hot-path logger (see rate_limited_logger), not to a handler.
+    """
+
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW_SECONDS, max_level=logging.INFO):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.max_level = max_level
+        self._sites = {}    # (pathname, lineno) -> [window_start, count, suppressed]
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        state = self._sites.get(key)
+        if state is None or record.created - state[0] >= self.window:
+            self._sites[key] = [record.created, 1, 0]
+            if state is not None and state[2]:
+                self._report_suppressed(record, state[2])
+            return True
+        state[1] += 1
+        if state[1] <= self.limit:
+            return True
+        state[2] += 1
+        LOG_SUPPRESSED.inc()
+        return False
+
+    def _report_suppressed(self, record, count):
+        # Not isEnabledFor(): like handle(), it reports False while a filter runs
+        if logger.disabled or logger.getEffectiveLevel() > logging.WARNING:
+            return
+        summary = logger.makeRecord(
+            logger.name, logging.WARNING, record.pathname, record.lineno,
+            f"Suppressed {count} log record(s) from {os.path.basename(record.pathname)}:{record.lineno} "
+            f"({record.name}) in the last {self.window:g}s", None, None)
+        # Logger.handle() drops records logged from inside a filter, so go to the handlers directly
+        logger.callHandlers(summary)
+
+def rate_limited_logger(name):
+    """
+    Returns the named logger with a CallSiteRateLimit attached, for log lines on
+    hot paths (per message, per report). Other loggers are never rate limited.
+    """
+    log = logging.getLogger(name)
+    if not any(isinstance(f, CallSiteRateLimit) for f in log.filters):
+        log.addFilter(CallSiteRateLimit())
+    return log
+
+class DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting (timestamps, tracebacks) to the writer thread."""
+
+    def prepare(self, record):
+        # Merge the args now, while they still hold the values being logged
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+_listener = None
+
+def setup_logging(level=logging.INFO):
+    """
+    Routes every log record through a queue: callers (including the event loop)
+    only enqueue, and a background thread formats and writes to a size-rotated
+    LOG_FILE and stderr.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredFormatQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+    metrics.registry.gauge("log_queue_depth", "Log records waiting for the writer thread.", fn=log_queue.qsize)
+    return _listener
+
+def shutdown():
+    """Writes out queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,148 @@
+import asyncio
+import collections
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", 100))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", 100))
+LOOP_BLOCK_BUFFER = int(os.getenv("LOOP_BLOCK_BUFFER", 50))
+
+# Frames from this directory are "ours"; the innermost one names the call site
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+_STACK_DEPTH = 12
+
+LOOP_LAG_SECONDS = metrics.registry.histogram(
+    "event_loop_lag_seconds", "How late the loop-lag sampler woke up.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+LOOP_BLOCKS = metrics.registry.counter(
+    "event_loop_blocked_total", "Times the event loop was blocked for longer than LOOP_BLOCK_THRESHOLD_MS.")
+
+class LoopBlock:
+    """One stall of the event loop, with the stack the watchdog saw while it lasted."""
+    __slots__ = ("at", "lag", "task", "site", "stack")
+
+    def __init__(self, at, lag, task=None, site=None, stack=None):
+        self.at = at            # epoch seconds the stall ended
+        self.lag = lag          # seconds
+        self.task = task        # name of the asyncio task that was running, if known
+        self.site = site        # innermost "file:line in func" from this repo, if captured
+        self.stack = stack or []
+
+class LoopLagMonitor:
+    """
+    A sampler task sleeps for a fixed interval and measures how late it wakes;
+    that delay is the time the loop spent on something else. A watchdog thread
+    notices when the sampler is overdue by more than the threshold and snapshots
+    the loop thread's stack (sys._current_frames) while the stall is still in
+    progress, so the blocking call site is known rather than guessed.
+    Stalls go into a ring buffer (see blocks) and /metrics.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL_MS / 1000, threshold=LOOP_BLOCK_THRESHOLD_MS / 1000,
+                 buffer=LOOP_BLOCK_BUFFER):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocks = collections.deque(maxlen=buffer)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.samples = 0
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+        self._beat = 0.0        # monotonic time the sampler is next expected to wake
+        self._capture = None    # (task, site, stack) seen by the watchdog during the current stall
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Starts the sampler on the running loop and the watchdog thread (idempotent)."""
+        if self.is_running():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic() + self.interval
+        self._stop.clear()
+        self._task = asyncio.create_task(self._sample(), name="loop-lag-sampler")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self):
+        while True:
+            self._beat = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._beat)
+            self.samples += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            capture, self._capture = self._capture, None
+            if lag >= self.threshold:
+                self._record(lag, capture)
+
+    def _record(self, lag, capture):
+        task, site, stack = capture or (None, None, None)
+        self.blocks.append(LoopBlock(time.time(), lag, task, site, stack))
+        LOOP_BLOCKS.inc()
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f}ms"
+                       + (f" in {site}" if site else "") + (f" (task {task})" if task else ""))
+
+    def _watch(self):
+        poll = max(0.005, self.threshold / 4)
+        while not self._stop.wait(poll):
+            overdue = time.monotonic() - self._beat
+            if overdue >= self.threshold and self._capture is None:
+                try:
+                    self._capture = self._snapshot()
+                except Exception as e:
+                    self._capture = (None, None, [f"stack unavailable: {e}"])
+
+    def _snapshot(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)[-_STACK_DEPTH:]
+        lines = [f"{os.path.basename(f.filename)}:{f.lineno} in {f.name}" for f in stack]
+        site = None
+        for f in reversed(stack):
+            if os.path.dirname(os.path.abspath(f.filename)) == _REPO_DIR:
+                site = f"{os.path.basename(f.filename)}:{f.lineno} in {f.name}"
+                break
+        return self._current_task_name(frame), site, lines
+
+    def _current_task_name(self, frame):
+        try:
+            task = asyncio.current_task(self._loop)
+            if task is not None:
+                return task.get_name()
+        except Exception:
+            pass
+        # Fall back to the outermost coroutine on the stack
+        name = None
+        while frame is not None:
+            if frame.f_code.co_flags & inspect.CO_COROUTINE:
+                name = frame.f_code.co_name
+            frame = frame.f_back
+        return name
+
+monitor = LoopLagMonitor()
+
+metrics.registry.gauge("event_loop_lag_max_seconds", "Largest loop lag seen since startup.",
+                       fn=lambda: monitor.max_lag)
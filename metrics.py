@@ -0,0 +1,180 @@
+import bisect
+import math
+
+# Latency buckets (seconds) shared by most histograms: 0.5ms .. 30s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class _Metric:
+    """
+    Base for the metric types below. Updates are plain attribute arithmetic
+    with no locks: the GIL keeps them safe enough for monitoring, and a scrape
+    racing an update at worst sees a value one update stale.
+    A metric built with fn= is read at scrape time instead: fn returns a number,
+    or {label_values_tuple: number} for a labelled metric.
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.fn = fn
+        self._children = {}
+        if not self.labelnames and fn is None:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Returns the child for these label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _label_str(self, values, extra=()):
+        pairs = [*zip(self.labelnames, values), *extra]
+        if not pairs:
+            return ""
+        escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def _samples(self):
+        if self.fn is None:
+            return [(values, child.value) for values, child in list(self._children.items())]
+        value = self.fn()
+        if isinstance(value, dict):
+            return [(k if isinstance(k, tuple) else (k,), v) for k, v in value.items()]
+        return [((), value)] if value is not None else []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in self._samples():
+            lines.append(f"{self.name}{self._label_str(values)} {_format(value)}")
+        return lines
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount=1):
+        self._children[()].dec(amount)
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, child in list(self._children.items()):
+            counts = list(child.counts)
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), counts):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else _format(bound)
+                lines.append(f"{self.name}_bucket{self._label_str(values, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_str(values)} {_format(child.sum)}")
+            lines.append(f"{self.name}_count{self._label_str(values)} {cumulative}")
+        return lines
+
+def _format(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=(), fn=None):
+        return self.register(Counter(name, help, labels, fn))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self.register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One broken callback must not take the whole scrape down
+                lines.append(f"# {metric.name} unavailable: {type(e).__name__}")
+        return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
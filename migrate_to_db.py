@@ -1,101 +1,211 @@
 import os
 import json
+import time
 import sqlite3
-from database import init_db, update_guild_config, add_or_update_record, DB_FILE
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from database import init_db, update_guild_config, add_or_update_record, bulk_import_guild, DB_FILE
 
 DATA_DIR = "data"
+CHECKPOINT_FILE = ".migrate_checkpoint.json"
 
-def migrate():
+def config_from_json(data):
+    """Maps a legacy guild JSON document onto guild_configs columns."""
+    settings = data.get('settings', {})
+
+    return {
+        "attendance_role_id": data.get('attendance_role_id'),
+        "absent_role_id": data.get('absent_role_id'),
+        "excused_role_id": data.get('excused_role_id'),
+        "welcome_channel_id": data.get('welcome_channel_id'),
+        "report_channel_id": data.get('report_channel_id'),
+        "last_report_message_id": data.get('last_report_message_id'),
+        "last_report_channel_id": data.get('last_report_channel_id'),
+        "allowed_role_id": data.get('allowed_role_id'),
+        "ping_role_id": data.get('ping_role_id'),
+
+        # Flatten settings
+        "attendance_mode": settings.get('attendance_mode', 'duration'),
+        "attendance_expiry_hours": settings.get('attendance_expiry_hours', 12),
+        "window_start_time": settings.get('window_start_time', '08:00'),
+        "window_end_time": settings.get('window_end_time', '17:00'),
+        "last_processed_date": settings.get('last_processed_date'),
+        "last_opened_date": settings.get('last_opened_date'), # Might be missing in some JSONs
+        "allow_self_marking": settings.get('allow_self_marking', True),
+        "require_admin_excuse": settings.get('require_admin_excuse', False),
+        "auto_nick_on_join": settings.get('auto_nick_on_join', False),
+        "enforce_suffix": settings.get('enforce_suffix', False),
+        "remove_suffix_on_role_loss": settings.get('remove_suffix_on_role_loss', False),
+        "suffix_format": settings.get('suffix_format', ' [𝙼𝚂𝚄𝚊𝚗]')
+    }
+
+def records_from_json(data):
+    """
+    Returns ([(user_id, status, timestamp, channel_id, reason)], errors) for a legacy guild JSON document.
+    """
+    rows = []
+    errors = []
+    for user_id_str, record in data.get('records', {}).items():
+        try:
+            user_id = int(user_id_str)
+            # Handle different record formats if any (old string format vs new dict)
+            if isinstance(record, str):
+                # Legacy format: just the timestamp of a "present" mark
+                rows.append((user_id, "present", record, None, None))
+            else:
+                rows.append((
+                    user_id,
+                    record.get('status', 'present'),
+                    record.get('timestamp'),
+                    record.get('channel_id'),
+                    record.get('reason')
+                ))
+        except Exception as e:
+            errors.append(f"Failed to migrate record for user {user_id_str}: {e}")
+    return rows, errors
+
+def guild_files(data_dir):
+    """Returns [(guild_id, filepath)] for every guild JSON file in data_dir."""
+    result = []
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            guild_id = int(filename.replace('.json', ''))
+        except ValueError:
+            print(f"Skipping invalid filename: {filename}")
+            continue
+        result.append((guild_id, os.path.join(data_dir, filename)))
+    return result
+
+def migrate(data_dir=DATA_DIR):
+    """Legacy migration: one connection and commit per record."""
     print("Initializing database...")
     init_db()
-    
-    if not os.path.exists(DATA_DIR):
+
+    if not os.path.exists(data_dir):
         print("No data directory found. Skipping migration.")
         return
 
-    files = [f for f in os.listdir(DATA_DIR) if f.endswith('.json')]
+    files = guild_files(data_dir)
     print(f"Found {len(files)} guild data files to migrate.")
 
-    for filename in files:
-        guild_id_str = filename.replace('.json', '')
-        try:
-            guild_id = int(guild_id_str)
-        except ValueError:
-            print(f"Skipping invalid filename: {filename}")
-            continue
-            
-        filepath = os.path.join(DATA_DIR, filename)
+    for guild_id, filepath in files:
         print(f"Migrating guild {guild_id} from {filepath}...")
-        
+
         try:
             with open(filepath, 'r') as f:
                 data = json.load(f)
         except Exception as e:
-            print(f"Error reading {filename}: {e}")
+            print(f"Error reading {filepath}: {e}")
             continue
-            
+
         # 1. Migrate Settings & Config
-        settings = data.get('settings', {})
-        
-        config_update = {
-            "attendance_role_id": data.get('attendance_role_id'),
-            "absent_role_id": data.get('absent_role_id'),
-            "excused_role_id": data.get('excused_role_id'),
-            "welcome_channel_id": data.get('welcome_channel_id'),
-            "report_channel_id": data.get('report_channel_id'),
-            "last_report_message_id": data.get('last_report_message_id'),
-            "last_report_channel_id": data.get('last_report_channel_id'),
-            
-            # Flatten settings
-            "attendance_mode": settings.get('attendance_mode', 'duration'),
-            "attendance_expiry_hours": settings.get('attendance_expiry_hours', 12),
-            "window_start_time": settings.get('window_start_time', '08:00'),
-            "window_end_time": settings.get('window_end_time', '17:00'),
-            "last_processed_date": settings.get('last_processed_date'),
-            "last_opened_date": settings.get('last_opened_date'), # Might be missing in some JSONs
-            "allow_self_marking": settings.get('allow_self_marking', True),
-            "require_admin_excuse": settings.get('require_admin_excuse', False),
-            "auto_nick_on_join": settings.get('auto_nick_on_join', False),
-            "enforce_suffix": settings.get('enforce_suffix', False),
-            "remove_suffix_on_role_loss": settings.get('remove_suffix_on_role_loss', False),
-            "suffix_format": settings.get('suffix_format', ' [𝙼𝚂𝚄𝚊𝚗]')
-        }
-        
-        # Filter out None values to let DB defaults apply? 
-        # Actually update_guild_config will handle it. 
-        # But if key is missing in JSON, we might want to preserve DB default if it's a new row.
-        # But here we are creating the row.
-        
-        update_guild_config(guild_id, **config_update)
-        
+        update_guild_config(guild_id, **config_from_json(data))
+
         # 2. Migrate Records
-        records = data.get('records', {})
-        count = 0
-        for user_id_str, record in records.items():
-            try:
-                user_id = int(user_id_str)
-                # Handle different record formats if any (old string format vs new dict)
-                if isinstance(record, str):
-                     # Legacy format: just timestamp? or "present"?
-                     # Code says: info = {"status": "present", "timestamp": info, "channel_id": None}
-                     status = "present"
-                     timestamp = record
-                     channel_id = None
-                     reason = None
-                else:
-                    status = record.get('status', 'present')
-                    timestamp = record.get('timestamp')
-                    channel_id = record.get('channel_id')
-                    reason = record.get('reason')
-                
-                add_or_update_record(guild_id, user_id, status, timestamp, channel_id, reason)
-                count += 1
-            except Exception as e:
-                print(f"Failed to migrate record for user {user_id_str}: {e}")
-        
-        print(f"  - Migrated {count} records.")
+        rows, errors = records_from_json(data)
+        for error in errors:
+            print(error)
+        for user_id, status, timestamp, channel_id, reason in rows:
+            add_or_update_record(guild_id, user_id, status, timestamp, channel_id, reason)
+
+        print(f"  - Migrated {len(rows)} records.")
 
     print("Migration complete.")
 
+# --- Bulk Migration ---
+
+def parse_guild_file(job):
+    """Worker: parses one guild file into (guild_id, config, rows, errors). Runs in a child process."""
+    guild_id, filepath = job
+    try:
+        with open(filepath, 'r') as f:
+            data = json.load(f)
+    except Exception as e:
+        return guild_id, None, [], [f"Error reading {filepath}: {e}"]
+    rows, errors = records_from_json(data)
+    return guild_id, config_from_json(data), rows, errors
+
+def load_checkpoint(path):
+    """Returns the set of guild ids already migrated according to the checkpoint file."""
+    if not os.path.exists(path):
+        return set()
+    try:
+        with open(path, 'r') as f:
+            return set(json.load(f).get('completed', []))
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}")
+        return set()
+
+def save_checkpoint(path, completed):
+    """Atomically records the completed guild ids."""
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump({"db_file": DB_FILE, "completed": sorted(completed)}, f)
+    os.replace(tmp, path)
+
+def migrate_bulk(data_dir=DATA_DIR, workers=None, checkpoint=CHECKPOINT_FILE, restart=False):
+    """
+    Bulk migration: JSON is parsed across a process pool and each guild is
+    written in one transaction with executemany. Completed guilds are recorded
+    in a checkpoint file, so a crashed run resumes from the last finished guild.
+    """
+    print("Initializing database...")
+    init_db()
+
+    if not os.path.exists(data_dir):
+        print("No data directory found. Skipping migration.")
+        return
+
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    completed = load_checkpoint(checkpoint)
+
+    files = guild_files(data_dir)
+    pending = [job for job in files if job[0] not in completed]
+    print(f"Found {len(files)} guild data files ({len(files) - len(pending)} already migrated, {len(pending)} to go).")
+    if not pending:
+        print("Migration complete.")
+        return
+
+    started = time.perf_counter()
+    total_records = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for done, (guild_id, config, rows, errors) in enumerate(pool.map(parse_guild_file, pending, chunksize=4), start=1):
+            for error in errors:
+                print(error)
+            if config is None:
+                continue
+
+            bulk_import_guild(guild_id, config, rows)
+            completed.add(guild_id)
+            save_checkpoint(checkpoint, completed)
+
+            total_records += len(rows)
+            elapsed = time.perf_counter() - started
+            rate = total_records / elapsed if elapsed else 0
+            eta = elapsed / done * (len(pending) - done)
+            print(f"[{done}/{len(pending)}] Guild {guild_id}: {len(rows)} records "
+                  f"({rate:,.0f} records/sec, ETA {eta:.0f}s)")
+
+    elapsed = time.perf_counter() - started
+    rate = total_records / elapsed if elapsed else 0
+    print(f"Migration complete: {total_records} records in {elapsed:.1f}s ({rate:,.0f} records/sec).")
+
+    # Everything landed; the checkpoint is only needed to resume a failed run
+    os.remove(checkpoint)
+
 if __name__ == "__main__":
-    migrate()
+    parser = argparse.ArgumentParser(description="Migrate legacy data/*.json guild files into SQLite.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory containing <guild_id>.json files")
+    parser.add_argument("--legacy", action="store_true", help="Use the old record-at-a-time migration")
+    parser.add_argument("--workers", type=int, default=None, help="JSON parser processes (default: CPU count)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Checkpoint file used to resume a crashed run")
+    parser.add_argument("--restart", action="store_true", help="Ignore any existing checkpoint and start over")
+    args = parser.parse_args()
+
+    if args.legacy:
+        migrate(args.data_dir)
+    else:
+        migrate_bulk(args.data_dir, workers=args.workers, checkpoint=args.checkpoint, restart=args.restart)
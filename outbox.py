@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+
+import aiohttp
+import discord
+
+logger = logging.getLogger(__name__)
+
+DM_OUTBOX_WORKERS = int(os.getenv("DM_OUTBOX_WORKERS", 4))
+DM_OUTBOX_MAX_QUEUE = int(os.getenv("DM_OUTBOX_MAX_QUEUE", 10000))
+DM_OUTBOX_MAX_ATTEMPTS = int(os.getenv("DM_OUTBOX_MAX_ATTEMPTS", 5))
+DM_OUTBOX_BACKOFF_SECONDS = float(os.getenv("DM_OUTBOX_BACKOFF_SECONDS", 2))
+DM_CLOSED_TTL_HOURS = float(os.getenv("DM_CLOSED_TTL_HOURS", 6))
+DM_CLOSED_CACHE_SIZE = 50000
+
+class DMOutbox:
+    """
+    Queue of direct messages drained by a small worker pool, so callers never
+    wait on a DM round trip. Transient failures (5xx, network) are retried with
+    exponential backoff; users whose DMs are closed (403) are remembered for
+    DM_CLOSED_TTL_HOURS and skipped instead of being retried on every mark.
+    """
+
+    def __init__(self, workers=DM_OUTBOX_WORKERS, max_queue=DM_OUTBOX_MAX_QUEUE,
+                 max_attempts=DM_OUTBOX_MAX_ATTEMPTS, backoff=DM_OUTBOX_BACKOFF_SECONDS,
+                 closed_ttl=DM_CLOSED_TTL_HOURS * 3600):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.closed_ttl = closed_ttl
+        self._max_queue = max_queue
+        self._queue = None
+        self._tasks = []
+        self._closed = OrderedDict()    # user_id -> monotonic time the entry expires
+        self.stats = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "closed": 0,
+                      "skipped_closed": 0, "dropped": 0}
+
+    def is_closed(self, user_id):
+        expires = self._closed.get(user_id)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._closed[user_id]
+            return False
+        return True
+
+    def _mark_closed(self, user_id):
+        self._closed[user_id] = time.monotonic() + self.closed_ttl
+        self._closed.move_to_end(user_id)
+        while len(self._closed) > DM_CLOSED_CACHE_SIZE:
+            self._closed.popitem(last=False)
+
+    def send(self, user, **kwargs):
+        """Queues user.send(**kwargs). Returns False if the DM was skipped or dropped."""
+        if self.is_closed(user.id):
+            self.stats["skipped_closed"] += 1
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait((user, kwargs, 1))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.warning(f"DM outbox full; dropped DM to {user.id}")
+            return False
+        self.stats["queued"] += 1
+        return True
+
+    def pending(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def join(self):
+        """Waits until every queued DM has been handled (retries scheduled for later are not waited on)."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def start(self):
+        """Starts the workers (needs a running event loop); a no-op once started."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_queue)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"dm-outbox-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _retry(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    async def _worker(self):
+        while True:
+            user, kwargs, attempt = await self._queue.get()
+            try:
+                if self.is_closed(user.id):
+                    self.stats["skipped_closed"] += 1
+                    continue
+                await user.send(**kwargs)
+                self.stats["sent"] += 1
+            except discord.Forbidden:
+                self._mark_closed(user.id)
+                self.stats["closed"] += 1
+                logger.warning(f"Could not DM user {user} (Closed DMs); not retrying for {self.closed_ttl / 3600:g}h")
+            except (discord.HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # 4xx other than 429 will not succeed on retry
+                status = getattr(e, 'status', 500)
+                if attempt < self.max_attempts and (status >= 500 or status == 429):
+                    delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                    self.stats["retried"] += 1
+                    asyncio.get_running_loop().call_later(delay, self._retry, (user, kwargs, attempt + 1))
+                else:
+                    self.stats["failed"] += 1
+                    logger.error(f"Giving up on DM to {user} after {attempt} attempt(s): {e}")
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Unexpected error sending DM to {user}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+dm_outbox = DMOutbox()
@@ -0,0 +1,50 @@
+from reports import STATUSES
+
+class PresenceIndex:
+    """
+    user_id -> status for one guild, plus one set of user ids per status, so
+    "is this user already present?" and per-status counts are O(1) without
+    loading records or scanning a member's roles.
+    """
+
+    __slots__ = ("status_of", "members")
+
+    def __init__(self):
+        self.status_of = {}                          # user_id (int) -> status
+        self.members = {s: set() for s in STATUSES}  # status -> {user_id}
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds an index from {user_id: record} as returned by load_attendance_data."""
+        index = cls()
+        for uid, info in records.items():
+            status = "present" if isinstance(info, str) else info.get('status', 'present')
+            index.set(int(uid), status)
+        return index
+
+    def set(self, user_id, status):
+        previous = self.status_of.get(user_id)
+        if previous == status:
+            return
+        if previous in self.members:
+            self.members[previous].discard(user_id)
+        self.status_of[user_id] = status
+        if status in self.members:
+            self.members[status].add(user_id)
+
+    def remove(self, user_id):
+        previous = self.status_of.pop(user_id, None)
+        if previous in self.members:
+            self.members[previous].discard(user_id)
+
+    def clear(self):
+        self.status_of.clear()
+        for members in self.members.values():
+            members.clear()
+
+    def status(self, user_id):
+        """Returns the user's current status, or None if they have no record."""
+        return self.status_of.get(user_id)
+
+    def count(self, status):
+        return len(self.members[status])
@@ -0,0 +1,91 @@
+import bisect
+
+STATUSES = ("present", "absent", "excused")
+
+class AttendanceReport:
+    """
+    In-memory attendance report for one guild.
+    Keeps three buckets (present/absent/excused) sorted by lowercased display name,
+    so a status change or rename is a binary search plus one list insert/remove
+    instead of reloading and re-sorting the whole roster.
+    """
+
+    def __init__(self):
+        self.entries = {}                            # user_id -> (sort_key, status, name, reason)
+        self.buckets = {s: [] for s in STATUSES}     # status -> sorted [sort_key]
+
+    @classmethod
+    def from_records(cls, records, get_name):
+        """Builds a report from {user_id: record} as returned by load_attendance_data."""
+        report = cls()
+        for uid, info in records.items():
+            if isinstance(info, str):
+                info = {"status": "present", "timestamp": info}
+            report.set(int(uid), info.get('status', 'present'), get_name(int(uid)), info.get('reason'))
+        return report
+
+    @staticmethod
+    def _key(user_id, name):
+        # user_id breaks ties between identical names
+        return (name.lower(), user_id)
+
+    def _unlink(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return None
+        key, status, _, _ = entry
+        bucket = self.buckets.get(status)
+        if bucket is not None:
+            i = bisect.bisect_left(bucket, key)
+            if i < len(bucket) and bucket[i] == key:
+                del bucket[i]
+        return entry
+
+    def set(self, user_id, status, name, reason=None):
+        """Records a user's current status (replacing any previous one)."""
+        self._unlink(user_id)
+        key = self._key(user_id, name)
+        self.entries[user_id] = (key, status, name, reason)
+        bucket = self.buckets.get(status)
+        if bucket is not None:
+            bisect.insort(bucket, key)
+
+    def remove(self, user_id):
+        self._unlink(user_id)
+
+    def rename(self, user_id, name):
+        """Moves a user to their new sorted position after a display name change."""
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[2] != name:
+            _, status, _, reason = entry
+            self.set(user_id, status, name, reason)
+
+    def clear(self):
+        self.entries.clear()
+        for bucket in self.buckets.values():
+            bucket.clear()
+
+    def count(self, status):
+        return len(self.buckets[status])
+
+    def format_bucket(self, status, limit=1000, truncate_at=950):
+        """
+        Renders one bucket as the embed field value, stopping as soon as the
+        Discord field limit is reached (only the visible entries are formatted).
+        """
+        bucket = self.buckets[status]
+        if not bucket:
+            return "None"
+
+        lines = []
+        length = 0
+        for key in bucket:
+            _, _, name, reason = self.entries[key[1]]
+            entry = f"• {name}"
+            if reason:
+                entry += f" (*{reason}*)"
+            length += len(entry) + (1 if lines else 0)
+            lines.append(entry)
+            if length > limit:
+                return "\n".join(lines)[:truncate_at] + "\n... (truncated)"
+        return "\n".join(lines)
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import re
+import time
+
+import aiohttp
+import discord
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Concurrency used until Discord has told us the real bucket size
+ROLE_ENGINE_CONCURRENCY = int(os.getenv("ROLE_ENGINE_CONCURRENCY", 5))
+ROLE_ENGINE_PROGRESS_SECONDS = float(os.getenv("ROLE_ENGINE_PROGRESS_SECONDS", 5))
+
+# PATCH/PUT/DELETE /guilds/{guild_id}/members/{user_id}[/roles/{role_id}] share the guild's member bucket
+_MEMBER_ROUTE = re.compile(r"/guilds/(\d+)/members/\d+")
+
+# Route labels: ids, tokens and emoji become placeholders so the label set stays small
+_API_PREFIX = re.compile(r"^/api/v\d+")
+_TOKEN_SEGMENT = re.compile(r"/(webhooks|interactions)/(\d+)/[^/]+")
+_EMOJI_SEGMENT = re.compile(r"/reactions/[^/]+")
+_ID_SEGMENT = re.compile(r"/\d{5,}")
+
+DISCORD_HTTP_SECONDS = metrics.registry.histogram(
+    "discord_http_request_seconds", "Discord REST request latency.", labels=("method", "route"))
+DISCORD_HTTP_429 = metrics.registry.counter(
+    "discord_http_429_total", "Discord REST responses with status 429.", labels=("method", "route"))
+
+def route_template(path):
+    """/api/v10/guilds/123/members/456 -> /guilds/{id}/members/{id}"""
+    path = _API_PREFIX.sub("", path)
+    path = _TOKEN_SEGMENT.sub(r"/\1/{id}/{token}", path)
+    path = _EMOJI_SEGMENT.sub("/reactions/{emoji}", path)
+    return _ID_SEGMENT.sub("/{id}", path)
+
+class RateLimitObserver:
+    """
+    Records the X-RateLimit-* headers Discord returns for member edits, per guild,
+    and the latency / 429s of every request for /metrics.
+    Fed by an aiohttp TraceConfig passed to the bot as http_trace.
+    """
+
+    def __init__(self):
+        self.buckets = {}   # guild_id -> {"limit", "remaining", "reset_at"} (reset_at is monotonic)
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_request_end.append(self._on_request_end)
+
+    async def _on_request_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.started = time.perf_counter()
+
+    async def _on_request_end(self, session, trace_config_ctx, params):
+        started = getattr(trace_config_ctx, 'started', None)
+        if started is not None:
+            route = route_template(params.url.path)
+            DISCORD_HTTP_SECONDS.labels(params.method, route).observe(time.perf_counter() - started)
+            if params.response.status == 429:
+                DISCORD_HTTP_429.labels(params.method, route).inc()
+        if params.method == 'GET':
+            return
+        match = _MEMBER_ROUTE.search(params.url.path)
+        if not match:
+            return
+        headers = params.response.headers
+        if 'X-RateLimit-Limit' not in headers:
+            return
+        try:
+            self.buckets[int(match.group(1))] = {
+                "limit": int(headers['X-RateLimit-Limit']),
+                "remaining": int(headers.get('X-RateLimit-Remaining', 0)),
+                "reset_at": time.monotonic() + float(headers.get('X-RateLimit-Reset-After', 0)),
+            }
+        except ValueError:
+            pass
+
+    def bucket(self, guild_id):
+        return self.buckets.get(guild_id)
+
+rate_limits = RateLimitObserver()
+
+class ProgressMessage:
+    """Posts one status message to a channel and edits it as a bulk job advances."""
+
+    def __init__(self, channel, label):
+        self.channel = channel
+        self.label = label
+        self.message = None
+
+    async def __call__(self, done, total, eta):
+        content = f"⏳ {self.label}: {done}/{total}"
+        if eta is not None and done < total:
+            content += f" (about {eta:.0f}s left)"
+        try:
+            if self.message is None:
+                self.message = await self.channel.send(content)
+            else:
+                await self.message.edit(content=content)
+        except discord.HTTPException as e:
+            logger.warning(f"Could not update progress message: {e}")
+
+class RoleChangeResult:
+    def __init__(self):
+        self.changed = 0
+        self.unchanged = 0
+        self.forbidden = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return (f"RoleChangeResult(changed={self.changed}, unchanged={self.unchanged}, "
+                f"forbidden={self.forbidden}, failed={self.failed})")
+
+def merge_jobs(jobs):
+    """
+    Merges (member, role, add) jobs into {member_id: (member, adds, removes)}.
+    A later job for the same member and role wins.
+    """
+    merged = {}
+    for member, role, add in jobs:
+        _, adds, removes = merged.setdefault(member.id, (member, {}, {}))
+        if add:
+            removes.pop(role.id, None)
+            adds[role.id] = role
+        else:
+            adds.pop(role.id, None)
+            removes[role.id] = role
+    return merged
+
+def target_roles(member, adds, removes):
+    """
+    The member's roles with adds/removes applied, from whatever roles it holds
+    now; None if that would change nothing.
+    """
+    current = [r for r in member.roles if not r.is_default()]
+    target = [r for r in current if r.id not in removes]
+    target.extend(r for r in adds.values() if r not in target)
+    if set(target) == set(current):
+        return None
+    return target
+
+async def _wait_for_bucket(guild_id, in_flight):
+    """Waits until the observed bucket allows another call beyond the ones in flight."""
+    while True:
+        bucket = rate_limits.bucket(guild_id)
+        if bucket is None or bucket["remaining"] > in_flight:
+            return
+        delay = bucket["reset_at"] - time.monotonic()
+        if delay <= 0:
+            return
+        await asyncio.sleep(delay)
+
+async def apply_role_changes(guild, jobs, progress=None, reason=None, on_done=None):
+    """
+    Applies (member, role, add) jobs with one member.edit(roles=...) per member.
+    Only the jobs' adds/removes are applied, to the roles the member holds in
+    the cache at the time of its edit; members already matching are skipped.
+    Calls run concurrently up to the member bucket's X-RateLimit-Limit and wait
+    for its reset when Remaining runs out; discord.py still handles any 429.
+    progress, if given, is an async callable(done, total, eta_seconds).
+    on_done, if given, is an async callable([member]) told about members as they
+    are finished with (edited or needing no change), e.g. to checkpoint. Members
+    whose edit failed are not reported, so a resumed job retries them.
+    """
+    result = RoleChangeResult()
+    pending = []
+    unchanged = []
+    for member, adds, removes in merge_jobs(jobs).values():
+        if target_roles(member, adds, removes) is None:
+            unchanged.append(member)
+        else:
+            pending.append((member, adds, removes))
+    result.unchanged = len(unchanged)
+    if unchanged and on_done:
+        await on_done(unchanged)
+
+    total = len(pending)
+    if not total:
+        if progress:
+            await progress(0, 0, None)
+        return result
+
+    started = time.monotonic()
+    state = {"done": 0, "in_flight": 0, "reported_at": started}
+
+    async def report(force=False):
+        if progress is None:
+            return
+        now = time.monotonic()
+        if not force and now - state["reported_at"] < ROLE_ENGINE_PROGRESS_SECONDS:
+            return
+        state["reported_at"] = now
+        done = state["done"]
+        eta = (now - started) / done * (total - done) if done else None
+        await progress(done, total, eta)
+
+    async def edit(member, adds, removes):
+        finished = False
+        try:
+            # Recompute from the cached roles now, so changes made since planning
+            # (by other commands, admins or bots) are kept rather than reverted
+            member = guild.get_member(member.id) or member
+            roles = target_roles(member, adds, removes)
+            if roles is None:
+                result.unchanged += 1
+            else:
+                await member.edit(roles=roles, reason=reason)
+                result.changed += 1
+            finished = True
+        except discord.Forbidden:
+            result.forbidden += 1
+            logger.warning(f"Failed to update roles for {member.name} (Missing Permissions)")
+        except Exception as e:
+            result.failed += 1
+            logger.error(f"Error updating roles for {member.id}: {e}")
+        finally:
+            state["in_flight"] -= 1
+            state["done"] += 1
+        if finished and on_done:
+            try:
+                await on_done([member])
+            except Exception as e:
+                logger.error(f"Role change callback failed for {member.id}: {e}")
+
+    await report(force=True)
+    running = set()
+    try:
+        for member, adds, removes in pending:
+            # Scale to the bucket size Discord reports, and hold off once Remaining is spent
+            while True:
+                bucket = rate_limits.bucket(guild.id)
+                concurrency = max(1, bucket["limit"] if bucket else ROLE_ENGINE_CONCURRENCY)
+                if len(running) < concurrency:
+                    break
+                _, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                await report()
+            await _wait_for_bucket(guild.id, state["in_flight"])
+            state["in_flight"] += 1
+            running.add(asyncio.create_task(edit(member, adds, removes)))
+        if running:
+            await asyncio.wait(running)
+    finally:
+        # If we are cancelled (e.g., a timeout), do not leave edits running behind the caller
+        for task in running:
+            task.cancel()
+    await report(force=True)
+
+    elapsed = time.monotonic() - started
+    # Single-member calls (status commands and buttons) would flood the log at INFO
+    log = logger.info if total > 1 else logger.debug
+    log(f"Role changes in {guild.name}: {result} in {elapsed:.1f}s")
+    return result
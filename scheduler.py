@@ -0,0 +1,101 @@
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class DeadlineScheduler:
+    """
+    Min-heap of (due_at, key) deadlines in epoch seconds.
+    run() sleeps exactly until the earliest deadline (waking early if an earlier one
+    is scheduled) and hands every due key to a callback, so nothing polls while idle.
+    Rescheduling and cancelling are O(log n) via lazy invalidation: stale heap
+    entries are skipped when they surface.
+    """
+
+    def __init__(self, name="scheduler"):
+        self.name = name
+        self._heap = []
+        self._due = {}          # key -> current due_at
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, key):
+        return key in self._due
+
+    def schedule(self, key, due_at):
+        """Sets (or moves) the deadline for key."""
+        if self._due.get(key) == due_at:
+            return
+        self._due[key] = due_at
+        heapq.heappush(self._heap, (due_at, key))
+        # Stale entries pile up when keys are rescheduled a lot; rebuild occasionally
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(d, k) for k, d in self._due.items()]
+            heapq.heapify(self._heap)
+        if self._wakeup is not None and self._heap[0][1] == key:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        self._due.pop(key, None)
+
+    def next_due(self):
+        """Returns the earliest live deadline, or None."""
+        while self._heap:
+            due_at, key = self._heap[0]
+            if self._due.get(key) == due_at:
+                return due_at
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now=None):
+        """Removes and returns the keys whose deadline has passed."""
+        now = time.time() if now is None else now
+        keys = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, key = heapq.heappop(self._heap)
+            if self._due.get(key) == due_at:
+                del self._due[key]
+                keys.append(key)
+        return keys
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, callback):
+        """Starts the background task; callback is an async function taking a list of due keys."""
+        if not self.is_running():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(callback), name=self.name)
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, callback):
+        while True:
+            self._wakeup.clear()
+            due_at = self.next_due()
+            if due_at is None:
+                await self._wakeup.wait()
+                continue
+            delay = due_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    continue  # An earlier deadline arrived; recompute
+                except asyncio.TimeoutError:
+                    pass
+            keys = self.pop_due()
+            if not keys:
+                continue
+            try:
+                await callback(keys)
+            except Exception as e:
+                logger.error(f"{self.name}: callback failed for {len(keys)} deadline(s): {e}", exc_info=True)
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+import database
+
+class EndOfDayJobTest(unittest.TestCase):
+    """A finished end-of-day job must run again if the day is no longer marked processed."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database.close_connections()
+        database.DB_FILE = os.path.join(self.tmp.name, "test.db")
+        database.init_db()
+        database.update_guild_config(1, attendance_mode='window')
+
+    def tearDown(self):
+        database.close_connections()
+        self.tmp.cleanup()
+
+    def finish(self, day):
+        database.start_eod_job(1, day)
+        database.plan_eod_job(1, day, {}, [(10, 100, 200)])
+        database.finish_eod_job(1, day)
+
+    def test_done_job_stays_done(self):
+        self.finish('2026-10-18')
+        self.assertEqual(database.start_eod_job(1, '2026-10-18')['step'], 'done')
+
+    def test_done_job_restarts_after_processed_date_reset(self):
+        self.finish('2026-10-18')
+        database.update_guild_config(1, last_processed_date=None)
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T21:00:00+08:00")
+
+        self.assertEqual(database.start_eod_job(1, '2026-10-18')['step'], 'plan')
+        self.assertEqual(database.get_eod_job_members(1, '2026-10-18'), [])
+
+        database.plan_eod_job(1, '2026-10-18', {}, [])
+        database.finish_eod_job(1, '2026-10-18')
+        self.assertEqual(database.get_attendance_records(1), {})
+        self.assertEqual(database.get_guild_config(1)['last_processed_date'], '2026-10-18')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+import database
+
+class DailyRollupExpiryTest(unittest.TestCase):
+    """attendance_daily must keep a day's check-in when the session later expires."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database.close_connections()
+        database.DB_FILE = os.path.join(self.tmp.name, "test.db")
+        database.init_db()
+
+    def tearDown(self):
+        database.close_connections()
+        self.tmp.cleanup()
+
+    def test_same_day_expiry_keeps_present(self):
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T08:00:00+08:00")
+        database.apply_record_changes(1, {"10": {"status": "absent", "timestamp": "2026-10-18T20:00:00+08:00"}},
+                                      [], expired=True)
+        self.assertEqual(database.get_daily_rollup(1), {"2026-10-18": {"present": 1}})
+        # The current-status row still moves to absent
+        self.assertEqual(database.get_attendance_records(1)["10"]["status"], "absent")
+
+    def test_expiry_on_unmarked_day_counts_absent(self):
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T22:00:00+08:00")
+        database.apply_record_changes(1, {"10": {"status": "absent", "timestamp": "2026-10-19T10:00:00+08:00"}},
+                                      [], expired=True)
+        self.assertEqual(database.get_daily_rollup(1),
+                         {"2026-10-18": {"present": 1}, "2026-10-19": {"absent": 1}})
+
+    def test_remark_after_expiry_counts_once(self):
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T08:00:00+08:00")
+        database.apply_record_changes(1, {"10": {"status": "absent", "timestamp": "2026-10-18T20:00:00+08:00"}},
+                                      [], expired=True)
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T21:00:00+08:00")
+        self.assertEqual(database.get_daily_rollup(1), {"2026-10-18": {"present": 1}})
+
+    def test_manual_absent_still_overrides(self):
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T08:00:00+08:00")
+        database.add_or_update_record(1, 10, 'absent', "2026-10-18T09:00:00+08:00")
+        self.assertEqual(database.get_daily_rollup(1), {"2026-10-18": {"absent": 1}})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import database
+
+# The schema init_db() created before migrations were versioned (user_version 0)
+BASELINE_SCHEMA = '''
+CREATE TABLE guild_configs (
+    guild_id INTEGER PRIMARY KEY,
+    attendance_role_id INTEGER,
+    absent_role_id INTEGER,
+    excused_role_id INTEGER,
+    welcome_channel_id INTEGER,
+    report_channel_id INTEGER,
+    last_report_message_id INTEGER,
+    last_report_channel_id INTEGER,
+    attendance_mode TEXT DEFAULT 'duration',
+    attendance_expiry_hours INTEGER DEFAULT 12,
+    window_start_time TEXT DEFAULT '08:00',
+    window_end_time TEXT DEFAULT '17:00',
+    last_processed_date TEXT,
+    last_opened_date TEXT,
+    allow_self_marking BOOLEAN DEFAULT 1,
+    require_admin_excuse BOOLEAN DEFAULT 0,
+    auto_nick_on_join BOOLEAN DEFAULT 0,
+    enforce_suffix BOOLEAN DEFAULT 0,
+    remove_suffix_on_role_loss BOOLEAN DEFAULT 0,
+    suffix_format TEXT DEFAULT ' [𝙼𝚂𝚄𝚊𝚗]'
+);
+CREATE TABLE attendance_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER,
+    user_id INTEGER,
+    status TEXT,
+    timestamp TEXT,
+    channel_id INTEGER,
+    reason TEXT,
+    FOREIGN KEY(guild_id) REFERENCES guild_configs(guild_id)
+);
+CREATE INDEX idx_records_guild_user ON attendance_records (guild_id, user_id);
+CREATE INDEX idx_records_guild_date ON attendance_records (guild_id, timestamp);
+'''
+
+class MigrationTest(unittest.TestCase):
+    """init_db() brings fresh and baseline-schema databases to SCHEMA_VERSION without losing data."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database.close_connections()
+        database.config_cache.clear()
+        database.DB_FILE = os.path.join(self.tmp.name, "test.db")
+
+    def tearDown(self):
+        database.close_connections()
+        self.tmp.cleanup()
+
+    def make_baseline(self):
+        conn = sqlite3.connect(database.DB_FILE)
+        conn.executescript(BASELINE_SCHEMA)
+        conn.execute('''INSERT INTO guild_configs (guild_id, attendance_role_id, attendance_expiry_hours, suffix_format)
+                        VALUES (1, 100, 2, ' [X]')''')
+        conn.executemany('''INSERT INTO attendance_records (guild_id, user_id, status, timestamp, channel_id, reason)
+                            VALUES (?, ?, ?, ?, ?, ?)''', [
+            (1, 10, 'absent', "2026-10-17T07:00:00+08:00", 5, None),
+            (1, 10, 'present', "2026-10-17T08:00:00+08:00", 5, None),   # newer duplicate wins
+            (1, 11, 'excused', "2026-10-17T09:00:00+08:00", None, "sick"),
+        ])
+        conn.commit()
+        conn.close()
+
+    def query(self, sql, *params):
+        conn = sqlite3.connect(database.DB_FILE)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def user_version(self):
+        return self.query('PRAGMA user_version')[0][0]
+
+    def columns(self, table):
+        return {row[1] for row in self.query(f'PRAGMA table_info({table})')}
+
+    def tables(self):
+        return {row[0] for row in self.query("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def test_fresh_database(self):
+        database.init_db()
+        database.close_connections()
+        self.assertEqual(self.user_version(), database.SCHEMA_VERSION)
+        self.assertTrue({'guild_configs', 'attendance_records', 'attendance_events', 'attendance_daily',
+                         'eod_jobs', 'eod_job_members'} <= self.tables())
+        self.assertTrue({'marked_at', 'expires_at'} <= self.columns('attendance_records'))
+        unique = {row[1]: row[2] for row in self.query('PRAGMA index_list(attendance_records)')}
+        self.assertEqual(unique.get('idx_records_guild_user'), 1)
+        self.assertIn('idx_records_expires', unique)
+
+    def test_baseline_database_is_upgraded_in_place(self):
+        self.make_baseline()
+        database.init_db()
+        self.assertEqual(database.get_attendance_records(1), {
+            "10": {"status": 'present', "timestamp": "2026-10-17T08:00:00+08:00", "channel_id": 5, "reason": None},
+            "11": {"status": 'excused', "timestamp": "2026-10-17T09:00:00+08:00", "channel_id": None, "reason": "sick"},
+        })
+        config = database.get_guild_config(1)
+        self.assertEqual((config['attendance_role_id'], config['attendance_expiry_hours'], config['suffix_format']),
+                         (100, 2, ' [X]'))
+        # v3 seeds history from the current rows
+        self.assertEqual(database.get_daily_rollup(1), {"2026-10-17": {"present": 1, "excused": 1}})
+        database.close_connections()
+        # v4 backfills the epoch columns using the guild's expiry hours
+        for marked_at, expires_at in self.query('SELECT marked_at, expires_at FROM attendance_records'):
+            self.assertIsNotNone(marked_at)
+            self.assertEqual(expires_at - marked_at, 2 * 3600)
+        self.assertEqual(self.user_version(), database.SCHEMA_VERSION)
+
+    def test_user_version_after_each_step(self):
+        self.make_baseline()
+        for count, (version, _) in enumerate(database.MIGRATIONS, start=1):
+            with mock.patch.object(database, 'MIGRATIONS', database.MIGRATIONS[:count]):
+                database.init_db()
+            database.close_connections()
+            self.assertEqual(self.user_version(), version)
+        self.assertEqual(len(self.query('SELECT * FROM attendance_records')), 2)
+
+    def test_rerun_at_current_version_is_a_no_op(self):
+        self.make_baseline()
+        database.init_db()
+        database.close_connections()
+        before = (self.query('SELECT * FROM attendance_records ORDER BY id'),
+                  self.query('SELECT * FROM attendance_events ORDER BY id'))
+        def rerun(c):
+            raise AssertionError("a migration ran again")
+        with mock.patch.object(database, 'MIGRATIONS', [(version, rerun) for version, _ in database.MIGRATIONS]):
+            database.init_db()
+        database.close_connections()
+        self.assertEqual((self.query('SELECT * FROM attendance_records ORDER BY id'),
+                          self.query('SELECT * FROM attendance_events ORDER BY id')), before)
+        self.assertEqual(self.user_version(), database.SCHEMA_VERSION)
+
+    def test_role_gate_columns(self):
+        """v6 adds allowed_role_id / ping_role_id to existing configs, unset, and they persist."""
+        self.make_baseline()
+        with mock.patch.object(database, 'MIGRATIONS', database.MIGRATIONS[:5]):
+            database.init_db()
+        self.assertNotIn('allowed_role_id', self.columns('guild_configs'))
+        database.close_connections()
+        database.config_cache.clear()
+
+        database.init_db()
+        config = database.get_guild_config(1)
+        self.assertEqual((config['allowed_role_id'], config['ping_role_id']), (None, None))
+        self.assertEqual(config['attendance_role_id'], 100)
+
+        database.update_guild_config(1, allowed_role_id=200, ping_role_id=300)
+        database.close_connections()
+        database.config_cache.clear()
+        config = database.get_guild_config(1)
+        self.assertEqual((config['allowed_role_id'], config['ping_role_id']), (200, 300))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+
+import role_engine
+from benchmarks.fakes import FakeGuild
+
+class ApplyRoleChangesTest(unittest.TestCase):
+    """Edits apply only the planned deltas, and only successful members are checkpointed."""
+
+    def setUp(self):
+        self.guild = FakeGuild(1)
+        self.member = self.guild.members[0]
+
+    def run_jobs(self, jobs, between=None):
+        async def progress(done, total, eta):
+            # The first report is sent after planning and before any edit
+            if done == 0 and between is not None:
+                between()
+        return asyncio.run(role_engine.apply_role_changes(self.guild, jobs, progress=progress))
+
+    def test_keeps_role_added_after_planning(self):
+        result = self.run_jobs([(self.member, self.guild.present_role, True)],
+                               between=lambda: self.member.roles.append(self.guild.excused_role))
+        self.assertEqual(result.changed, 1)
+        self.assertIn(self.guild.present_role, self.member.roles)
+        self.assertIn(self.guild.excused_role, self.member.roles)
+
+    def test_keeps_removal_made_after_planning(self):
+        self.member.roles.append(self.guild.absent_role)
+        self.run_jobs([(self.member, self.guild.present_role, True)],
+                      between=lambda: self.member.roles.remove(self.guild.absent_role))
+        self.assertNotIn(self.guild.absent_role, self.member.roles)
+        self.assertIn(self.guild.present_role, self.member.roles)
+
+    def test_skips_edit_when_already_applied(self):
+        result = self.run_jobs([(self.member, self.guild.present_role, True)],
+                               between=lambda: self.member.roles.append(self.guild.present_role))
+        self.assertEqual((result.changed, result.unchanged), (0, 1))
+        self.assertEqual(self.guild.http.calls["PATCH /guilds/{guild_id}/members/{user_id}"], 0)
+
+    def test_failed_edit_is_not_reported_done(self):
+        ok = self.guild.add_member("ok")
+        async def broken_edit(**kwargs):
+            raise RuntimeError("503 Service Unavailable")
+        self.member.edit = broken_edit
+        finished = []
+        async def on_done(members):
+            finished.extend(members)
+        jobs = [(self.member, self.guild.present_role, True), (ok, self.guild.present_role, True)]
+        result = asyncio.run(role_engine.apply_role_changes(self.guild, jobs, on_done=on_done))
+        self.assertEqual((result.changed, result.failed), (1, 1))
+        self.assertEqual(finished, [ok])
+
+if __name__ == '__main__':
+    unittest.main()
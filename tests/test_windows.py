@@ -0,0 +1,81 @@
+import datetime
+import unittest
+
+from windows import PH_TZ, WindowSchedule
+
+def ph(day, hour, minute=0):
+    return datetime.datetime(2026, 10, day, hour, minute, tzinfo=PH_TZ)
+
+class SameDayWindowTest(unittest.TestCase):
+    """08:00-17:00: each session opens and closes on the same day."""
+
+    def setUp(self):
+        self.window = WindowSchedule.compile("08:00", "17:00")
+
+    def test_open_and_close_are_half_open(self):
+        self.assertFalse(self.window.is_open(ph(18, 7, 59)))
+        self.assertTrue(self.window.is_open(ph(18, 8)))
+        self.assertTrue(self.window.is_open(ph(18, 16, 59)))
+        self.assertFalse(self.window.is_open(ph(18, 17)))
+
+    def test_session_days(self):
+        self.assertEqual(self.window.current_session_day(ph(18, 8)), "2026-10-18")
+        # Before today's close, the last closed session is yesterday's
+        self.assertEqual(self.window.last_closed_session_day(ph(18, 8)), "2026-10-17")
+        self.assertEqual(self.window.last_closed_session_day(ph(18, 17)), "2026-10-18")
+        self.assertEqual(self.window.last_closed_session_day(ph(18, 23, 59)), "2026-10-18")
+
+    def test_midnight(self):
+        self.assertFalse(self.window.is_open(ph(19, 0)))
+        self.assertEqual(self.window.last_closed_session_day(ph(19, 0)), "2026-10-18")
+
+    def test_next_transition(self):
+        self.assertEqual(self.window.next_transition(ph(18, 7)), ph(18, 8))
+        self.assertEqual(self.window.next_transition(ph(18, 8)), ph(18, 17))
+        self.assertEqual(self.window.next_transition(ph(18, 17)), ph(19, 8))
+
+class OvernightWindowTest(unittest.TestCase):
+    """22:00-06:00: a session runs past midnight and counts toward the day it opened."""
+
+    def setUp(self):
+        self.window = WindowSchedule.compile("22:00", "06:00")
+
+    def test_open_across_midnight(self):
+        self.assertTrue(self.window.overnight)
+        self.assertFalse(self.window.is_open(ph(17, 21, 59)))
+        self.assertTrue(self.window.is_open(ph(17, 22)))
+        self.assertTrue(self.window.is_open(ph(18, 0)))
+        self.assertTrue(self.window.is_open(ph(18, 5, 59)))
+        self.assertFalse(self.window.is_open(ph(18, 6)))
+
+    def test_session_belongs_to_opening_day(self):
+        self.assertEqual(self.window.current_session_day(ph(17, 22)), "2026-10-17")
+        self.assertEqual(self.window.current_session_day(ph(18, 0)), "2026-10-17")
+        self.assertEqual(self.window.current_session_day(ph(18, 5, 59)), "2026-10-17")
+
+    def test_last_closed_session(self):
+        # While the 17th's session is open, the last closed one is the 16th's
+        self.assertEqual(self.window.last_closed_session_day(ph(17, 22)), "2026-10-16")
+        self.assertEqual(self.window.last_closed_session_day(ph(18, 0)), "2026-10-16")
+        # From 06:00 on the 18th, the 17th's session is closed
+        self.assertEqual(self.window.last_closed_session_day(ph(18, 6)), "2026-10-17")
+        self.assertEqual(self.window.last_closed_session_day(ph(18, 21, 59)), "2026-10-17")
+
+    def test_next_transition(self):
+        self.assertEqual(self.window.next_transition(ph(17, 23)), ph(18, 6))
+        self.assertEqual(self.window.next_transition(ph(18, 6)), ph(18, 22))
+
+    def test_other_timezones_are_converted(self):
+        utc = datetime.datetime(2026, 10, 17, 14, 0, tzinfo=datetime.timezone.utc)  # 22:00 PH
+        self.assertTrue(self.window.is_open(utc))
+        self.assertEqual(self.window.current_session_day(utc), "2026-10-17")
+
+class AllDayWindowTest(unittest.TestCase):
+    def test_equal_start_and_end_never_closes(self):
+        window = WindowSchedule.compile("08:00", "08:00")
+        self.assertTrue(window.is_open(ph(18, 7, 59)))
+        self.assertTrue(window.is_open(ph(18, 8)))
+        self.assertEqual(window.duration, datetime.timedelta(hours=24))
+
+if __name__ == '__main__':
+    unittest.main()
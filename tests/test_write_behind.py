@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import database
+
+class WriteBehindReadTest(unittest.TestCase):
+    """Reads must see journaled writes whether or not a flush lands mid-read."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database.close_connections()
+        database.DB_FILE = os.path.join(self.tmp.name, "test.db")
+        database.init_db()
+        self.previous_journal = database.journal
+        # No background flushes: the test decides when the journal commits
+        database.journal = database.WriteBehindJournal(max_lag_ms=60_000, max_batch=1_000_000)
+
+    def tearDown(self):
+        database.journal.stop()
+        database.journal = self.previous_journal
+        database.close_connections()
+        self.tmp.cleanup()
+
+    def test_pending_write_is_overlaid(self):
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T08:00:00+08:00")
+        self.assertEqual(database.get_attendance_records(1)["10"]["status"], 'present')
+
+    def test_flush_between_select_and_overlay(self):
+        journal = database.journal
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T08:00:00+08:00")
+        overlay = journal.overlay
+
+        def flush_then_overlay(guild_id, records):
+            # The SELECT has already run without the row; now it is committed and pruned
+            journal.flush()
+            return overlay(guild_id, records)
+        journal.overlay = flush_then_overlay
+
+        self.assertEqual(database.get_attendance_records(1)["10"]["status"], 'present')
+        journal.overlay = overlay
+        # Once no read needs it, the committed entry leaves the overlay
+        self.assertEqual(journal.overlay(1, {}), {})
+        self.assertEqual(database.get_attendance_records(1)["10"]["status"], 'present')
+
+    def test_clear_flushed_mid_read(self):
+        journal = database.journal
+        database.add_or_update_record(1, 10, 'present', "2026-10-18T08:00:00+08:00")
+        journal.flush()
+        database.clear_attendance_records(1)
+        overlay = journal.overlay
+
+        def flush_then_overlay(guild_id, records):
+            journal.flush()
+            return overlay(guild_id, records)
+        journal.overlay = flush_then_overlay
+
+        self.assertEqual(database.get_attendance_records(1), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import datetime
+
+# Attendance windows are always expressed in Philippines Time
+PH_TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+DAY = datetime.timedelta(days=1)
+
+class WindowSchedule:
+    """
+    A daily attendance window compiled once from its "HH:MM" start/end strings.
+    The window is open on [start, end) in UTC+8. When end <= start it runs
+    overnight (e.g. 22:00-06:00) and belongs to the day it opened on.
+    """
+
+    __slots__ = ("start", "end", "overnight", "duration", "message")
+
+    def __init__(self, start, end):
+        self.start = start              # datetime.time
+        self.end = end
+        self.overnight = end <= start
+        start_s = start.hour * 3600 + start.minute * 60
+        end_s = end.hour * 3600 + end.minute * 60
+        # A window with start == end never closes (24 hours)
+        self.duration = datetime.timedelta(seconds=(end_s - start_s) % 86400 or 86400)
+        # Convert to 12-hour format for display
+        display_start = start.strftime("%I:%M %p").lstrip('0')
+        display_end = end.strftime("%I:%M %p").lstrip('0')
+        self.message = f"Attendance is only allowed between {display_start} and {display_end}."
+
+    @classmethod
+    def compile(cls, start_str, end_str):
+        """Parses "HH:MM" strings; raises ValueError if either is malformed."""
+        start = datetime.datetime.strptime(start_str, "%H:%M").time()
+        end = datetime.datetime.strptime(end_str, "%H:%M").time()
+        return cls(start, end)
+
+    @staticmethod
+    def now():
+        return datetime.datetime.now(PH_TZ)
+
+    def _at(self, now, t, days=0):
+        return datetime.datetime.combine(now.date(), t, tzinfo=PH_TZ) + days * DAY
+
+    def is_open(self, now=None):
+        t = (now or self.now()).astimezone(PH_TZ).time()
+        if self.start == self.end:
+            return True
+        if not self.overnight:
+            return self.start <= t < self.end
+        return t >= self.start or t < self.end
+
+    def next_open(self, now=None):
+        """The next instant (strictly after now) the window opens."""
+        now = (now or self.now()).astimezone(PH_TZ)
+        opens = self._at(now, self.start)
+        return opens if opens > now else opens + DAY
+
+    def next_close(self, now=None):
+        """The next instant (strictly after now) the window closes."""
+        now = (now or self.now()).astimezone(PH_TZ)
+        closes = self._at(now, self.end)
+        return closes if closes > now else closes + DAY
+
+    def next_transition(self, now=None):
+        now = now or self.now()
+        return min(self.next_open(now), self.next_close(now))
+
+    def current_session_day(self, now=None):
+        """YYYY-MM-DD of the session open at `now` (the day it opened)."""
+        now = (now or self.now()).astimezone(PH_TZ)
+        opened = self._at(now, self.start)
+        if opened > now:
+            opened -= DAY
+        return opened.strftime("%Y-%m-%d")
+
+    def last_closed_session_day(self, now=None):
+        """YYYY-MM-DD of the most recent session that has already closed."""
+        now = (now or self.now()).astimezone(PH_TZ)
+        closed = self._at(now, self.end)
+        if closed > now:
+            closed -= DAY
+        return (closed - self.duration).strftime("%Y-%m-%d")